@@ -0,0 +1,2 @@
+from . import index
+from .index import benchmark_index, compare_reports, load_report
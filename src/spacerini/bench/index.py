@@ -0,0 +1,255 @@
+import csv
+import inspect
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List, Literal, TypedDict, Union
+
+logger = logging.getLogger(__name__)
+
+IndexMethod = Literal["streaming", "json_shards"]
+
+DEFAULT_MATRIX = {
+    "n_threads": [1, 4],
+    "memory_buffer": ["512", "4096"],
+    "storePositions": [True],
+    "storeDocvectors": [False],
+    "storeRaw": [False, True],
+    "optimize": [True],
+    "pretokenized": [False],
+}
+
+
+class IndexBenchmarkResult(TypedDict):
+    method: str
+    config: Dict[str, Any]
+    num_docs: int
+    wall_time: float
+    docs_per_sec: float
+    peak_rss_mb: float
+    index_size_mb: float
+
+
+def generate_corpus(path: str, num_docs: int, doc_length: int = 200, vocab_size: int = 50000, seed: int = 0) -> str:
+    """
+    Write a synthetic JSONL corpus with Zipf-like term frequencies
+    Parameters
+    ----------
+    path : str
+        Path of the JSONL file to write
+    num_docs : int
+        Number of documents
+    doc_length : int
+        Number of terms per document
+    vocab_size : int
+        Number of distinct terms
+    seed : int
+        Random seed
+
+    Returns
+    -------
+    str
+        Path to the corpus
+    """
+    rng = random.Random(seed)
+    vocab = [f"term{i}" for i in range(vocab_size)]
+    weights = [1 / (rank + 1) for rank in range(vocab_size)]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        for i in range(num_docs):
+            contents = " ".join(rng.choices(vocab, weights=weights, k=doc_length))
+            f.write(json.dumps({"id": f"doc{i}", "contents": contents}) + "\n")
+    return path
+
+
+def expand_matrix(matrix: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """
+    Expand a mapping of argument name to candidate values into every combination of values
+    """
+    keys = list(matrix)
+    return [dict(zip(keys, values)) for values in itertools.product(*[matrix[key] for key in keys])]
+
+
+def _run_config(method: IndexMethod, corpus_path: str, index_path: str, config: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Build one index and measure it. Runs in a fresh process, so that peak RSS only covers this build.
+    """
+    from spacerini.index import fetch_index_stats, index_json_shards, index_streaming_dataset
+    from spacerini.index.utils import directory_size
+
+    if method == "streaming":
+        func = index_streaming_dataset
+        kwargs = dict(
+            index_path=index_path,
+            dataset_name_or_path=corpus_path,
+            split="train",
+            column_to_index=["contents"],
+            doc_id_column="id",
+            disable_tqdm=True,
+        )
+    else:
+        func = index_json_shards
+        kwargs = dict(shards_path=os.path.dirname(corpus_path), index_path=index_path, quiet=True)
+
+    accepted = inspect.signature(func).parameters
+    kwargs.update({k: v for k, v in config.items() if k in accepted})
+
+    start_time = time.perf_counter()
+    func(**kwargs)
+    wall_time = time.perf_counter() - start_time
+
+    return {
+        "num_docs": fetch_index_stats(index_path)["documents"],
+        "wall_time": wall_time,
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "index_size_mb": directory_size(index_path) / 2**20,
+    }
+
+
+def benchmark_index(
+    corpus_path: str = None,
+    num_docs: int = 10000,
+    matrix: Dict[str, List[Any]] = None,
+    methods: List[IndexMethod] = None,
+    output_path: str = "bench-index.json",
+    work_dir: str = None,
+) -> List[IndexBenchmarkResult]:
+    """
+    Sweep a matrix of indexing configurations and report throughput, memory and index size for each
+    Parameters
+    ----------
+    corpus_path : str
+        Path to a JSONL corpus with `id` and `contents` fields. If None, a synthetic corpus is generated.
+    num_docs : int
+        Number of documents in the synthetic corpus
+    matrix : Dict[str, List[Any]]
+        Candidate values for each indexing argument. Defaults to `DEFAULT_MATRIX`.
+    methods : List[str]
+        Indexing functions to benchmark: `streaming` (`index_streaming_dataset`) and/or `json_shards` (`index_json_shards`)
+    output_path : str
+        Path of the report. Written as CSV if it ends with `.csv`, as JSON otherwise.
+    work_dir : str
+        Directory for the corpus and indexes. A temporary directory is used and removed if None.
+
+    Returns
+    -------
+    List[IndexBenchmarkResult]
+    """
+    matrix = matrix or DEFAULT_MATRIX
+    methods = methods or ["streaming", "json_shards"]
+    cleanup = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="spacerini-bench-")
+
+    # index_json_shards indexes every file in a directory, so the corpus gets a directory of its own
+    bench_corpus_path = os.path.join(work_dir, "corpus", "docs-000.jsonl")
+    if corpus_path is None:
+        generate_corpus(bench_corpus_path, num_docs)
+    else:
+        os.makedirs(os.path.dirname(bench_corpus_path), exist_ok=True)
+        shutil.copyfile(corpus_path, bench_corpus_path)
+
+    results = []
+    for method, config in itertools.product(methods, expand_matrix(matrix)):
+        index_path = os.path.join(work_dir, "index")
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            metrics = executor.submit(_run_config, method, bench_corpus_path, index_path, config).result()
+        shutil.rmtree(index_path, ignore_errors=True)
+
+        result = IndexBenchmarkResult(
+            method=method,
+            config=config,
+            docs_per_sec=metrics["num_docs"] / max(metrics["wall_time"], 1e-9),
+            **metrics
+        )
+        logger.info(f"{method} {config}: {result['docs_per_sec']:.1f} docs/sec, {result['peak_rss_mb']:.0f} MB peak RSS")
+        results.append(result)
+
+    if cleanup:
+        shutil.rmtree(work_dir)
+    write_report(results, output_path)
+    return results
+
+
+def write_report(results: List[IndexBenchmarkResult], output_path: str) -> None:
+    """
+    Write benchmark results as CSV if `output_path` ends with `.csv`, and as JSON otherwise
+    """
+    if output_path.endswith(".csv"):
+        config_keys = sorted({key for result in results for key in result["config"]})
+        with open(output_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            metric_keys = [key for key in IndexBenchmarkResult.__annotations__ if key not in ["method", "config"]]
+            writer.writerow(["method", *config_keys, *metric_keys])
+            for result in results:
+                writer.writerow([
+                    result["method"],
+                    *[result["config"].get(key) for key in config_keys],
+                    *[result[key] for key in metric_keys]
+                ])
+    else:
+        with open(output_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def compare_reports(
+    baseline: Union[str, List[IndexBenchmarkResult]],
+    candidate: Union[str, List[IndexBenchmarkResult]],
+    tolerance: float = 0.1,
+) -> List[Dict[str, Any]]:
+    """
+    Compare two benchmark reports configuration by configuration
+    Parameters
+    ----------
+    baseline : str or List[IndexBenchmarkResult]
+        The reference results, or the path to a JSON report of them
+    candidate : str or List[IndexBenchmarkResult]
+        The results to check, or the path to a JSON report of them
+    tolerance : float
+        Relative change beyond which a configuration is flagged as a regression
+
+    Returns
+    -------
+    List of dictionaries with the ratio of candidate to baseline for each metric, and a `regression` flag
+    """
+    baseline = {(r["method"], json.dumps(r["config"], sort_keys=True)): r for r in load_report(baseline)}
+    candidate = load_report(candidate)
+
+    comparisons = []
+    for result in candidate:
+        reference = baseline.get((result["method"], json.dumps(result["config"], sort_keys=True)))
+        if reference is None:
+            continue
+        ratios = {
+            key: result[key] / reference[key] if reference[key] else float("nan")
+            for key in ["docs_per_sec", "wall_time", "peak_rss_mb", "index_size_mb"]
+        }
+        comparisons.append({
+            "method": result["method"],
+            "config": result["config"],
+            **ratios,
+            "regression": ratios["docs_per_sec"] < 1 - tolerance
+            or ratios["peak_rss_mb"] > 1 + tolerance
+            or ratios["index_size_mb"] > 1 + tolerance,
+        })
+    return comparisons
+
+
+def load_report(report: Union[str, List[IndexBenchmarkResult]]) -> List[IndexBenchmarkResult]:
+    """
+    Read a JSON benchmark report. Results already in memory are returned as is.
+    """
+    if not isinstance(report, str):
+        return report
+    if report.endswith(".csv"):
+        raise ValueError(f"Cannot compare {report}: CSV reports lose the types of configuration values, use a JSON report")
+    with open(report) as f:
+        return json.load(f)
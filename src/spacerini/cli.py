@@ -4,10 +4,14 @@ import logging
 from pathlib import Path
 from shutil import copytree
 
+from spacerini.bench import benchmark_index, compare_reports, load_report
 from spacerini.frontend import create_app, create_space_from_local
 from spacerini.index import index_streaming_dataset
-from spacerini.index.encode import encode_json_dataset
+from spacerini.index.encode import encode_dataset
+from spacerini.search import build_query_cache, query_encoder_class
 from spacerini.prebuilt import EXAMPLES
+from spacerini.spacerini_utils.cache import QUERY_WARM_FILENAME
+from spacerini.spacerini_utils.onnx_encoder import ONNX_ENCODER_CLASSES
 
 
 def update_args_from_json(_args: argparse.Namespace, file: str) -> argparse.Namespace:
@@ -43,6 +47,13 @@ def get_args() -> argparse.Namespace:
     deploy_only_parser = sub_parser.add_parser("deploy-only", help="Deploy an already created space")
     deploy_parser = sub_parser.add_parser("deploy", help="Deploy new space.")
     deploy_parser.add_argument("--delete-after", type=bool, default=False, help="If True, delete the local directory after pushing it to the Hub.")
+    bench_parser = sub_parser.add_parser("bench", help="Benchmark indexing configurations.")
+    bench_parser.add_argument("target", choices=["index"], help="What to benchmark")
+    bench_parser.add_argument("--bench-corpus", type=str, help="JSONL corpus with `id` and `contents` fields. If not set, a synthetic corpus is generated.")
+    bench_parser.add_argument("--bench-num-docs", type=int, default=10000, help="Number of documents in the synthetic corpus")
+    bench_parser.add_argument("--bench-matrix", type=str, help="JSON file mapping indexing arguments to lists of values to sweep")
+    bench_parser.add_argument("--bench-output", type=str, default="bench-index.json", help="Report path. Written as CSV if it ends with .csv")
+    bench_parser.add_argument("--bench-baseline", type=str, help="JSON report to compare the new report against")
     # --------
 
     space_args = parser.add_argument_group("Space arguments")
@@ -68,6 +79,7 @@ def get_args() -> argparse.Namespace:
     sparse_index_args.add_argument("--collection", type=str, help="Collection class")
     sparse_index_args.add_argument("--memory-buffer", type=str, help="Memory buffer size")
     sparse_index_args.add_argument("--threads", type=int, default=5, help="Number of threads to use for indexing")
+    sparse_index_args.add_argument("--auto-resources", action="store_true", help="If True, choose threads and memory buffer from the dataset size and host capacity")
     sparse_index_args.add_argument("--hf-tokenizer", type=str, default=None, help="HuggingFace tokenizer to tokenize dataset")
     sparse_index_args.add_argument("--pretokenized", type=bool, default=False, help="If True, dataset is already tokenized")
     sparse_index_args.add_argument("--store-positions", action="store_true", help="If True, store document vectors in index")     # TODO: @theyorubayesian
@@ -87,15 +99,24 @@ def get_args() -> argparse.Namespace:
     dense_index_args.add_argument("--n-index-shards", type=int, default=1, help="Number of index shards")
     dense_index_args.add_argument("--batch-size", default=64, type=int, help="Batch size for encoding")
     dense_index_args.add_argument("--max-length", type=int, default=256, help="Max document length to encode")
-    dense_index_args.add_argument('--device', default='cuda:0', type=str, help='Device: cpu or cuda [cuda:0, cuda:1...]', required=False)
+    dense_index_args.add_argument("--max-tokens", type=int, help="Token budget of an encoding batch. If set, documents are batched by length")
+    dense_index_args.add_argument("--sort-window", type=int, default=64, help="Number of batches sorted by length together when `--max-tokens` is set")
+    dense_index_args.add_argument("--encode-num-proc", type=int, default=1, help="Number of processes encoding shards of the corpus in parallel")
+    dense_index_args.add_argument("--embedding-cache-dir", type=str, help="Directory of a persistent embedding cache. Unchanged documents are not re-encoded")
+    dense_index_args.add_argument("--pipeline-threads", type=int, default=0, help="Number of threads reading and tokenizing documents ahead of the encoder")
+    dense_index_args.add_argument('--device', default=None, type=str, help='Device: cpu or cuda [cuda:0, cuda:1...]. Defaults to cuda:0 if available, else cpu', required=False)
+    dense_index_args.add_argument("--backend", default="torch", type=str, choices=["torch", "onnx"], help="Run the encoder with PyTorch, or as an int8-quantized ONNX model on CPU")
     dense_index_args.add_argument("--dimension", default=768, type=int, help="Dimension for Faiss Index")
     dense_index_args.add_argument("--add-sep", action="store_true", help="Pass `title` and `content` columns separately into encode function")
     dense_index_args.add_argument("--to-faiss", action="store_true", help="Store embeddings in Faiss Index")
+    dense_index_args.add_argument("--faiss-index-type", default="flat", type=str, choices=["flat", "hnsw", "ivf_flat", "ivf_pq", "sq8", "fp16"], help="Type of Faiss Index")
     dense_index_args.add_argument("--fp16", action="store_true", help="Use FP 16")
 
     search_args = parser.add_argument_group("Search arguments")
     search_args.add_argument("--bm25_k1", type=float, help="BM25: k1 parameter")
     search_args.add_argument("--bm24_b", type=float, help="BM25: b parameter")
+    search_args.add_argument("--query-log", type=str, help="Query log whose most frequent queries are pre-encoded into the app's query embedding cache")
+    search_args.add_argument("--query-cache-size", type=int, default=4096, help="Number of queries pre-encoded from `--query-log`")
 
     args, _ = parser.parse_known_args()
 
@@ -108,6 +129,9 @@ def get_args() -> argparse.Namespace:
     if args.config_file:
         args = update_args_from_json(args, args.config_file)
 
+    if args.backend == "onnx" and query_encoder_class(args.encoder_class) not in ONNX_ENCODER_CLASSES:
+        parser.error(f"--backend onnx does not support --encoder-class {args.encoder_class}")
+
     args.template = "templates/gradio_roots_temp"
     return args
 
@@ -115,6 +139,21 @@ def get_args() -> argparse.Namespace:
 def main():
     args = get_args()
 
+    if args.command == "bench":
+        matrix = json.load(open(args.bench_matrix, "r")) if args.bench_matrix else None
+        # Read the baseline first, so that an unusable one fails before the benchmark runs
+        baseline = load_report(args.bench_baseline) if args.bench_baseline else None
+        results = benchmark_index(
+            corpus_path=args.bench_corpus,
+            num_docs=args.bench_num_docs,
+            matrix=matrix,
+            output_path=args.bench_output
+        )
+        if args.bench_baseline:
+            for comparison in compare_reports(baseline, results):
+                print(json.dumps(comparison))
+        return
+
     local_app_dir = Path(f"apps/{args.space_name}")
     local_app_dir.mkdir(exist_ok=True)
 
@@ -141,12 +180,17 @@ def main():
                 language=args.language,
                 storeContents=args.store_contents,
                 storeRaw=args.store_raw,
-                analyzeWithHuggingFaceTokenizer=args.hf_tokenizer
+                analyzeWithHuggingFaceTokenizer=args.hf_tokenizer,
+                memory_buffer=args.memory_buffer or "4096",
+                n_threads=args.threads,
+                auto_resources=args.auto_resources
             )
 
             if args.encoder_name_or_path:
-                encode_json_dataset(
-                    data_path=args.dataset,
+                encode_dataset(
+                    dataset_name_or_path=args.dataset,
+                    split=args.split,
+                    doc_id_column=args.docid_column,
                     encoder_name_or_path=args.encoder_name_or_path,
                     encoder_class=args.encoder_class,
                     embedding_dir=(local_app_dir / "dense_index").as_posix(),
@@ -154,7 +198,6 @@ def main():
                     device=args.device,
                     index_shard_id=args.index_shard_id,
                     num_index_shards=args.n_index_shards,
-                    delimiter=args.delimiter,
                     max_length=args.max_length,
                     add_sep=args.add_sep,
                     title_column_to_encode=args.title_column,
@@ -162,8 +205,25 @@ def main():
                     expand_column_to_encode=args.expand_column,
                     output_to_faiss=True,
                     embedding_dimension=args.dimension,
-                    fp16=args.fp16
+                    fp16=args.fp16,
+                    max_tokens=args.max_tokens,
+                    sort_window=args.sort_window,
+                    num_proc=args.encode_num_proc,
+                    cache_dir=args.embedding_cache_dir,
+                    faiss_index_type=args.faiss_index_type,
+                    pipeline_threads=args.pipeline_threads,
+                    backend=args.backend
                 )
+                if args.query_log:
+                    build_query_cache(
+                        query_log_path=args.query_log,
+                        output_path=(local_app_dir / "dense_index" / QUERY_WARM_FILENAME).as_posix(),
+                        encoder_name_or_path=args.encoder_name_or_path,
+                        encoder_class=query_encoder_class(args.encoder_class),
+                        device=args.device,
+                        query_encoder_backend=args.backend,
+                        max_queries=args.query_cache_size,
+                    )
     
     if args.command in ["create-space", "deploy"]:
         logging.info(f"Creating local app into {args.space_name} directory")
@@ -173,7 +233,10 @@ def main():
             "space_title": args.space_title, 
             "local_app": args.space_name,
             "space_description": args.description, 
-            "dataset_name": args.dataset
+            "dataset_name": args.dataset,
+            "encoder_name_or_path": args.encoder_name_or_path or "",
+            "encoder_class": query_encoder_class(args.encoder_class),
+            "query_encoder_backend": args.backend,
         }
 
         create_app(
@@ -1,2 +1,2 @@
 from . import load, utils
-from .load import load_from_hub, load_from_pandas, load_ir_dataset, load_ir_dataset_low_memory, load_ir_dataset_streaming, load_from_local, load_from_sqlite_table
\ No newline at end of file
+from .load import load_from_hub, load_from_pandas, load_ir_dataset, load_ir_dataset_low_memory, load_ir_dataset_streaming, load_from_local, load_from_sqlite_table, load_dataset_source
\ No newline at end of file
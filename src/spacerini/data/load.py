@@ -3,7 +3,7 @@ from datasets import Dataset, IterableDataset
 from datasets import load_dataset
 import pandas as pd
 import ir_datasets
-from typing import Generator, Dict, List
+from typing import Generator, Dict, List, Union
 
 def ir_dataset_dict_generator(dataset_name: str) -> Generator[Dict,None,None]:
     """
@@ -146,3 +146,35 @@ def load_from_sqlite_table(uri_or_con: str, table_or_query: str) -> Dataset:
     Dataset
     """
     return Dataset.from_sql(con=uri_or_con, sql=table_or_query)
+
+def load_dataset_source(dataset_name_or_path: str, split: str = "train", config_name: str = None, streaming: bool = True) -> Union[Dataset, IterableDataset]:
+    """
+    Load a dataset from any supported source:
+    `ir_datasets:<name>` loads the documents of an ir_datasets dataset, with `docid` and `contents` columns.
+    `sqlite:///<path>` loads the result of `config_name`, a table name or query, from a SQLite database.
+    A local path loads a JSON, JSONL, CSV or TSV file, and anything else a HuggingFace Hub dataset.
+
+    Parameters
+    ----------
+    dataset_name_or_path : str
+        Source of the dataset
+    split : str
+        Split of dataset to load. Ignored for ir_datasets and SQLite sources.
+    config_name : str
+        Dataset configuration, or table or query for SQLite sources
+    streaming : bool
+        Whether to load dataset in streaming mode. SQLite sources are always loaded as a Dataset.
+
+    Returns
+    -------
+    Dataset or IterableDataset
+    """
+    if dataset_name_or_path.startswith("ir_datasets:"):
+        name = dataset_name_or_path[len("ir_datasets:"):]
+        return load_ir_dataset_streaming(name) if streaming else load_ir_dataset(name)
+    if dataset_name_or_path.startswith("sqlite:"):
+        assert config_name, "Loading from SQLite requires a table or query as `config_name`"
+        return load_from_sqlite_table(dataset_name_or_path, config_name)
+    if os.path.exists(dataset_name_or_path):
+        return load_from_local(dataset_name_or_path, split=split, streaming=streaming)
+    return load_from_hub(dataset_name_or_path, split=split, config_name=config_name, streaming=streaming)
@@ -0,0 +1,58 @@
+import queue
+import threading
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+_SENTINEL = object()
+
+
+def prefetch(iterable: Iterable[T], max_prefetch: int = 2) -> Iterator[T]:
+    """
+    Iterate over `iterable` in a background thread, keeping at most `max_prefetch` items ready.
+    This lets the consumer work on one item while the next ones are being produced.
+
+    Parameters
+    ----------
+    iterable : Iterable
+        The iterable to consume in the background
+    max_prefetch : int
+        Maximum number of items buffered between producer and consumer
+
+    Returns
+    -------
+    Iterator
+        Items of `iterable`, in order. Exceptions raised by the producer are re-raised here.
+    """
+    buffer = queue.Queue(maxsize=max(max_prefetch, 1))
+    stop = threading.Event()
+
+    def _produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                buffer.put(item)
+        except BaseException as ex:
+            buffer.put(ex)
+        finally:
+            buffer.put(_SENTINEL)
+
+    producer = threading.Thread(target=_produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _SENTINEL:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Unblock the producer if it is waiting on a full buffer
+        while producer.is_alive():
+            try:
+                buffer.get_nowait()
+            except queue.Empty:
+                producer.join(timeout=0.1)
@@ -1,5 +1,9 @@
 from . import index
-from .encode import encode_json_dataset
-from .index import index_json_shards, index_streaming_dataset
-from .index import fetch_index_stats
+from .embedding_cache import EmbeddingCache
+from .embedding_store import EmbeddingStore, EmbeddingStoreWriter
+from .encode import encode_dataset, encode_json_dataset
+from .index import index_dataset_pipelined, index_json_shards, index_streaming_dataset
+from .index import fetch_index_stats, merge_indexes
+from .manifest import read_index_manifest, write_index_manifest
+from .update import update_index
 from .utils import push_index_to_hub, load_index_from_hub
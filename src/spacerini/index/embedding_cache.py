@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+from datasets.utils.py_utils import convert_file_size_to_int
+
+
+def cache_namespace(
+    encoder_name_or_path: str,
+    encoder_revision: str = None,
+    max_length: int = 256,
+    add_sep: bool = False,
+    backend: str = "torch",
+    encoder_class: str = None,
+    pooling: str = None,
+    l2_norm: bool = None,
+    fp16: bool = False,
+) -> str:
+    """
+    Name of the cache partition holding embeddings computed with the given encoder settings.
+    Embeddings computed with different settings are never mixed. Encoder classes loading the same
+    checkpoint can pool and normalize differently, and fp16 changes the embeddings too.
+    """
+    settings = [encoder_name_or_path, encoder_revision, max_length, add_sep, backend]
+    if encoder_class is not None:
+        settings.append([encoder_class, pooling, l2_norm, fp16])
+    return hashlib.sha1(json.dumps(settings).encode("utf-8")).hexdigest()[:16]
+
+
+def document_key(text: str, title: str = None, expand: str = None) -> str:
+    """
+    Hash the encoded fields of a document
+    """
+    return hashlib.sha1("\x1f".join([title or "", text, expand or ""]).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed store of document embeddings.
+
+    Vectors live in a memory-mapped float32 file with a fixed number of slots, and a SQLite
+    database maps each document key to its slot and last use. Once every slot is taken,
+    the least recently used embeddings are evicted. All reads and writes hold a SQLite write lock,
+    so several encoding processes can share a cache, and a thread lock, so that threads can share an instance.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Root directory of the cache
+    namespace : str
+        Partition of the cache, see `cache_namespace`
+    max_size : int or str
+        Maximum size of the vector file, in bytes or as a string such as "10GB"
+    """
+
+    def __init__(self, cache_dir: str, namespace: str, max_size: Union[int, str] = "10GB"):
+        self.path = os.path.join(cache_dir, namespace)
+        os.makedirs(self.path, exist_ok=True)
+        self.max_size = convert_file_size_to_int(max_size)
+        self._con = sqlite3.connect(
+            os.path.join(self.path, "index.sqlite"), isolation_level=None, timeout=600, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        self._con.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self._con.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER, last_used REAL)")
+        self._vectors: Optional[np.memmap] = None
+        self._open_vectors()
+
+    def _open_vectors(self) -> None:
+        meta = dict(self._con.execute("SELECT key, value FROM meta"))
+        if meta:
+            self._vectors = np.memmap(
+                os.path.join(self.path, "vectors.f32"), dtype=np.float32, mode="r+",
+                shape=(meta["num_slots"], meta["dimension"])
+            )
+
+    def _create_vectors(self, dimension: int) -> None:
+        # Called inside a write transaction, so only one process creates the file
+        self._open_vectors()
+        if self._vectors is not None:
+            return
+        num_slots = max(self.max_size // (dimension * 4), 1)
+        self._vectors = np.memmap(
+            os.path.join(self.path, "vectors.f32"), dtype=np.float32, mode="w+", shape=(num_slots, dimension)
+        )
+        self._con.executemany("INSERT INTO meta VALUES (?, ?)", [("num_slots", num_slots), ("dimension", dimension)])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._con.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get(self, keys: List[str]) -> Tuple[Optional[np.ndarray], List[bool]]:
+        """
+        Look up embeddings
+
+        Returns
+        -------
+        A `(len(keys), dimension)` array holding the cached embeddings (None if the cache is empty),
+        and for each key whether it was found
+        """
+        with self._lock:
+            if self._vectors is None:
+                self._open_vectors()
+                if self._vectors is None:
+                    return None, [False] * len(keys)
+
+            vectors = np.zeros((len(keys), self._vectors.shape[1]), dtype=np.float32)
+            found = [False] * len(keys)
+            now = time.time()
+            self._con.execute("BEGIN IMMEDIATE")
+            try:
+                for i, key in enumerate(keys):
+                    row = self._con.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        vectors[i] = self._vectors[row[0]]
+                        found[i] = True
+                        self._con.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+                self._con.execute("COMMIT")
+            except BaseException:
+                self._con.execute("ROLLBACK")
+                raise
+        return vectors, found
+
+    def put(self, keys: List[str], vectors: np.ndarray) -> None:
+        """
+        Store embeddings, evicting the least recently used ones if the cache is full
+        """
+        if not keys:
+            return None
+        with self._lock:
+            self._put(keys, vectors)
+        return None
+
+    def _put(self, keys: List[str], vectors: np.ndarray) -> None:
+        now = time.time()
+        self._con.execute("BEGIN IMMEDIATE")
+        try:
+            self._create_vectors(vectors.shape[1])
+            num_slots = len(self._vectors)
+            new_keys = list(dict.fromkeys(
+                key for key in keys
+                if self._con.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is None
+            ))[:num_slots]
+
+            # Entries always occupy slots 0..n-1: fill the free ones, then reuse evicted ones
+            num_entries = self._con.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            slots = list(range(num_entries, min(num_entries + len(new_keys), num_slots)))
+            num_evicted = len(new_keys) - len(slots)
+            if num_evicted:
+                evicted = self._con.execute(
+                    "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (num_evicted,)
+                ).fetchall()
+                self._con.executemany("DELETE FROM entries WHERE key = ?", ((key,) for key, _ in evicted))
+                slots.extend(slot for _, slot in evicted)
+
+            positions = {key: i for i, key in enumerate(keys)}
+            for key, slot in zip(new_keys, slots):
+                self._vectors[slot] = vectors[positions[key]]
+            self._vectors.flush()
+            self._con.executemany("INSERT INTO entries VALUES (?, ?, ?)", ((key, slot, now) for key, slot in zip(new_keys, slots)))
+            self._con.execute("COMMIT")
+        except BaseException:
+            self._con.execute("ROLLBACK")
+            raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._con.close()
+            self._vectors = None
@@ -0,0 +1,182 @@
+import json
+import mmap
+import os
+from typing import Any, Dict, Iterator, List, Literal
+
+import numpy as np
+from pyserini.encode import RepresentationWriter
+
+EmbeddingDtype = Literal["float32", "float16"]
+
+VECTORS_FILENAME = "embeddings.npy"
+DOCIDS_FILENAME = "docid"
+DOCID_OFFSETS_FILENAME = "docid_offsets.npy"
+META_FILENAME = "meta.json"
+
+
+class _NpyAppender:
+    """
+    Appends rows to a `.npy` file. The header is written for an empty array and rewritten with
+    the final shape on close: numpy pads headers so that the number of rows can grow without changing their size.
+    """
+
+    def __init__(self, path: str, dtype: np.dtype, row_shape: tuple = ()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = row_shape
+        self.num_rows = 0
+        self.file = open(path, "wb")
+        self.header_size = self._write_header()
+
+    def _write_header(self) -> int:
+        self.file.seek(0)
+        np.lib.format.write_array_header_1_0(self.file, {
+            "descr": np.lib.format.dtype_to_descr(self.dtype),
+            "fortran_order": False,
+            "shape": (self.num_rows, *self.row_shape),
+        })
+        return self.file.tell()
+
+    def append(self, rows: np.ndarray) -> None:
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        if rows.shape[1:] != self.row_shape:
+            raise ValueError(f"Expected rows of shape {self.row_shape}, got {rows.shape[1:]}")
+        self.file.write(rows.tobytes())
+        self.num_rows += len(rows)
+
+    def close(self) -> None:
+        self.file.flush()
+        if self._write_header() != self.header_size:
+            raise RuntimeError(f"The header of {self.path} changed size, the file is corrupt")
+        self.file.close()
+
+
+class EmbeddingStoreWriter(RepresentationWriter):
+    """
+    Writes document embeddings to a binary store that can be memory-mapped, see `EmbeddingStore`.
+
+    Each batch is appended as a chunk, so writing never holds more than a batch in memory.
+    The store is only readable once the writer is closed, which writes `meta.json`.
+    Document fields other than the ID are not stored.
+
+    Parameters
+    ----------
+    dir_path : str
+        Output directory
+    dimension : int
+        Dimension of the embeddings
+    dtype : str
+        `float32`, or `float16` to halve the size of the store
+    """
+
+    def __init__(self, dir_path: str, dimension: int = 768, dtype: EmbeddingDtype = "float32"):
+        self.dir_path = dir_path
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self.vectors = None
+        self.docid_offsets = None
+        self.docid_file = None
+        self.docid_bytes = 0
+
+    def __enter__(self):
+        os.makedirs(self.dir_path, exist_ok=True)
+        meta_path = os.path.join(self.dir_path, META_FILENAME)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        self.vectors = _NpyAppender(os.path.join(self.dir_path, VECTORS_FILENAME), self.dtype, (self.dimension,))
+        self.docid_offsets = _NpyAppender(os.path.join(self.dir_path, DOCID_OFFSETS_FILENAME), np.int64)
+        self.docid_offsets.append(np.zeros(1, dtype=np.int64))
+        self.docid_file = open(os.path.join(self.dir_path, DOCIDS_FILENAME), "wb")
+        self.docid_bytes = 0
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.vectors.close()
+        self.docid_offsets.close()
+        self.docid_file.close()
+        if exc_type is None:
+            meta = {
+                "dtype": self.dtype.name,
+                "dimension": self.dimension,
+                "num_vectors": self.vectors.num_rows,
+            }
+            with open(os.path.join(self.dir_path, f"{META_FILENAME}.tmp"), "w") as f:
+                json.dump(meta, f, indent=2)
+            os.replace(os.path.join(self.dir_path, f"{META_FILENAME}.tmp"), os.path.join(self.dir_path, META_FILENAME))
+
+    def write(self, batch_info: Dict[str, Any], fields: List[str] = None):
+        docids = b"".join(f"{id_}\n".encode("utf-8") for id_ in batch_info["id"])
+        lengths = np.array([len(f"{id_}\n".encode("utf-8")) for id_ in batch_info["id"]], dtype=np.int64)
+        self.vectors.append(batch_info["vector"])
+        self.docid_file.write(docids)
+        self.docid_offsets.append(self.docid_bytes + np.cumsum(lengths))
+        self.docid_bytes += len(docids)
+
+
+class EmbeddingStore:
+    """
+    Read-only view of a store written by `EmbeddingStoreWriter`.
+
+    The directory holds `embeddings.npy`, a `(num_vectors, dimension)` array, `docid`, one document ID
+    per line in the order of the vectors (the layout of FAISS index directories), `docid_offsets.npy`,
+    the byte offset of each line, and `meta.json`. Vectors and document IDs are memory-mapped, so opening
+    a store reads nothing and `vectors` can be passed as is to numpy or FAISS.
+
+    Parameters
+    ----------
+    dir_path : str
+        Directory of the store
+    """
+
+    def __init__(self, dir_path: str):
+        meta_path = os.path.join(dir_path, META_FILENAME)
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No complete embedding store in {dir_path}")
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        self.dir_path = dir_path
+        self.vectors: np.ndarray = np.load(os.path.join(dir_path, VECTORS_FILENAME), mmap_mode="r")
+        self._docid_offsets = np.load(os.path.join(dir_path, DOCID_OFFSETS_FILENAME), mmap_mode="r")
+        self._docids = None
+        if self._docid_offsets[-1]:
+            with open(os.path.join(dir_path, DOCIDS_FILENAME), "rb") as f:
+                self._docids = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def exists(dir_path: str) -> bool:
+        return os.path.exists(os.path.join(dir_path, META_FILENAME)) and os.path.exists(os.path.join(dir_path, VECTORS_FILENAME))
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def dimension(self) -> int:
+        return self.vectors.shape[1]
+
+    def docid(self, i: int) -> str:
+        """
+        Document ID of the `i`-th vector
+        """
+        return self._docids[self._docid_offsets[i]:self._docid_offsets[i + 1] - 1].decode("utf-8")
+
+    def docids(self, start: int = 0, stop: int = None) -> List[str]:
+        """
+        Document IDs of vectors `start` to `stop`
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return []
+        lines = self._docids[self._docid_offsets[start]:self._docid_offsets[stop]].decode("utf-8")
+        return lines.split("\n")[:-1]
+
+    def iter_batches(self, batch_size: int = 100_000) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the store in batches with the keys `id` and `vector`, as taken by representation writers
+        """
+        for start in range(0, len(self), batch_size):
+            yield {"id": self.docids(start, start + batch_size), "vector": self.vectors[start:start + batch_size]}
+
+    def close(self) -> None:
+        if self._docids is not None:
+            self._docids.close()
+        self.vectors = None
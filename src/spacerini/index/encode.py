@@ -1,8 +1,31 @@
+import copy
+import logging
+import os
+import threading
+from collections import deque
+from contextlib import nullcontext
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
+from typing import Any
+from typing import Callable
+from typing import Dict
 from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Literal
 from typing import Optional
 from typing import Protocol
+from typing import TypedDict
+from typing import Union
+
+import faiss
+import numpy as np
+import pyarrow as pa
+from datasets import Dataset, IterableDataset
+from datasets.distributed import split_dataset_by_node
 
 from pyserini.encode.__main__ import init_encoder
 from pyserini.encode import RepresentationWriter
@@ -10,25 +33,286 @@ from pyserini.encode import FaissRepresentationWriter
 from pyserini.encode import JsonlCollectionIterator
 from pyserini.encode import JsonlRepresentationWriter
 
+from spacerini.data import load_dataset_source
+from spacerini.data.utils import prefetch
+from spacerini.index.embedding_cache import EmbeddingCache, cache_namespace, document_key
+from spacerini.index.embedding_store import EmbeddingDtype, EmbeddingStore, EmbeddingStoreWriter
+from spacerini.index.faiss_index import FaissIndexParams, FaissIndexType, FaissIndexWriter, rebuild_faiss_index
+from spacerini.spacerini_utils.onnx_encoder import init_onnx_encoder
+
+logger = logging.getLogger(__name__)
+
 EncoderClass = Literal["dkrr", "dpr", "tct_colbert", "ance", "sentence", "contriever", "auto"]
+EncoderBackend = Literal["torch", "onnx"]
+EmbeddingFormat = Literal["npy", "jsonl"]
 
 
 class Encoder(Protocol):
     def encode(**kwargs): ...
 
 
+class EncodeStats(TypedDict):
+    documents: int
+    batches: int
+    cache_hits: int
+    elapsed: float
+    docs_per_sec: float
+    padding_ratio: float
+    fixed_padding_ratio: float
+
+
+def default_device() -> str:
+    """
+    First GPU if there is one, else CPU
+    """
+    import torch
+    return "cuda:0" if torch.cuda.is_available() else "cpu"
+
+
 def init_writer(
     embedding_dir: str, 
     embedding_dimension: int = 768, 
-    output_to_faiss: bool = False
+    output_to_faiss: bool = False,
+    faiss_index_type: FaissIndexType = "flat",
+    faiss_index_params: FaissIndexParams = None,
+    embedding_format: EmbeddingFormat = "npy",
+    embedding_dtype: EmbeddingDtype = "float32",
 ) -> RepresentationWriter:
     """
+    Initialize a writer for document embeddings
+
+    Parameters
+    ----------
+    embedding_dir : str
+        Output directory
+    embedding_dimension : int
+        Dimension of the embeddings
+    output_to_faiss : bool
+        If True, write a FAISS index. Otherwise write embeddings in `embedding_format`.
+    faiss_index_type : str
+        `flat` for exact search, `hnsw`, `ivf_flat` or `ivf_pq` for approximate search,
+        `sq8` or `fp16` for scalar-quantized exact search
+    faiss_index_params : FaissIndexParams
+        Build parameters of non-flat indexes, see `spacerini.index.faiss_index.build_faiss_index`.
+        Size, recall and latency of the built index are written to `index_stats.json`.
+    embedding_format : str
+        `npy` for a binary store that can be memory-mapped, see `spacerini.index.embedding_store.EmbeddingStore`,
+        or `jsonl` for pyserini's JSONL embeddings, which also hold the input fields
+    embedding_dtype : str
+        `float32` or `float16` vectors in an `npy` store
+
+    Returns
+    -------
+    RepresentationWriter
     """
     if output_to_faiss:
+        if faiss_index_type != "flat":
+            return FaissIndexWriter(embedding_dir, embedding_dimension, faiss_index_type, faiss_index_params)
         writer = FaissRepresentationWriter(embedding_dir, dimension=embedding_dimension)
         return writer
 
-    return JsonlRepresentationWriter(embedding_dir)
+    if embedding_format == "jsonl":
+        return JsonlRepresentationWriter(embedding_dir)
+    return EmbeddingStoreWriter(embedding_dir, embedding_dimension, embedding_dtype)
+
+
+def token_lengths(
+    encoder: Encoder,
+    texts: List[str],
+    titles: Optional[List[str]] = None,
+    max_length: int = 256,
+    tokenizer=None,
+) -> List[int]:
+    """
+    Number of tokens each document is encoded into, capped at `max_length`.
+    Uses `tokenizer` or else the encoder's tokenizer when it has one, and counts whitespace-separated words otherwise.
+    """
+    if not texts:
+        return []
+    if titles is not None:
+        texts = [f"{title} {text}" for title, text in zip(titles, texts)]
+    tokenizer = tokenizer or getattr(encoder, "tokenizer", None)
+    if tokenizer is not None:
+        input_ids = tokenizer(texts, max_length=max_length, truncation=True, add_special_tokens=True)["input_ids"]
+        return [len(ids) for ids in input_ids]
+    return [min(len(text.split()) + 2, max_length) for text in texts]
+
+
+def plan_token_batches(lengths: List[int], max_tokens: int, max_batch_size: int = None) -> List[List[int]]:
+    """
+    Group documents of similar length into batches that hold at most `max_tokens` tokens once padded
+
+    Parameters
+    ----------
+    lengths : List[int]
+        Length of each document in tokens
+    max_tokens : int
+        Token budget of a batch, counting padding. A document longer than the budget gets a batch of its own.
+    max_batch_size : int
+        Maximum number of documents in a batch
+
+    Returns
+    -------
+    List of batches, each a list of positions in `lengths`
+    """
+    batches, batch, longest = [], [], 0
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        padded_length = max(longest, lengths[i])
+        if batch and (padded_length * (len(batch) + 1) > max_tokens or len(batch) == max_batch_size):
+            batches.append(batch)
+            batch, padded_length = [], lengths[i]
+        batch.append(i)
+        longest = padded_length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def padded_tokens(lengths: List[int], batches: List[List[int]]) -> int:
+    """
+    Number of tokens fed to the encoder, padding included, when each batch is padded to its longest document
+    """
+    return sum(max(lengths[i] for i in batch) * len(batch) for batch in batches)
+
+
+def _iter_windows(batches: Iterable[Dict[str, list]], window_size: int) -> Iterator[Dict[str, list]]:
+    """
+    Concatenate consecutive batches of the collection iterator into windows of `window_size` batches
+    """
+    window = None
+    for i, batch_info in enumerate(batches, start=1):
+        if window is None:
+            window = {key: list(values) for key, values in batch_info.items()}
+        else:
+            for key, values in batch_info.items():
+                window[key].extend(values)
+        if i % window_size == 0:
+            yield window
+            window = None
+    if window is not None:
+        yield window
+
+
+def _ordered_map(executor: ThreadPoolExecutor, fn: Callable, iterable: Iterable, max_pending: int) -> Iterator:
+    """
+    Like `executor.map`, but reads `iterable` lazily and keeps at most `max_pending` calls in flight
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _supports_split_forward(encoder: Encoder) -> bool:
+    """
+    Whether tokenization and the forward pass of the encoder can be run separately.
+    True for pyserini's `AutoDocumentEncoder` and encoders exposing the same attributes.
+    """
+    return all(hasattr(encoder, attr) for attr in ["tokenizer", "model", "pooling", "l2_norm", "device", "_mean_pooling"])
+
+
+def _tokenizer_inputs(encoder: Encoder, texts: List[str], titles: Optional[List[str]], add_sep: bool) -> Dict[str, List[str]]:
+    # Mirrors how pyserini's AutoDocumentEncoder builds its tokenizer inputs
+    if titles is not None and add_sep:
+        inputs = {"text": titles, "text_pair": texts}
+    elif titles is not None:
+        inputs = {"text": [f"{title} {text}" for title, text in zip(titles, texts)]}
+    else:
+        inputs = {"text": texts}
+    if getattr(encoder, "prefix", None) is not None:
+        inputs["text"] = [f"{encoder.prefix} {text}" for text in inputs["text"]]
+    return inputs
+
+
+def _forward(encoder: Encoder, inputs, fp16: bool = False) -> np.ndarray:
+    """
+    Run the model and pooling of an `AutoDocumentEncoder`-like encoder on tokenized inputs.
+    With `fp16`, the forward pass is autocast to half precision on GPUs, as pyserini's encoders do.
+    """
+    import torch
+
+    inputs = inputs.to(encoder.device)
+    use_autocast = fp16 and str(encoder.device).startswith("cuda")
+    with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16) if use_autocast else nullcontext():
+        outputs = encoder.model(**inputs)
+        if encoder.pooling == "mean":
+            embeddings = encoder._mean_pooling(outputs[0], inputs["attention_mask"])
+        else:
+            embeddings = outputs[0][:, 0, :]
+        embeddings = embeddings.float().detach().cpu().numpy()
+    if encoder.l2_norm:
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1, norms)
+    return embeddings
+
+
+def _prepare_window(
+    window: Dict[str, list],
+    encoder: Encoder,
+    batch_size: int,
+    max_length: int,
+    add_sep: bool,
+    title_column_to_encode: Optional[str],
+    text_column_to_encode: Optional[str],
+    expand_column_to_encode: Optional[str],
+    max_tokens: Optional[int],
+    embedding_cache: Optional[EmbeddingCache],
+    tokenizer=None,
+    split_forward: bool = False,
+) -> Dict[str, Any]:
+    """
+    Look a window of documents up in the embedding cache and batch the misses.
+    With `split_forward`, also tokenize each batch for `_forward`.
+    """
+    texts = window[text_column_to_encode]
+    titles = window[title_column_to_encode] if title_column_to_encode else None
+    expands = window[expand_column_to_encode] if expand_column_to_encode else None
+
+    # Only documents missing from the cache are encoded
+    keys, vectors, misses = None, None, list(range(len(texts)))
+    if embedding_cache is not None:
+        keys = [
+            document_key(text, titles[i] if titles else None, expands[i] if expands else None)
+            for i, text in enumerate(texts)
+        ]
+        vectors, found = embedding_cache.get(keys)
+        misses = [i for i, hit in enumerate(found) if not hit]
+
+    miss_texts = [texts[i] for i in misses]
+    miss_titles = [titles[i] for i in misses] if titles else None
+    inputs = None
+    if split_forward and misses:
+        # Tokenize once without padding, then pad each batch to its longest document
+        encoded = tokenizer(
+            **_tokenizer_inputs(encoder, miss_texts, miss_titles, add_sep),
+            max_length=max_length, truncation=True, add_special_tokens=True,
+            return_attention_mask=True, return_token_type_ids=False,
+        )
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+    elif max_tokens:
+        lengths = token_lengths(encoder, miss_texts, miss_titles, max_length, tokenizer=tokenizer)
+    else:
+        # Fixed-size batches need no lengths, and counting them would tokenize every document twice
+        lengths = None
+
+    fixed_batches = [list(range(i, min(i + batch_size, len(misses)))) for i in range(0, len(misses), batch_size)]
+    batches = plan_token_batches(lengths, max_tokens, batch_size) if max_tokens else fixed_batches
+    if split_forward:
+        inputs = [] if not misses else [
+            tokenizer.pad(
+                {key: [encoded[key][i] for i in batch] for key in ["input_ids", "attention_mask"]},
+                padding="longest", return_tensors="pt"
+            ) for batch in batches
+        ]
+
+    return {
+        "window": window, "texts": texts, "titles": titles, "expands": expands, "keys": keys,
+        "vectors": vectors, "misses": misses, "lengths": lengths,
+        "batches": batches, "fixed_batches": fixed_batches, "inputs": inputs,
+    }
 
 
 def encode_corpus_or_shard(
@@ -44,24 +328,136 @@ def encode_corpus_or_shard(
     title_column_to_encode: Optional[str] = None,
     text_column_to_encode: Optional[str] = "text",
     expand_column_to_encode: Optional[str] = None,
-    fp16: bool = False
-) -> None:
-    """
-    
-    """
-    with embedding_writer:
-        for batch_info in collection_iterator(batch_size, shard_id, shard_num):
-            kwargs = {
-                'texts': batch_info[text_column_to_encode],
-                'titles': batch_info[title_column_to_encode] if title_column_to_encode else None,
-                'expands': batch_info[expand_column_to_encode] if expand_column_to_encode else None,
-                'fp16': fp16,
-                'max_length': max_length,
-                'add_sep': add_sep,
-            }
-            embeddings = encoder.encode(**kwargs)
-            batch_info['vector'] = embeddings
-            embedding_writer.write(batch_info, input_fields)
+    fp16: bool = False,
+    max_tokens: Optional[int] = None,
+    sort_window: int = 64,
+    embedding_cache: Optional[EmbeddingCache] = None,
+    pipeline_threads: int = 0,
+) -> EncodeStats:
+    """
+    Encode a collection, or one shard of it, and write the embeddings
+
+    With `max_tokens`, documents are read `sort_window` batches at a time, sorted by length and
+    re-batched so that each batch holds at most `max_tokens` tokens including padding. Short documents
+    then share large batches, and long documents small ones, instead of every document being padded
+    to the longest of a fixed-size batch. Embeddings are written back in collection order.
+    Encoders that pad every batch to `max_length` instead of its longest document see no padding savings.
+
+    Parameters
+    ----------
+    batch_size : int
+        Number of documents per batch. With `max_tokens`, the number of documents read per batch
+        of the collection iterator, and the maximum number of documents per batch.
+    max_tokens : int
+        Token budget of a batch. If None, batches of `batch_size` documents are encoded in collection order.
+    sort_window : int
+        Number of collection batches sorted by length together. Larger windows waste less padding
+        but hold more documents and embeddings in memory.
+    embedding_cache : EmbeddingCache
+        Cache of embeddings computed with the same encoder settings. Only documents whose
+        contents are not in the cache are encoded, and their embeddings are added to it.
+    pipeline_threads : int
+        If positive, windows of documents are read, looked up in the cache and tokenized by this many
+        threads ahead of the model, and embeddings are written by a separate thread, so that only the
+        forward pass runs on the calling thread. Tokenization is only moved off the calling thread for
+        encoders exposing `tokenizer`, `model` and `pooling` like pyserini's `AutoDocumentEncoder`.
+
+    Returns
+    -------
+    EncodeStats
+        Throughput, number of documents read from the cache, and the fraction of padding tokens with the batches used (`padding_ratio`)
+        and with fixed-size batches in collection order (`fixed_padding_ratio`). Padding is only measured
+        when documents are tokenized anyway, with `max_tokens` or when tokenization runs in the preparation threads.
+    """
+    stats = EncodeStats(
+        documents=0, batches=0, cache_hits=0, elapsed=0.0, docs_per_sec=0.0, padding_ratio=0.0, fixed_padding_ratio=0.0
+    )
+    num_tokens = num_padded_tokens = num_fixed_padded_tokens = 0
+    windows = collection_iterator(batch_size, shard_id, shard_num)
+    if max_tokens:
+        windows = _iter_windows(windows, sort_window)
+
+    # Tokenize in the preparation threads only if the forward pass can be run separately
+    split_forward = pipeline_threads > 0 and _supports_split_forward(encoder)
+    if pipeline_threads > 0:
+        windows = prefetch(windows, max_prefetch=2)
+    thread_state = threading.local()
+
+    def _prepare(window: Dict[str, list]) -> Dict[str, Any]:
+        tokenizer = None
+        if pipeline_threads > 0 and getattr(encoder, "tokenizer", None) is not None:
+            # Fast tokenizers are not safe to share between threads, so each thread gets its own
+            if not hasattr(thread_state, "tokenizer"):
+                thread_state.tokenizer = copy.deepcopy(encoder.tokenizer)
+            tokenizer = thread_state.tokenizer
+        return _prepare_window(
+            window, encoder, batch_size, max_length, add_sep, title_column_to_encode, text_column_to_encode,
+            expand_column_to_encode, max_tokens, embedding_cache, tokenizer, split_forward
+        )
+
+    start_time = time.perf_counter()
+    with embedding_writer, ThreadPoolExecutor(max(pipeline_threads, 1)) as prepare_pool, ThreadPoolExecutor(1) as write_pool:
+        if pipeline_threads > 0:
+            prepared_windows = _ordered_map(prepare_pool, _prepare, windows, max_pending=2 * pipeline_threads)
+        else:
+            prepared_windows = map(_prepare, windows)
+
+        pending_writes = deque()
+        for prepared in prepared_windows:
+            texts, titles, expands = prepared["texts"], prepared["titles"], prepared["expands"]
+            vectors, misses, lengths = prepared["vectors"], prepared["misses"], prepared["lengths"]
+            batches, fixed_batches = prepared["batches"], prepared["fixed_batches"]
+
+            for i, batch in enumerate(batches):
+                batch = [misses[j] for j in batch]
+                if prepared["inputs"] is not None:
+                    embeddings = _forward(encoder, prepared["inputs"][i], fp16=fp16)
+                else:
+                    kwargs = {
+                        'texts': [texts[j] for j in batch],
+                        'titles': [titles[j] for j in batch] if titles else None,
+                        'expands': [expands[j] for j in batch] if expands else None,
+                        'fp16': fp16,
+                        'max_length': max_length,
+                        'add_sep': add_sep,
+                    }
+                    embeddings = encoder.encode(**kwargs)
+                if vectors is None:
+                    vectors = np.empty((len(texts), *embeddings.shape[1:]), dtype=embeddings.dtype)
+                vectors[batch] = embeddings
+            if embedding_cache is not None and misses:
+                embedding_cache.put([prepared["keys"][i] for i in misses], vectors[misses])
+
+            window = prepared["window"]
+            window['vector'] = vectors
+            if pipeline_threads > 0:
+                # A single writer thread keeps windows in order
+                pending_writes.append(write_pool.submit(embedding_writer.write, window, input_fields))
+                while len(pending_writes) > 2:
+                    pending_writes.popleft().result()
+            else:
+                embedding_writer.write(window, input_fields)
+
+            if lengths is not None:
+                num_tokens += sum(lengths)
+                num_padded_tokens += padded_tokens(lengths, batches)
+                num_fixed_padded_tokens += padded_tokens(lengths, fixed_batches)
+            stats["documents"] += len(texts)
+            stats["batches"] += len(batches)
+            stats["cache_hits"] += len(texts) - len(misses)
+        for future in pending_writes:
+            future.result()
+
+    stats["elapsed"] = time.perf_counter() - start_time
+    stats["docs_per_sec"] = stats["documents"] / max(stats["elapsed"], 1e-9)
+    stats["padding_ratio"] = 1 - num_tokens / num_padded_tokens if num_padded_tokens else 0.0
+    stats["fixed_padding_ratio"] = 1 - num_tokens / num_fixed_padded_tokens if num_fixed_padded_tokens else 0.0
+    logger.info(
+        f"Encoded {stats['documents']} documents in {stats['batches']} batches ({stats['docs_per_sec']:.1f} docs/sec), "
+        f"{stats['cache_hits']} from the embedding cache. "
+        f"Padding: {stats['padding_ratio']:.1%} of tokens, {stats['fixed_padding_ratio']:.1%} with fixed-size batches"
+    )
+    return stats
 
 
 def encode_json_dataset(
@@ -72,7 +468,7 @@ def encode_json_dataset(
     batch_size: int,
     index_shard_id: int = 0,
     num_index_shards: int = 1,
-    device: str = "cuda:0",
+    device: Optional[str] = None,
     delimiter: str = "\n",
     max_length: int = 256,
     add_sep: bool = False,
@@ -82,24 +478,331 @@ def encode_json_dataset(
     expand_column_to_encode: Optional[str] = None,
     output_to_faiss: bool = False,
     embedding_dimension: int = 768,
-    fp16: bool = False
-) -> None:
+    fp16: bool = False,
+    max_tokens: Optional[int] = None,
+    sort_window: int = 64,
+    num_proc: int = 1,
+    n_threads: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_size: Union[int, str] = "10GB",
+    encoder_revision: Optional[str] = None,
+    faiss_index_type: FaissIndexType = "flat",
+    faiss_index_params: Optional[FaissIndexParams] = None,
+    pipeline_threads: int = 0,
+    backend: EncoderBackend = "torch",
+    embedding_format: EmbeddingFormat = "npy",
+    embedding_dtype: EmbeddingDtype = "float32",
+) -> EncodeStats:
     """
-    
+    Encode a JSONL collection into a dense index
+
+    Parameters
+    ----------
+    num_proc : int
+        Number of worker processes. Each worker encodes a slice of the `index_shard_id`-th shard
+        of the collection, and the slices are merged into `embedding_dir` in collection order.
+        Meant for CPU hosts: workers sharing a GPU compete for it.
+    n_threads : int
+        Number of torch threads. Defaults to the CPUs available split evenly between workers.
+        If None and `num_proc` is 1, torch's own default is kept.
+    cache_dir : str
+        Directory of a persistent embedding cache. Documents already encoded with the same encoder,
+        `encoder_revision`, `max_length` and `add_sep` are read from it instead of re-encoded.
+    cache_max_size : int or str
+        Maximum size of the cached vectors. Least recently used embeddings are evicted beyond it.
+    encoder_revision : str
+        Revision of the encoder. Change it whenever the weights behind `encoder_name_or_path` change.
+    faiss_index_type : str
+        Type of FAISS index written if `output_to_faiss`, see `init_writer`
+    faiss_index_params : FaissIndexParams
+        Build parameters of the FAISS index, see `init_writer`
+    pipeline_threads : int
+        Number of threads reading and tokenizing ahead of the model, see `encode_corpus_or_shard`
+    backend : str
+        `torch` to run the encoder with pyserini on `device`, or `onnx` to run an int8-quantized ONNX export
+        of it on CPU with ONNX Runtime, see `spacerini.spacerini_utils.onnx_encoder.OnnxEncoder`.
+        The `onnx` backend supports the `auto`, `sentence` and `contriever` encoder classes and ignores `device` and `fp16`.
+    embedding_format : str
+        Format of the embeddings if not `output_to_faiss`, see `init_writer`
+    embedding_dtype : str
+        Precision of the vectors of an `npy` store, see `init_writer`
     """
     if input_fields is None:
         input_fields = ["text"]
-    
-    encoder = init_encoder(encoder_name_or_path, encoder_class, device=device)
+
+    if num_proc > 1:
+        return _encode_parallel(encode_json_dataset, num_proc=num_proc, **{
+            k: v for k, v in locals().items() if k != "num_proc"
+        })
+
+    collection_iterator = JsonlCollectionIterator(data_path, input_fields, delimiter)
+    return _encode_collection(
+        collection_iterator,
+        encoder_name_or_path=encoder_name_or_path,
+        encoder_class=encoder_class,
+        embedding_dir=embedding_dir,
+        batch_size=batch_size,
+        index_shard_id=index_shard_id,
+        num_index_shards=num_index_shards,
+        device=device,
+        max_length=max_length,
+        add_sep=add_sep,
+        input_fields=input_fields,
+        title_column_to_encode=title_column_to_encode,
+        text_column_to_encode=text_column_to_encode,
+        expand_column_to_encode=expand_column_to_encode,
+        output_to_faiss=output_to_faiss,
+        embedding_dimension=embedding_dimension,
+        fp16=fp16,
+        max_tokens=max_tokens,
+        sort_window=sort_window,
+        n_threads=n_threads,
+        cache_dir=cache_dir,
+        cache_max_size=cache_max_size,
+        encoder_revision=encoder_revision,
+        faiss_index_type=faiss_index_type,
+        faiss_index_params=faiss_index_params,
+        pipeline_threads=pipeline_threads,
+        backend=backend,
+        embedding_format=embedding_format,
+        embedding_dtype=embedding_dtype,
+    )
+
+
+class DatasetCollectionIterator:
+    """
+    Collection iterator over a HuggingFace dataset, with the interface of pyserini's `JsonlCollectionIterator`.
+    Arrow batches are turned directly into encoder inputs, and upcoming batches are prepared in a
+    background thread while the current one is encoded.
+
+    Parameters
+    ----------
+    ds : datasets.Dataset or datasets.IterableDataset
+        Dataset to encode
+    fields : List[str]
+        Columns passed on to the encoder and writer
+    doc_id_column : str
+        Column to use as document ID. If None, use the position of the row in the dataset
+    max_prefetch : int
+        Maximum number of batches prepared ahead of the encoder
+    """
+
+    def __init__(
+        self,
+        ds: Union[Dataset, IterableDataset],
+        fields: List[str],
+        doc_id_column: str = None,
+        max_prefetch: int = 4,
+    ):
+        self.ds = ds
+        self.fields = fields
+        self.doc_id_column = doc_id_column
+        self.max_prefetch = max_prefetch
+
+    def __call__(self, batch_size: int, shard_id: int = 0, shard_num: int = 1) -> Iterator[Dict[str, list]]:
+        return prefetch(self._iter_batches(batch_size, shard_id, shard_num), max_prefetch=self.max_prefetch)
+
+    def _iter_batches(self, batch_size: int, shard_id: int, shard_num: int) -> Iterator[Dict[str, list]]:
+        ds, offset, positional_slicing = self.ds, 0, False
+        if shard_num > 1 and isinstance(ds, Dataset):
+            # Contiguous shards, so that merged shard outputs follow dataset order
+            offset = len(ds) // shard_num * shard_id + min(shard_id, len(ds) % shard_num)
+            ds = ds.shard(shard_num, shard_id, contiguous=True)
+        elif shard_num > 1 and self.doc_id_column:
+            ds = split_dataset_by_node(ds, rank=shard_id, world_size=shard_num)
+        elif shard_num > 1:
+            # Positional IDs need every row's position, so the stream is read in full and sliced
+            positional_slicing = True
+
+        for batch in ds.with_format("arrow").iter(batch_size=batch_size):
+            num_batch_rows = batch.num_rows
+            ids = range(offset, offset + num_batch_rows)
+            if positional_slicing:
+                first = (shard_id - offset) % shard_num
+                batch = batch.take(pa.array(range(first, num_batch_rows, shard_num), type=pa.int64()))
+                ids = range(offset + first, offset + num_batch_rows, shard_num)
+            offset += num_batch_rows
+            if not batch.num_rows:
+                continue
+
+            batch_info = {field: batch.column(field).to_pylist() for field in self.fields}
+            if self.doc_id_column:
+                batch_info["id"] = [str(docid) for docid in batch.column(self.doc_id_column).to_pylist()]
+            else:
+                batch_info["id"] = [str(docid) for docid in ids]
+            yield batch_info
+
+
+def encode_dataset(
+    dataset_name_or_path: str,
+    split: str,
+    encoder_name_or_path: str,
+    encoder_class: EncoderClass,
+    embedding_dir: str,
+    batch_size: int,
+    ds_config_name: str = None,
+    doc_id_column: str = None,
+    max_prefetch: int = 4,
+    index_shard_id: int = 0,
+    num_index_shards: int = 1,
+    device: Optional[str] = None,
+    max_length: int = 256,
+    add_sep: bool = False,
+    input_fields: List[str] = None,
+    title_column_to_encode: Optional[str] = None,
+    text_column_to_encode: Optional[str] = "text",
+    expand_column_to_encode: Optional[str] = None,
+    output_to_faiss: bool = False,
+    embedding_dimension: int = 768,
+    fp16: bool = False,
+    max_tokens: Optional[int] = None,
+    sort_window: int = 64,
+    num_proc: int = 1,
+    n_threads: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_size: Union[int, str] = "10GB",
+    encoder_revision: Optional[str] = None,
+    faiss_index_type: FaissIndexType = "flat",
+    faiss_index_params: Optional[FaissIndexParams] = None,
+    pipeline_threads: int = 0,
+    backend: EncoderBackend = "torch",
+    embedding_format: EmbeddingFormat = "npy",
+    embedding_dtype: EmbeddingDtype = "float32",
+) -> EncodeStats:
+    """
+    Encode a dataset into a dense index, streaming it from any source `index_streaming_dataset` reads:
+    the HuggingFace Hub, local files, SQLite or ir_datasets. No intermediate JSONL copy is written.
+
+    Parameters
+    ----------
+    dataset_name_or_path : str
+        Source of the dataset, see `spacerini.data.load_dataset_source`
+    split : str
+        Split of dataset to encode
+    ds_config_name : str
+        Dataset configuration, or table or query for SQLite sources
+    doc_id_column : str
+        Column to use as document ID. If None, use the position of the row in the dataset
+    max_prefetch : int
+        Maximum number of batches prepared ahead of the encoder
+    input_fields : List[str]
+        Columns written along with the embeddings by a JSONL writer. Defaults to the encoded columns.
+    num_proc : int
+        Number of worker processes, see `encode_json_dataset`. Merged outputs follow dataset order
+        unless a streamed dataset is split without `doc_id_column`.
+
+    See `encode_json_dataset` for remaining argument definitions
+
+    Returns
+    -------
+    EncodeStats
+    """
+    if num_proc > 1:
+        return _encode_parallel(encode_dataset, num_proc=num_proc, **{
+            k: v for k, v in locals().items() if k != "num_proc"
+        })
+
+    encoded_columns = [column for column in [title_column_to_encode, text_column_to_encode, expand_column_to_encode] if column]
+    if input_fields is None:
+        input_fields = encoded_columns
+
+    ds = load_dataset_source(dataset_name_or_path, split=split, config_name=ds_config_name, streaming=True)
+    fields = list(dict.fromkeys([*input_fields, *encoded_columns]))
+    collection_iterator = DatasetCollectionIterator(ds, fields, doc_id_column, max_prefetch=max_prefetch)
+    return _encode_collection(
+        collection_iterator,
+        encoder_name_or_path=encoder_name_or_path,
+        encoder_class=encoder_class,
+        embedding_dir=embedding_dir,
+        batch_size=batch_size,
+        index_shard_id=index_shard_id,
+        num_index_shards=num_index_shards,
+        device=device,
+        max_length=max_length,
+        add_sep=add_sep,
+        input_fields=input_fields,
+        title_column_to_encode=title_column_to_encode,
+        text_column_to_encode=text_column_to_encode,
+        expand_column_to_encode=expand_column_to_encode,
+        output_to_faiss=output_to_faiss,
+        embedding_dimension=embedding_dimension,
+        fp16=fp16,
+        max_tokens=max_tokens,
+        sort_window=sort_window,
+        n_threads=n_threads,
+        cache_dir=cache_dir,
+        cache_max_size=cache_max_size,
+        encoder_revision=encoder_revision,
+        faiss_index_type=faiss_index_type,
+        faiss_index_params=faiss_index_params,
+        pipeline_threads=pipeline_threads,
+        backend=backend,
+        embedding_format=embedding_format,
+        embedding_dtype=embedding_dtype,
+    )
+
+
+def _encode_collection(
+    collection_iterator: Callable[[int, int, int], Iterable[Dict[str, list]]],
+    encoder_name_or_path: str,
+    encoder_class: EncoderClass,
+    embedding_dir: str,
+    batch_size: int,
+    index_shard_id: int,
+    num_index_shards: int,
+    device: Optional[str],
+    max_length: int,
+    add_sep: bool,
+    input_fields: List[str],
+    title_column_to_encode: Optional[str],
+    text_column_to_encode: Optional[str],
+    expand_column_to_encode: Optional[str],
+    output_to_faiss: bool,
+    embedding_dimension: int,
+    fp16: bool,
+    max_tokens: Optional[int],
+    sort_window: int,
+    n_threads: Optional[int],
+    cache_dir: Optional[str],
+    cache_max_size: Union[int, str],
+    encoder_revision: Optional[str],
+    faiss_index_type: FaissIndexType,
+    faiss_index_params: Optional[FaissIndexParams],
+    pipeline_threads: int,
+    backend: EncoderBackend,
+    embedding_format: EmbeddingFormat,
+    embedding_dtype: EmbeddingDtype,
+) -> EncodeStats:
+    """
+    Load the encoder, writer and embedding cache, and encode a shard of a collection
+    """
+    if backend == "onnx":
+        encoder = init_onnx_encoder(encoder_name_or_path, encoder_class, num_threads=n_threads)
+    else:
+        if n_threads:
+            import torch
+            torch.set_num_threads(n_threads)
+        encoder = init_encoder(encoder_name_or_path, encoder_class, device=device or default_device())
 
     writer = init_writer(
         embedding_dir=embedding_dir, 
         embedding_dimension=embedding_dimension, 
-        output_to_faiss=output_to_faiss
+        output_to_faiss=output_to_faiss,
+        faiss_index_type=faiss_index_type,
+        faiss_index_params=faiss_index_params,
+        embedding_format=embedding_format,
+        embedding_dtype=embedding_dtype,
     )
 
-    collection_iterator = JsonlCollectionIterator(data_path, input_fields, delimiter)
-    encode_corpus_or_shard(
+    embedding_cache = None
+    if cache_dir:
+        namespace = cache_namespace(
+            encoder_name_or_path, encoder_revision, max_length, add_sep, backend, encoder_class=encoder_class,
+            pooling=getattr(encoder, "pooling", None), l2_norm=getattr(encoder, "l2_norm", None), fp16=fp16,
+        )
+        embedding_cache = EmbeddingCache(cache_dir, namespace, max_size=cache_max_size)
+
+    stats = encode_corpus_or_shard(
         encoder=encoder,
         collection_iterator=collection_iterator,
         embedding_writer=writer,
@@ -112,5 +815,111 @@ def encode_json_dataset(
         title_column_to_encode=title_column_to_encode,
         text_column_to_encode=text_column_to_encode,
         expand_column_to_encode=expand_column_to_encode,
-        fp16=fp16
+        fp16=fp16,
+        max_tokens=max_tokens,
+        sort_window=sort_window,
+        embedding_cache=embedding_cache,
+        pipeline_threads=pipeline_threads,
+    )
+    if embedding_cache is not None:
+        embedding_cache.close()
+    return stats
+
+
+def _encode_parallel(encode_fn: Callable[..., EncodeStats], embedding_dir: str, num_proc: int, **kwargs) -> EncodeStats:
+    """
+    Encode `num_proc` shards of a collection in worker processes and merge their outputs.
+    Workers are spawned rather than forked so that each one gets a fresh torch thread pool.
+    """
+    parts_path = f"{embedding_dir}.parts"
+    part_dirs = [os.path.join(parts_path, f"part-{rank:03d}") for rank in range(num_proc)]
+    index_shard_id = kwargs.pop("index_shard_id")
+    num_index_shards = kwargs.pop("num_index_shards")
+    # Workers write flat indexes, which are merged and only then trained and rebuilt as the requested type
+    faiss_index_type = kwargs.pop("faiss_index_type")
+    faiss_index_params = kwargs.pop("faiss_index_params")
+    if kwargs["backend"] == "onnx":
+        # Export the model once, before workers look it up in the ONNX cache
+        init_onnx_encoder(kwargs["encoder_name_or_path"], kwargs["encoder_class"])
+    if kwargs["n_threads"] is None:
+        cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        kwargs["n_threads"] = max(cpu_count // num_proc, 1)
+
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=num_proc, mp_context=get_context("spawn")) as executor:
+        futures = [
+            executor.submit(
+                encode_fn,
+                **kwargs,
+                embedding_dir=part_dir,
+                # Worker `rank` encodes the `rank`-th slice of this invocation's shard
+                index_shard_id=index_shard_id * num_proc + rank,
+                num_index_shards=num_index_shards * num_proc,
+                faiss_index_type="flat",
+            ) for rank, part_dir in enumerate(part_dirs)
+        ]
+        part_stats = [future.result() for future in futures]
+
+    merge_embedding_shards(part_dirs, embedding_dir)
+    shutil.rmtree(parts_path)
+    if kwargs["output_to_faiss"] and faiss_index_type != "flat":
+        rebuild_faiss_index(embedding_dir, faiss_index_type, faiss_index_params)
+
+    num_docs = sum(stats["documents"] for stats in part_stats)
+    stats = EncodeStats(
+        documents=num_docs,
+        batches=sum(stats["batches"] for stats in part_stats),
+        cache_hits=sum(stats["cache_hits"] for stats in part_stats),
+        elapsed=time.perf_counter() - start_time,
+        docs_per_sec=0.0,
+        # Weighted by documents rather than tokens: close enough to compare batching strategies
+        padding_ratio=sum(s["padding_ratio"] * s["documents"] for s in part_stats) / max(num_docs, 1),
+        fixed_padding_ratio=sum(s["fixed_padding_ratio"] * s["documents"] for s in part_stats) / max(num_docs, 1),
     )
+    stats["docs_per_sec"] = num_docs / max(stats["elapsed"], 1e-9)
+    logger.info(f"Encoded {num_docs} documents with {num_proc} workers ({stats['docs_per_sec']:.1f} docs/sec)")
+    return stats
+
+
+def merge_embedding_shards(shard_dirs: List[str], embedding_dir: str) -> None:
+    """
+    Concatenate the outputs of encoding the shards of a collection, in shard order, into a single dense index
+
+    Parameters
+    ----------
+    shard_dirs : List[str]
+        Output directories of `encode_json_dataset`, one per shard. Either all FAISS indexes
+        (`index` and `docid` files), all embedding stores or all JSONL embeddings.
+    embedding_dir : str
+        Directory of the merged output
+    """
+    os.makedirs(embedding_dir, exist_ok=True)
+    if os.path.exists(os.path.join(shard_dirs[0], "index")):
+        merged = None
+        with open(os.path.join(embedding_dir, "docid"), "w") as docids:
+            for shard_dir in shard_dirs:
+                index = faiss.read_index(os.path.join(shard_dir, "index"))
+                if merged is None:
+                    merged = faiss.IndexFlatIP(index.d)
+                if index.ntotal:
+                    merged.add(index.reconstruct_n(0, index.ntotal))
+                with open(os.path.join(shard_dir, "docid")) as f:
+                    shutil.copyfileobj(f, docids)
+        faiss.write_index(merged, os.path.join(embedding_dir, "index"))
+        return None
+
+    if EmbeddingStore.exists(shard_dirs[0]):
+        stores = [EmbeddingStore(shard_dir) for shard_dir in shard_dirs]
+        with EmbeddingStoreWriter(embedding_dir, stores[0].dimension, stores[0].vectors.dtype.name) as writer:
+            for store in stores:
+                for batch in store.iter_batches():
+                    writer.write(batch)
+                store.close()
+        return None
+
+    for filename in sorted(f for f in os.listdir(shard_dirs[0]) if f.endswith(".jsonl")):
+        with open(os.path.join(embedding_dir, filename), "w") as out:
+            for shard_dir in shard_dirs:
+                with open(os.path.join(shard_dir, filename)) as f:
+                    shutil.copyfileobj(f, out)
+    return None
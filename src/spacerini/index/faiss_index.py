@@ -0,0 +1,254 @@
+import json
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, Literal, Optional, TypedDict
+
+import faiss
+import numpy as np
+from pyserini.encode import FaissRepresentationWriter
+
+from spacerini.index.embedding_store import EmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+FaissIndexType = Literal["flat", "hnsw", "ivf_flat", "ivf_pq", "sq8", "fp16"]
+
+INDEX_STATS_FILENAME = "index_stats.json"
+# Norm of the noise added to corpus vectors to make evaluation queries, relative to the vector's norm
+EVAL_QUERY_NOISE = 0.5
+
+
+class FaissIndexParams(TypedDict, total=False):
+    nlist: int
+    pq_m: int
+    pq_nbits: int
+    hnsw_m: int
+    ef_construction: int
+    train_size: int
+    nprobe: int
+    ef_search: int
+    num_eval_queries: int
+
+
+def faiss_factory_string(index_type: FaissIndexType, dimension: int, num_vectors: int, params: FaissIndexParams = None) -> str:
+    """
+    Translate an index type and its parameters into a FAISS index factory string
+
+    Parameters
+    ----------
+    index_type : str
+        One of `flat`, `hnsw`, `ivf_flat`, `ivf_pq`, `sq8` or `fp16`
+    dimension : int
+        Dimension of the vectors
+    num_vectors : int
+        Number of vectors the index will hold. Used to pick the number of IVF lists if `nlist` is not set.
+    params : FaissIndexParams
+        `nlist` (IVF lists), `pq_m` (PQ sub-quantizers, must divide `dimension`),
+        `pq_nbits` (bits per PQ code) and `hnsw_m` (HNSW neighbours per node)
+
+    Returns
+    -------
+    str
+    """
+    params = params or {}
+    # FAISS wants at least 39 training points per centroid
+    nlist = params.get("nlist") or max(min(int(4 * math.sqrt(num_vectors)), num_vectors // 39), 1)
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{params.get('hnsw_m', 32)},Flat"
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if index_type == "ivf_pq":
+        pq_m = params.get("pq_m") or next(m for m in [64, 48, 32, 24, 16, 8, 4, 2, 1] if dimension % m == 0)
+        return f"IVF{nlist},PQ{pq_m}x{params.get('pq_nbits', 8)}"
+    if index_type == "sq8":
+        return "SQ8"
+    if index_type == "fp16":
+        return "SQfp16"
+    raise ValueError(f"Unknown FAISS index type: {index_type}")
+
+
+def set_search_params(index: faiss.Index, nprobe: int = None, ef_search: int = None) -> None:
+    """
+    Set the search-time parameters of an index: `nprobe` for IVF indexes and `ef_search` for HNSW indexes.
+    Parameters that do not apply to the index are ignored.
+    """
+    index = faiss.downcast_index(index)
+    if nprobe and hasattr(index, "nprobe"):
+        faiss.ParameterSpace().set_index_parameter(index, "nprobe", nprobe)
+    if ef_search and hasattr(index, "hnsw"):
+        faiss.ParameterSpace().set_index_parameter(index, "efSearch", ef_search)
+
+
+def build_faiss_index(
+    vectors: np.ndarray,
+    index_path: str,
+    index_type: FaissIndexType = "flat",
+    params: FaissIndexParams = None,
+    seed: int = 42,
+) -> Dict[str, Any]:
+    """
+    Build an inner-product FAISS index, write it to `index_path` and record its size, recall and latency
+
+    Trained index types are trained on a random sample of `train_size` vectors. Recall@10 and
+    single-query latency are measured against exact search over the whole corpus, with `num_eval_queries`
+    queries made by perturbing vectors of the corpus with random noise. Indexed vectors themselves would be
+    their own nearest neighbour, which overstates the recall of queries that are not in the corpus.
+
+    Parameters
+    ----------
+    vectors : np.ndarray
+        `(num_vectors, dimension)` float32 or float16 array, possibly memory-mapped
+    index_path : str
+        Path of the index file. Statistics are written next to it in `index_stats.json`.
+    index_type : str
+        One of `flat`, `hnsw`, `ivf_flat`, `ivf_pq`, `sq8` or `fp16`
+    params : FaissIndexParams
+        Build parameters, see `faiss_factory_string`, plus `ef_construction` for HNSW, `train_size`,
+        the search parameters `nprobe` and `ef_search` used for evaluation, and `num_eval_queries`
+    seed : int
+        Seed of the training and evaluation samples
+
+    Returns
+    -------
+    Dictionary of index statistics
+    """
+    params = params or {}
+    num_vectors, dimension = vectors.shape
+    factory_string = faiss_factory_string(index_type, dimension, num_vectors, params)
+    index = faiss.index_factory(dimension, factory_string, faiss.METRIC_INNER_PRODUCT)
+    if index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efConstruction = params.get("ef_construction", 200)
+    rng = np.random.default_rng(seed)
+
+    start_time = time.perf_counter()
+    train_size = 0
+    if not index.is_trained:
+        train_size = min(params.get("train_size", 100_000), num_vectors)
+        sample = np.sort(rng.choice(num_vectors, size=train_size, replace=False))
+        index.train(np.ascontiguousarray(vectors[sample], dtype=np.float32))
+    train_time = time.perf_counter() - start_time
+
+    chunk_size = 100_000
+    for start in range(0, num_vectors, chunk_size):
+        index.add(np.ascontiguousarray(vectors[start:start + chunk_size], dtype=np.float32))
+    build_time = time.perf_counter() - start_time
+    faiss.write_index(index, index_path)
+
+    set_search_params(index, params.get("nprobe"), params.get("ef_search"))
+    num_queries = min(params.get("num_eval_queries", 100), num_vectors)
+    queries = np.array(vectors[np.sort(rng.choice(num_vectors, size=num_queries, replace=False))], dtype=np.float32)
+    noise = rng.standard_normal(queries.shape).astype(np.float32)
+    noise *= EVAL_QUERY_NOISE * np.linalg.norm(queries, axis=1, keepdims=True) / np.linalg.norm(noise, axis=1, keepdims=True)
+    queries += noise
+    k = min(10, num_vectors)
+    exact = faiss.IndexFlatIP(dimension)
+    exact_scores = np.full((num_queries, k), -np.inf, dtype=np.float32)
+    exact_ids = np.zeros((num_queries, k), dtype=np.int64)
+    for start in range(0, num_vectors, chunk_size):
+        exact.reset()
+        exact.add(np.ascontiguousarray(vectors[start:start + chunk_size], dtype=np.float32))
+        scores, ids = exact.search(queries, k)
+        merged_scores = np.concatenate([exact_scores, scores], axis=1)
+        merged_ids = np.concatenate([exact_ids, ids + start], axis=1)
+        top = np.argsort(-merged_scores, axis=1)[:, :k]
+        exact_scores = np.take_along_axis(merged_scores, top, axis=1)
+        exact_ids = np.take_along_axis(merged_ids, top, axis=1)
+
+    latencies = []
+    found = 0
+    for query, truth in zip(queries, exact_ids):
+        query_start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - query_start)
+        found += len(set(ids[0].tolist()) & set(truth.tolist()))
+
+    stats = {
+        "index_type": index_type,
+        "factory_string": factory_string,
+        "num_vectors": num_vectors,
+        "dimension": dimension,
+        "index_bytes": os.path.getsize(index_path),
+        "flat_bytes": num_vectors * dimension * 4,
+        "train_size": train_size,
+        "train_time": train_time,
+        "build_time": build_time,
+        "search_params": {key: params[key] for key in ["nprobe", "ef_search"] if key in params},
+        "recall_at_10": found / max(num_queries * k, 1),
+        "latency_ms": {
+            "mean": 1000 * float(np.mean(latencies)) if latencies else 0.0,
+            "p95": 1000 * float(np.percentile(latencies, 95)) if latencies else 0.0,
+        },
+    }
+    with open(os.path.join(os.path.dirname(index_path), INDEX_STATS_FILENAME), "w") as f:
+        json.dump(stats, f, indent=2)
+    logger.info(
+        f"Built {factory_string} index of {num_vectors} vectors: {stats['index_bytes'] / 2**20:.1f} MB, "
+        f"recall@10 {stats['recall_at_10']:.3f}, {stats['latency_ms']['mean']:.2f} ms/query"
+    )
+    return stats
+
+
+class FaissIndexWriter(FaissRepresentationWriter):
+    """
+    Writes embeddings into an approximate or compressed FAISS index.
+
+    Vectors are spooled to disk as they are written, since trained index types need a sample of
+    the whole corpus before the first vector is added. The index is built when the writer is closed.
+    The output directory has the same layout as `FaissRepresentationWriter`'s.
+    """
+
+    def __init__(self, dir_path: str, dimension: int = 768, index_type: FaissIndexType = "flat", params: FaissIndexParams = None):
+        super().__init__(dir_path, dimension=dimension)
+        self.index_type = index_type
+        self.params = params
+        self.spool_path = os.path.join(dir_path, "vectors.f32.tmp")
+        self.spool = None
+        self.num_vectors = 0
+
+    def __enter__(self):
+        super().__enter__()
+        self.spool = open(self.spool_path, "wb")
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.id_file.close()
+        self.spool.close()
+        if exc_type is None and self.num_vectors:
+            vectors = np.memmap(self.spool_path, dtype=np.float32, mode="r", shape=(self.num_vectors, self.dimension))
+            build_faiss_index(vectors, os.path.join(self.dir_path, self.index_name), self.index_type, self.params)
+            del vectors
+        elif exc_type is None:
+            faiss.write_index(self.index, os.path.join(self.dir_path, self.index_name))
+        os.remove(self.spool_path)
+
+    def write(self, batch_info: Dict[str, Any], fields=None):
+        for id_ in batch_info['id']:
+            self.id_file.write(f'{id_}\n')
+        vectors = np.ascontiguousarray(batch_info['vector'], dtype=np.float32)
+        self.spool.write(vectors.tobytes())
+        self.num_vectors += len(vectors)
+
+
+def rebuild_faiss_index(
+    embedding_dir: str,
+    index_type: FaissIndexType,
+    params: FaissIndexParams = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Rebuild the flat index in `embedding_dir` as another index type, keeping the document IDs.
+    If `embedding_dir` holds an embedding store instead, build the index from its memory-mapped vectors,
+    next to the store's `docid` file.
+    """
+    index_path = os.path.join(embedding_dir, "index")
+    if not os.path.exists(index_path) and EmbeddingStore.exists(embedding_dir):
+        store = EmbeddingStore(embedding_dir)
+        stats = build_faiss_index(store.vectors, index_path, index_type, params)
+        store.close()
+        return stats
+    flat = faiss.read_index(index_path)
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    del flat
+    return build_faiss_index(vectors, index_path, index_type, params)
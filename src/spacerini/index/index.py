@@ -1,16 +1,43 @@
-from itertools import chain
+from itertools import chain, islice
+from typing import Iterator
 from typing import List
 from typing import Literal
+from typing import Optional
+from typing import Tuple
+from typing import Union
 
+import logging
 import shutil
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from datasets import Dataset, IterableDataset
+from datasets.distributed import split_dataset_by_node
 from pyserini.index.lucene import LuceneIndexer, IndexReader
 from typing import Any, Dict, List
 from pyserini.pyclass import autoclass
 from tqdm import tqdm
 import json
 import os
+import numpy as np
+import pyarrow as pa
 
-from spacerini.data import load_from_hub, load_from_local
+from spacerini.data import load_dataset_source
+from spacerini.data.utils import prefetch
+from spacerini.index.manifest import LengthHistogram, read_index_manifest, write_index_manifest
+from spacerini.index.resources import dataset_size, plan_index_resources, plan_index_threads
+from spacerini.index.utils import directory_size
+from spacerini.preprocess.dedup import deduplicate_dataset
+from spacerini.preprocess.utils import (
+    SHARD_EXTENSIONS, build_documents, documents_to_json, get_num_shards, memory_map_dataset, open_shard,
+    prepare_documents, write_shard
+)
+
+logger = logging.getLogger(__name__)
+
+# Column holding row positions when documents are filtered before indexing
+POSITION_COLUMN = "__spacerini_position__"
 
 
 def parse_args(
@@ -100,6 +127,7 @@ def index_json_shards(
     quiet: bool = False,
     memory_buffer: str = "4096",
     n_threads: bool = 5,
+    auto_resources: bool = False,
 ):
     """Index dataset from a directory containing files
 
@@ -111,6 +139,8 @@ def index_json_shards(
         Directory to store index
     keep_shards : bool
         If False, remove dataset after indexing is complete
+    auto_resources : bool
+        If True, choose `n_threads` and `memory_buffer` from the size of the shards and the host's capacity
     
     See [docs](../../docs/arguments.md) for remaining argument definitions
 
@@ -118,15 +148,142 @@ def index_json_shards(
     -------
     None
     """
+    if os.path.isdir(shards_path) and any(name.endswith(SHARD_EXTENSIONS["zstd"]) for name in os.listdir(shards_path)):
+        raise ValueError(
+            f"{shards_path} holds zstd-compressed shards, which Anserini cannot read. "
+            "Write shards with gzip or without compression, or index the dataset with `index_dataset_pipelined`."
+        )
+    if auto_resources:
+        n_threads, memory_buffer = plan_index_threads(dataset_size(shards_path, split=None)[0])
+
     args = parse_args(**locals())
     JIndexCollection = autoclass('io.anserini.index.IndexCollection')
     JIndexCollection.main(args)
+    write_index_manifest(index_path, build_config={"lucene_args": args})
     if not keep_shards:
         shutil.rmtree(shards_path)
     
     return None
 
 
+def index_dataset_pipelined(
+    hf_dataset: Dataset,
+    shards_path: str,
+    index_path: str,
+    column_to_index: Union[str, List[str]],
+    shard_size: Union[int, str] = "100MB",
+    num_proc: int = 4,
+    max_pending_shards: int = None,
+    keep_shards: bool = True,
+    doc_id_column: str = None,
+    compression: Literal["gzip", "zstd"] = None,
+    batch_size: int = 1000,
+    disable_tqdm: bool = False,
+    language: str = "en",
+    pretokenized: bool = False,
+    analyzeWithHuggingFaceTokenizer: str = None,
+    storePositions: bool = True,
+    storeDocvectors: bool = False,
+    storeContents: bool = False,
+    storeRaw: bool = False,
+    keepStopwords: bool = False,
+    stopwords: str = None,
+    stemmer:  Literal["porter", "krovetz"] = "porter",
+    optimize: bool = True,
+    verbose: bool = False,
+    quiet: bool = True,
+    memory_buffer: str = "4096",
+    n_threads: bool = 5,
+    auto_resources: bool = False,
+):
+    """Write a dataset as JSON shards and index each shard as soon as it is written
+
+    Shards are written by `num_proc` worker processes while the main process indexes the shards
+    that are already on disk, instead of writing every shard before indexing starts.
+
+    Parameters
+    ----------
+    hf_dataset : datasets.Dataset
+        Dataset to index
+    shards_path : str
+        Directory to write the JSON shards to
+    index_path : str
+        Directory to store index
+    column_to_index : str or List[str]
+        Column(s) of dataset to index
+    shard_size : int or str
+        Maximum size of the arrow data written to each shard, e.g. "100MB"
+    num_proc : int
+        Number of processes writing shards
+    max_pending_shards : int
+        Maximum number of shards written or being written, but not yet indexed. Bounds disk usage
+        when `keep_shards` is False. Defaults to twice `num_proc`.
+    keep_shards : bool
+        If False, delete each shard once it is indexed
+    doc_id_column : str
+        Column of dataset to use as document ID. If None, IDs are row positions.
+    compression : str
+        Compress shards with `gzip` or `zstd`. zstd requires the `zstd` extra.
+    batch_size : int
+        Number of documents handed to the indexer at a time
+    auto_resources : bool
+        If True, choose `n_threads`, `memory_buffer` and the number of shards from the size of the dataset and the host's capacity
+    
+    See [docs](../../docs/arguments.md) for remaining argument definitions
+
+    Returns
+    -------
+    None
+    """
+    hf_dataset = prepare_documents(hf_dataset, column_to_index, doc_id_column=doc_id_column)
+    num_shards = get_num_shards(hf_dataset.data.nbytes, shard_size)
+    if auto_resources:
+        plan = plan_index_resources(hf_dataset.data.nbytes, num_rows=len(hf_dataset), max_shard_size=shard_size)
+        n_threads, memory_buffer, num_shards = plan["n_threads"], plan["memory_buffer"], plan["num_shards"]
+
+    args = parse_args(**locals(), for_otf_indexing=True)
+    max_pending_shards = max_pending_shards or 2 * num_proc
+    os.makedirs(shards_path, exist_ok=True)
+
+    length_histogram = LengthHistogram()
+    length_histogram.update(hf_dataset.data.column("contents"))
+
+    indexer = LuceneIndexer(args=args)
+    start_time = time.perf_counter()
+    num_docs = 0
+    next_shard = 0
+    pending = set()
+    with tempfile.TemporaryDirectory(dir=shards_path) as dataset_path, \
+            ProcessPoolExecutor(max_workers=num_proc, mp_context=get_context("spawn")) as executor, \
+            tqdm(total=len(hf_dataset), disable=disable_tqdm) as pbar:
+        hf_dataset = memory_map_dataset(hf_dataset, dataset_path)
+        while next_shard < num_shards or pending:
+            while next_shard < num_shards and len(pending) < max_pending_shards:
+                pending.add(executor.submit(write_shard, hf_dataset, num_shards, next_shard, shards_path, compression))
+                next_shard += 1
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard_path = future.result()
+                with open_shard(shard_path) as f:
+                    for lines in iter(lambda: list(islice(f, batch_size)), []):
+                        indexer.add_batch_raw([line.rstrip("\n") for line in lines])
+                        num_docs += len(lines)
+                        pbar.update(len(lines))
+                if not keep_shards:
+                    os.remove(shard_path)
+
+    indexer.close()
+    if not keep_shards:
+        shutil.rmtree(shards_path, ignore_errors=True)
+
+    write_index_manifest(index_path, build_config={"lucene_args": args, "num_shards": num_shards}, length_histograms={"contents": length_histogram})
+
+    elapsed = time.perf_counter() - start_time
+    logger.info(f"Indexed {num_docs} documents from {num_shards} shards in {elapsed:.1f}s ({num_docs / max(elapsed, 1e-9):.1f} docs/sec)")
+    return None
+
+
 def index_streaming_dataset(
     index_path: str,
     dataset_name_or_path: str,
@@ -151,13 +308,24 @@ def index_streaming_dataset(
     quiet: bool = True,
     memory_buffer: str = "4096",
     n_threads: bool = 5,
+    batch_size: int = None,
+    max_prefetch: int = 4,
+    index_shard_id: int = 0,
+    num_index_shards: int = 1,
+    num_proc: int = 1,
+    checkpoint_every: int = None,
+    resume: bool = False,
+    auto_resources: bool = False,
+    deduplicate: bool = False,
+    dedup_mode: Literal["drop", "collapse"] = "drop",
 ):
     """Stream dataset from HuggingFace Hub & index
 
     Parameters
     ----------
     dataset_name_or_path : str
-        Name of HuggingFace dataset to stream
+        Name of HuggingFace dataset to stream, path to a local file, `sqlite:///<path>` (with the
+        table or query as `ds_config_name`) or `ir_datasets:<name>`. See `spacerini.data.load_dataset_source`.
     split : str
         Split of dataset to index
     column_to_index : List[str]
@@ -168,6 +336,30 @@ def index_streaming_dataset(
         Dataset configuration to stream. Usually a language name or code
     num_rows : int
         Number of rows in dataset
+    batch_size : int
+        If set, read the dataset in batches of `batch_size` rows in a background thread and
+        hand each batch to the indexer in a single call. Otherwise, index one row at a time.
+    max_prefetch : int
+        Maximum number of prepared batches waiting to be indexed. Only used with `batch_size`.
+    index_shard_id : int
+        Zero-based id of the slice of the dataset to index
+    num_index_shards : int
+        Number of slices the dataset is split into. Only slice `index_shard_id` is indexed.
+    num_proc : int
+        If greater than 1, index `num_proc` slices of the dataset in parallel worker processes,
+        each into its own sub-index, and merge the sub-indexes into `index_path`.
+    checkpoint_every : int
+        If set, commit the index and record the position in the dataset stream every `checkpoint_every` rows
+    resume : bool
+        If True, continue an interrupted build from its last checkpoint instead of starting over
+    auto_resources : bool
+        If True, choose `n_threads` and `memory_buffer` from the size of the dataset and the host's capacity
+    deduplicate : bool
+        If True, drop near-duplicate documents before indexing them. With `num_proc`, each worker
+        only removes duplicates within its own slice of the dataset.
+    dedup_mode : str
+        `drop` or `collapse`. `collapse` also writes `duplicates.jsonl` to the index directory, mapping
+        the ID of every removed document to the ID of the document it duplicates.
     
     See [docs](../../docs/arguments.md) for remaining argument definitions
 
@@ -175,27 +367,391 @@ def index_streaming_dataset(
     -------
     None
     """
-    
+    params = dict(locals())
+    if auto_resources:
+        nbytes, dataset_rows = dataset_size(dataset_name_or_path, split, ds_config_name)
+        n_threads, memory_buffer = plan_index_threads(nbytes, num_rows=dataset_rows, num_proc=num_proc)
+        auto_resources = False
+        params.update(n_threads=n_threads, memory_buffer=memory_buffer, auto_resources=auto_resources)
+
+    if num_proc > 1:
+        return _index_streaming_dataset_parallel(num_proc=num_proc, **{
+            k: v for k, v in params.items() if k != "num_proc"
+        })
+
+    if deduplicate and resume:
+        raise ValueError("Deduplication state is not checkpointed, so a deduplicated build cannot be resumed")
+
     args = parse_args(**locals(), for_otf_indexing=True)
-    if os.path.exists(dataset_name_or_path):
-        ds = load_from_local(dataset_name_or_path, split=split, streaming=True)
+    if not resume:
+        _clear_checkpoint(index_path)
+    checkpoint = _load_checkpoint(index_path) if resume else None
+    if checkpoint and checkpoint.get("complete"):
+        logger.info(f"Index at {index_path} is already complete. Nothing to resume.")
+        return None
+    if checkpoint_every:
+        # Intermediate commits should not merge segments; the index is optimized once at the end
+        args = [arg for arg in args if arg != "-optimize"]
+    start_row = checkpoint["rows"] if checkpoint else 0
+    num_docs = checkpoint["documents"] if checkpoint else 0
+    # Checkpoints written before length histograms were recorded have none
+    length_histogram = LengthHistogram.from_dict(checkpoint.get("length_histogram", {})) if checkpoint else LengthHistogram()
+    if checkpoint:
+        logger.info(f"Resuming indexing into {index_path} from row {start_row} ({num_docs} documents committed)")
+
+    ds = _load_streaming_dataset(dataset_name_or_path, split, ds_config_name)
+    if deduplicate and not doc_id_column:
+        # Record row positions before duplicates are dropped, so that positional IDs still match the dataset
+        ds = _with_positions(ds, shard_id=index_shard_id, num_shards=num_index_shards)
+        doc_id_column = POSITION_COLUMN
+    elif num_index_shards > 1 and doc_id_column:
+        # Document IDs come from the data, so each worker can read its own dataset shards
+        ds = split_dataset_by_node(ds, rank=index_shard_id, world_size=num_index_shards)
+    if start_row:
+        ds = ds.skip(start_row)
+    deduplicator = None
+    if deduplicate:
+        ds, deduplicator = deduplicate_dataset(ds, column_to_index, doc_id_column, mode=dedup_mode)
+
+    indexer = LuceneIndexer(args=args, append=checkpoint is not None)
+    start_time = time.perf_counter()
+    start_docs = num_docs
+
+    if batch_size:
+        batches = prefetch(_iter_document_batches(
+            ds, column_to_index, doc_id_column, batch_size,
+            shard_id=index_shard_id, num_shards=num_index_shards, start=start_row
+        ), max_prefetch=max_prefetch)
     else:
-        ds = load_from_hub(dataset_name_or_path, split=split,config_name=ds_config_name, streaming=True)
+        batches = _iter_documents(
+            ds, column_to_index, doc_id_column,
+            shard_id=index_shard_id, num_shards=num_index_shards, start=start_row
+        )
 
-    indexer = LuceneIndexer(args=args)
+    position = last_checkpoint = start_row
+    with tqdm(total=num_rows, initial=start_row, disable=disable_tqdm) as pbar:
+        for end, docs, lengths in batches:
+            if batch_size:
+                indexer.add_batch_raw(docs)
+            elif docs:
+                indexer.add_doc_raw(docs[0])
+            num_docs += len(docs)
+            length_histogram.add(lengths)
+            pbar.update(end - position)
+            position = end
+            if checkpoint_every and position - last_checkpoint >= checkpoint_every:
+                checkpoint = {"rows": position, "documents": num_docs, "length_histogram": length_histogram.to_dict()}
+                _write_checkpoint(index_path, checkpoint, pending=True)
+                indexer.close()
+                _write_checkpoint(index_path, checkpoint)
+                indexer = LuceneIndexer(args=args, append=True)
+                last_checkpoint = position
+
+    indexer.close()
+    if checkpoint_every:
+        _write_checkpoint(index_path, {
+            "rows": position, "documents": num_docs, "length_histogram": length_histogram.to_dict(), "complete": True
+        })
+        if optimize:
+            optimize_index(index_path)
+
+    elapsed = time.perf_counter() - start_time
+    indexed = num_docs - start_docs
+    logger.info(f"Indexed {indexed} documents in {elapsed:.1f}s ({indexed / max(elapsed, 1e-9):.1f} docs/sec)")
+    if deduplicator:
+        logger.info(f"Near-duplicate removal: {deduplicator.report(index_size=directory_size(index_path))}")
+        if dedup_mode == "collapse":
+            deduplicator.write_duplicates(os.path.join(index_path, "duplicates.jsonl"))
+
+    write_index_manifest(
+        index_path,
+        build_config={
+            "dataset": dataset_name_or_path, "split": split, "column_to_index": column_to_index,
+            "doc_id_column": doc_id_column, "deduplicate": deduplicate, "lucene_args": args
+        },
+        length_histograms={"contents": length_histogram}
+    )
+    return None
+
+
+def _index_streaming_dataset_parallel(index_path: str, num_proc: int, **kwargs) -> None:
+    """
+    Index `num_proc` slices of a dataset in worker processes and merge the resulting sub-indexes.
+    Workers are spawned rather than forked because each one starts its own JVM.
+    """
+    parts_path = f"{index_path}.parts"
+    part_paths = [os.path.join(parts_path, f"part-{rank:03d}") for rank in range(num_proc)]
+    num_rows = kwargs.pop("num_rows")
+    disable_tqdm = kwargs.pop("disable_tqdm")
+    optimize = kwargs.pop("optimize")
+    kwargs.pop("index_shard_id")
+    kwargs.pop("num_index_shards")
+
+    with ProcessPoolExecutor(max_workers=num_proc, mp_context=get_context("spawn")) as executor:
+        futures = [
+            executor.submit(
+                index_streaming_dataset,
+                **kwargs,
+                index_path=part_path,
+                index_shard_id=rank,
+                num_index_shards=num_proc,
+                num_rows=num_rows // num_proc if num_rows > 0 else num_rows,
+                disable_tqdm=disable_tqdm or rank > 0,
+                optimize=False,
+            ) for rank, part_path in enumerate(part_paths)
+        ]
+        for future in futures:
+            future.result()
+
+    length_histogram = LengthHistogram()
+    for part_path in part_paths:
+        length_histogram.merge(LengthHistogram.from_dict(read_index_manifest(part_path)["length_histograms"]["contents"]))
+    build_config = read_index_manifest(part_paths[0])["build_config"]
+
+    merge_indexes(part_paths, index_path, optimize=optimize)
+    write_index_manifest(index_path, build_config={**build_config, "num_proc": num_proc}, length_histograms={"contents": length_histogram})
+    shutil.rmtree(parts_path)
+    return None
 
-    for i, row in tqdm(enumerate(ds), total=num_rows, disable=disable_tqdm):
+
+def _with_positions(ds: Union[Dataset, IterableDataset], shard_id: int = 0, num_shards: int = 1) -> Union[Dataset, IterableDataset]:
+    """
+    Record the position of each row in the full dataset in `POSITION_COLUMN`, and keep the rows of slice `shard_id`
+    as positional IDs do. Positions are assigned before slicing: splitting a stream by its shards would
+    restart them in every worker.
+    """
+    ds = ds.map(lambda _, idx: {POSITION_COLUMN: idx}, with_indices=True)
+    if num_shards > 1:
+        ds = ds.filter(lambda row: row[POSITION_COLUMN] % num_shards == shard_id)
+    return ds
+
+
+def _load_streaming_dataset(dataset_name_or_path: str, split: str, ds_config_name: str = None) -> Union[Dataset, IterableDataset]:
+    return load_dataset_source(dataset_name_or_path, split=split, config_name=ds_config_name, streaming=True)
+
+
+def iter_document_batches(
+    ds: Union[Dataset, IterableDataset],
+    column_to_index: List[str],
+    doc_id_column: str = None,
+    batch_size: int = 1000,
+    shard_id: int = 0,
+    num_shards: int = 1,
+    start: int = 0,
+) -> Iterator[List[str]]:
+    """
+    Turn batches of dataset rows into batches of raw JSON documents for the `LuceneIndexer`
+
+    Parameters
+    ----------
+    ds : datasets.Dataset or datasets.IterableDataset
+        Dataset to read from
+    column_to_index : List[str]
+        Columns joined into the `contents` of each document
+    doc_id_column : str
+        Column to use as document ID. If None, use the position of the row in the dataset
+    batch_size : int
+        Number of rows per batch
+    shard_id : int
+        Zero-based id of the slice of positional documents to keep. Ignored if `doc_id_column` is set.
+    num_shards : int
+        Number of slices positional documents are split into. Ignored if `doc_id_column` is set.
+    start : int
+        Position in the full dataset of the first row of `ds`
+
+    Returns
+    -------
+    Iterator over lists of JSON documents
+    """
+    for _, docs, _ in _iter_document_batches(ds, column_to_index, doc_id_column, batch_size, shard_id, num_shards, start):
+        yield docs
+
+
+def _iter_document_batches(
+    ds: Union[Dataset, IterableDataset],
+    column_to_index: List[str],
+    doc_id_column: str = None,
+    batch_size: int = 1000,
+    shard_id: int = 0,
+    num_shards: int = 1,
+    start: int = 0,
+) -> Iterator[Tuple[int, List[str], np.ndarray]]:
+    """
+    Same as `iter_document_batches`, but also yields the position in the dataset after each batch
+    and the length of each document in tokens
+    """
+    offset = start
+    for batch in ds.with_format("arrow").iter(batch_size=batch_size):
+        num_batch_rows = batch.num_rows
+        if doc_id_column:
+            documents = build_documents(batch, column_to_index, doc_id_column)
+        else:
+            # Keep rows whose position in the full dataset falls in this slice
+            first = (shard_id - offset) % num_shards
+            if num_shards > 1:
+                batch = batch.take(pa.array(range(first, num_batch_rows, num_shards), type=pa.int64()))
+            documents = build_documents(batch, column_to_index, ids=range(offset + first, offset + num_batch_rows, num_shards))
+        offset += num_batch_rows
+        yield offset, documents_to_json(documents), LengthHistogram.token_counts(documents.column("contents"))
+
+
+def _iter_documents(
+    ds: Union[Dataset, IterableDataset],
+    column_to_index: List[str],
+    doc_id_column: str = None,
+    shard_id: int = 0,
+    num_shards: int = 1,
+    start: int = 0,
+) -> Iterator[Tuple[int, List[str], List[int]]]:
+    """
+    Row-at-a-time counterpart of `_iter_document_batches`. Rows outside the slice yield no document.
+    """
+    for i, row in enumerate(ds, start=start):
+        if not doc_id_column and i % num_shards != shard_id:
+            yield i + 1, [], []
+            continue
         contents = " ".join([row[column] for column in column_to_index])
-        indexer.add_doc_raw(json.dumps({"id": i if not doc_id_column else row[doc_id_column] , "contents": contents}))
+        doc = json.dumps({"id": i if not doc_id_column else row[doc_id_column] , "contents": contents})
+        yield i + 1, [doc], [len(contents.split())]
 
-    indexer.close()
 
+CHECKPOINT_FILENAME = "checkpoint.json"
+
+
+def _write_checkpoint(index_path: str, checkpoint: Dict[str, Any], pending: bool = False) -> None:
+    """
+    Atomically write a checkpoint next to the index. A pending checkpoint is written before
+    the index is committed, and promoted once the commit has succeeded.
+    """
+    path = os.path.join(index_path, CHECKPOINT_FILENAME)
+    target = f"{path}.pending" if pending else path
+    with open(f"{target}.tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{target}.tmp", target)
+    if not pending and os.path.exists(f"{path}.pending"):
+        os.remove(f"{path}.pending")
+
+
+def _clear_checkpoint(index_path: str) -> None:
+    path = os.path.join(index_path, CHECKPOINT_FILENAME)
+    for stale in [path, f"{path}.pending"]:
+        if os.path.exists(stale):
+            os.remove(stale)
+
+
+def _load_checkpoint(index_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Load the last checkpoint whose documents are all committed to the index, if any
+    """
+    path = os.path.join(index_path, CHECKPOINT_FILENAME)
+    if os.path.exists(f"{path}.pending"):
+        with open(f"{path}.pending") as f:
+            pending = json.load(f)
+        committed = None
+        if _has_index(index_path):
+            reader = IndexReader(index_path)
+            try:
+                committed = reader.stats()["documents"]
+            finally:
+                reader.reader.close()
+        # The process may have died between committing the index and promoting the checkpoint
+        if committed == pending["documents"]:
+            os.replace(f"{path}.pending", path)
+        else:
+            os.remove(f"{path}.pending")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _has_index(index_path: str) -> bool:
+    """
+    Whether a Lucene index has been committed to `index_path`
+    """
+    return os.path.isdir(index_path) and any(f.startswith("segments_") for f in os.listdir(index_path))
+
+
+def optimize_index(index_path: str) -> None:
+    """
+    Merge an index down to a single segment
+
+    Parameters
+    ----------
+    index_path : str
+        Path to index directory
+
+    Returns
+    -------
+    None
+    """
+    JFile = autoclass('java.io.File')
+    JFSDirectory = autoclass('org.apache.lucene.store.FSDirectory')
+    JIndexWriter = autoclass('org.apache.lucene.index.IndexWriter')
+    JIndexWriterConfig = autoclass('org.apache.lucene.index.IndexWriterConfig')
+    JOpenMode = autoclass('org.apache.lucene.index.IndexWriterConfig$OpenMode')
+
+    config = JIndexWriterConfig()
+    config.setOpenMode(JOpenMode.APPEND)
+    writer = JIndexWriter(JFSDirectory.open(JFile(index_path).toPath()), config)
+    try:
+        writer.forceMerge(1)
+        writer.commit()
+    finally:
+        writer.close()
+    return None
+
+
+def merge_indexes(index_paths: List[str], index_path: str, optimize: bool = False) -> None:
+    """
+    Merge Lucene indexes into a single index. Documents keep the IDs they were indexed with, but internal
+    Lucene docids follow the order of `index_paths` and differ from those of a single-process build.
+
+    Parameters
+    ----------
+    index_paths : List[str]
+        Paths to the indexes to merge, in order
+    index_path : str
+        Directory to store the merged index. Any index already there is replaced.
+    optimize : bool
+        If True, merge the result down to a single segment
+
+    Returns
+    -------
+    None
+    """
+    JFile = autoclass('java.io.File')
+    JFSDirectory = autoclass('org.apache.lucene.store.FSDirectory')
+    JIndexWriter = autoclass('org.apache.lucene.index.IndexWriter')
+    JIndexWriterConfig = autoclass('org.apache.lucene.index.IndexWriterConfig')
+    JOpenMode = autoclass('org.apache.lucene.index.IndexWriterConfig$OpenMode')
+
+    config = JIndexWriterConfig()
+    config.setOpenMode(JOpenMode.CREATE)
+    directory = JFSDirectory.open(JFile(index_path).toPath())
+    part_directories = []
+    try:
+        writer = JIndexWriter(directory, config)
+        try:
+            for path in index_paths:
+                part_directories.append(JFSDirectory.open(JFile(path).toPath()))
+                writer.addIndexes(part_directories[-1])
+            if optimize:
+                writer.forceMerge(1)
+            writer.commit()
+        finally:
+            writer.close()
+    finally:
+        for part_directory in part_directories:
+            part_directory.close()
+        directory.close()
     return None
 
 
 def fetch_index_stats(index_path: str) -> Dict[str, Any]:
     """
-    Fetch index statistics
+    Fetch index statistics. Statistics are read from the index manifest if it is up to date,
+    and from the index itself otherwise.
     index_path : str
         Path to index directory
     Returns
@@ -204,5 +760,8 @@ def fetch_index_stats(index_path: str) -> Dict[str, Any]:
     Dictionary Keys ==> total_terms, documents, unique_terms
     """
     assert os.path.exists(index_path), f"Index path {index_path} does not exist"
+    manifest = read_index_manifest(index_path)
+    if manifest is not None:
+        return manifest["stats"]
     index_reader = IndexReader(index_path)
     return index_reader.stats()
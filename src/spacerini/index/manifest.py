@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyserini.index.lucene import IndexReader
+
+MANIFEST_FILENAME = "spacerini_manifest.json"
+NUM_LENGTH_BUCKETS = 32
+
+
+class LengthHistogram:
+    """
+    Histogram of document lengths in whitespace-separated tokens, with power-of-two buckets.
+    Bucket 0 counts empty documents and bucket `i` counts documents of `2^(i-1)` to `2^i - 1` tokens.
+    """
+
+    def __init__(self, counts: List[int] = None):
+        self.counts = np.zeros(NUM_LENGTH_BUCKETS, dtype=np.int64)
+        if counts:
+            self.counts[:len(counts)] += counts
+
+    @staticmethod
+    def token_counts(texts: Union[pa.Array, pa.ChunkedArray, Iterable[str]]) -> np.ndarray:
+        """
+        Number of whitespace-separated tokens in each text
+        """
+        if isinstance(texts, (pa.Array, pa.ChunkedArray)):
+            lengths = pc.list_value_length(pc.utf8_split_whitespace(texts)).fill_null(0)
+            return lengths.to_numpy(zero_copy_only=False)
+        return np.array([len(text.split()) for text in texts], dtype=np.int64)
+
+    def add(self, lengths: np.ndarray) -> None:
+        """
+        Add a batch of document lengths, as returned by `token_counts`
+        """
+        lengths = np.asarray(lengths, dtype=np.int64)
+        buckets = np.zeros(len(lengths), dtype=np.int64)
+        nonempty = lengths > 0
+        buckets[nonempty] = np.floor(np.log2(lengths[nonempty])).astype(np.int64) + 1
+        self.counts += np.bincount(np.minimum(buckets, NUM_LENGTH_BUCKETS - 1), minlength=NUM_LENGTH_BUCKETS)
+
+    def update(self, texts: Union[pa.Array, pa.ChunkedArray, Iterable[str]]) -> None:
+        """
+        Add the lengths of a batch of documents
+        """
+        self.add(self.token_counts(texts))
+
+    def merge(self, other: "LengthHistogram") -> "LengthHistogram":
+        self.counts += other.counts
+        return self
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            ("0" if i == 0 else f"{2 ** (i - 1)}-{2 ** i - 1}"): int(count)
+            for i, count in enumerate(self.counts) if count
+        }
+
+    @classmethod
+    def from_dict(cls, histogram: Dict[str, int]) -> "LengthHistogram":
+        counts = [0] * NUM_LENGTH_BUCKETS
+        for bucket, count in histogram.items():
+            counts[0 if bucket == "0" else int(bucket.split("-")[0]).bit_length()] = count
+        return cls(counts)
+
+
+def _latest_commit(index_path: str) -> Optional[str]:
+    # Lucene names commit points segments_<generation>, with the generation in base 36
+    commits = [f for f in os.listdir(index_path) if f.startswith("segments_")]
+    return max(commits, key=lambda f: int(f[len("segments_"):], 36)) if commits else None
+
+
+def _checksum(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def write_index_manifest(
+    index_path: str,
+    build_config: Dict[str, Any] = None,
+    length_histograms: Dict[str, LengthHistogram] = None,
+) -> Dict[str, Any]:
+    """
+    Write a manifest of precomputed statistics next to an index, so that apps can show them without opening the index
+
+    Parameters
+    ----------
+    index_path : str
+        Path to index directory
+    build_config : Dict[str, Any]
+        Arguments the index was built with. Values that cannot be serialized to JSON are left out.
+    length_histograms : Dict[str, LengthHistogram]
+        Document length histogram of each indexed field
+
+    Returns
+    -------
+    The manifest
+    Dictionary Keys ==> stats, vocabulary_size, length_histograms, build_config, commit, checksum, created_at
+    """
+    stats = IndexReader(index_path).stats()
+    commit = _latest_commit(index_path)
+    build_config = {
+        k: v for k, v in (build_config or {}).items()
+        if isinstance(v, (str, int, float, bool, list, type(None)))
+    }
+    manifest = {
+        "stats": stats,
+        "vocabulary_size": stats["unique_terms"],
+        "length_histograms": {field: h.to_dict() for field, h in (length_histograms or {}).items()},
+        "build_config": build_config,
+        "commit": commit,
+        "checksum": _checksum(os.path.join(index_path, commit)),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    with open(os.path.join(index_path, f"{MANIFEST_FILENAME}.tmp"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(index_path, f"{MANIFEST_FILENAME}.tmp"), os.path.join(index_path, MANIFEST_FILENAME))
+    return manifest
+
+
+def read_index_manifest(index_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Read the manifest of an index
+
+    Parameters
+    ----------
+    index_path : str
+        Path to index directory
+
+    Returns
+    -------
+    The manifest, or None if there is none or the index was committed to after it was written
+    """
+    path = os.path.join(index_path, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    commit = _latest_commit(index_path)
+    if commit is None or commit != manifest.get("commit") or _checksum(os.path.join(index_path, commit)) != manifest.get("checksum"):
+        return None
+    return manifest
@@ -0,0 +1,164 @@
+import logging
+import math
+import os
+from typing import Optional, Tuple, TypedDict, Union
+
+from datasets import load_dataset_builder
+from datasets.utils.py_utils import convert_file_size_to_int
+
+from spacerini.index.utils import directory_size
+from spacerini.preprocess.utils import get_num_shards
+
+logger = logging.getLogger(__name__)
+
+MIN_MEMORY_BUFFER_MB = 256
+MAX_MEMORY_BUFFER_MB = 8192
+# Lucene indexing threads each hold their own in-memory segment, so we budget heap per thread
+MEMORY_PER_THREAD_MB = 512
+# Below this many rows per thread, extra indexing threads mostly contend with each other
+MIN_ROWS_PER_THREAD = 10000
+
+
+class IndexPlan(TypedDict):
+    n_threads: int
+    memory_buffer: str
+    num_shards: int
+    shard_size: int
+
+
+def available_memory() -> int:
+    """
+    Memory available to new processes in bytes, as reported by the OS
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def dataset_size(dataset_name_or_path: str, split: str, ds_config_name: str = None) -> Tuple[int, Optional[int]]:
+    """
+    Size of a dataset split in bytes and its number of rows, without downloading it.
+    For local files, directories and SQLite databases, the row count is unknown and returned as None.
+    Neither is known for ir_datasets sources, whose size is returned as 0.
+
+    Parameters
+    ----------
+    dataset_name_or_path : str
+        Name of HuggingFace dataset, or path to a local file or directory
+    split : str
+        Split of dataset
+    ds_config_name : str
+        Dataset configuration
+
+    Returns
+    -------
+    Tuple of (number of bytes, number of rows)
+    """
+    if dataset_name_or_path.startswith("sqlite:///"):
+        return os.path.getsize(dataset_name_or_path[len("sqlite:///"):]), None
+    if dataset_name_or_path.startswith("ir_datasets:"):
+        return 0, None
+    if os.path.isfile(dataset_name_or_path):
+        return os.path.getsize(dataset_name_or_path), None
+    if os.path.isdir(dataset_name_or_path):
+        return directory_size(dataset_name_or_path), None
+
+    info = load_dataset_builder(dataset_name_or_path, ds_config_name).info
+    if info.splits and split in info.splits:
+        return info.splits[split].num_bytes, info.splits[split].num_examples
+    return info.dataset_size or 0, None
+
+
+def plan_index_threads(
+    dataset_nbytes: Union[int, str],
+    num_rows: int = None,
+    memory_bytes: int = None,
+    cpu_count: int = None,
+    num_proc: int = 1,
+) -> Tuple[int, str]:
+    """
+    Choose indexing threads and RAM buffer from the dataset size and host capacity
+
+    See `plan_index_resources` for argument definitions
+
+    Returns
+    -------
+    Tuple of (number of threads, RAM buffer in MB) for each indexing process
+    """
+    memory_mb = (memory_bytes or available_memory()) // 2**20 // num_proc
+    if cpu_count is None:
+        cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    dataset_mb = convert_file_size_to_int(dataset_nbytes) // 2**20 or None
+
+    # Leave one core for the Python process feeding documents to Lucene
+    n_threads = max((cpu_count - num_proc) // num_proc, 1)
+    if num_rows:
+        n_threads = min(n_threads, max(num_rows // num_proc // MIN_ROWS_PER_THREAD, 1))
+
+    # Keep a quarter of the memory for the buffer: the JVM, Python and the page cache need the rest.
+    # A buffer larger than the data it will hold is wasted.
+    memory_buffer = min(memory_mb // 4, MAX_MEMORY_BUFFER_MB)
+    if dataset_mb:
+        memory_buffer = min(memory_buffer, max(2 * dataset_mb // num_proc, MIN_MEMORY_BUFFER_MB))
+    memory_buffer = max(memory_buffer, MIN_MEMORY_BUFFER_MB)
+    n_threads = max(min(n_threads, memory_mb // MEMORY_PER_THREAD_MB), 1)
+
+    logger.info(
+        f"Indexing plan for {dataset_mb or '?'} MB / {num_rows or '?'} rows on {cpu_count} CPUs "
+        f"and {memory_mb * num_proc} MB available memory: {n_threads} threads and a {memory_buffer} MB buffer per process"
+    )
+    return n_threads, str(memory_buffer)
+
+
+def plan_index_resources(
+    dataset_nbytes: Union[int, str],
+    num_rows: int = None,
+    memory_bytes: int = None,
+    cpu_count: int = None,
+    num_proc: int = 1,
+    max_shard_size: Union[int, str] = "1GB",
+) -> IndexPlan:
+    """
+    Choose indexing threads, RAM buffer and shard count from the dataset size and host capacity
+
+    Parameters
+    ----------
+    dataset_nbytes : int or str
+        Size of the dataset in bytes or as a string such as "10MB"
+    num_rows : int
+        Number of rows in the dataset, if known
+    memory_bytes : int
+        Memory available for indexing. Defaults to the memory currently available on the host.
+    cpu_count : int
+        Number of CPUs available for indexing. Defaults to the CPUs this process may run on.
+    num_proc : int
+        Number of indexing processes sharing the host. Threads and memory are split between them.
+    max_shard_size : int or str
+        Maximum size of a JSON shard
+
+    Returns
+    -------
+    IndexPlan
+        Threads and RAM buffer for each indexing process, and the number and size of JSON shards
+    """
+    n_threads, memory_buffer = plan_index_threads(dataset_nbytes, num_rows, memory_bytes, cpu_count, num_proc)
+    dataset_mb = convert_file_size_to_int(dataset_nbytes) // 2**20 or None
+
+    # Give every indexing thread at least one shard to work on
+    num_shards = max(get_num_shards(dataset_nbytes, max_shard_size), n_threads * num_proc)
+    if num_rows:
+        num_shards = min(num_shards, num_rows)
+    shard_size = math.ceil((dataset_mb or 1) * 2**20 / num_shards)
+    logger.info(f"Sharding the dataset into {num_shards} JSON shards of {shard_size} bytes")
+
+    return IndexPlan(
+        n_threads=n_threads,
+        memory_buffer=memory_buffer,
+        num_shards=num_shards,
+        shard_size=shard_size,
+    )
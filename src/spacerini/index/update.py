@@ -0,0 +1,199 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, Iterator, List, Literal, Tuple
+
+from pyserini.index.lucene import LuceneIndexer, IndexReader
+from pyserini.pyclass import autoclass
+from tqdm import tqdm
+
+from spacerini.index.index import _has_index, _load_streaming_dataset, parse_args
+from spacerini.index.manifest import write_index_manifest
+
+logger = logging.getLogger(__name__)
+
+DOC_HASHES_FILENAME = "doc_hashes.sqlite"
+
+
+def content_hash(contents: str) -> str:
+    """
+    Hash the contents of a document to detect changes between index updates
+    """
+    return hashlib.sha1(contents.encode("utf-8")).hexdigest()
+
+
+def _open_hash_store(index_path: str) -> sqlite3.Connection:
+    """
+    Open the sidecar database mapping each indexed document ID to the hash of its contents.
+    If the index has no sidecar yet, seed it with the IDs already in the index and no hashes,
+    so that every document still in the dataset is re-indexed once.
+    """
+    store_path = os.path.join(index_path, DOC_HASHES_FILENAME)
+    seed = not os.path.exists(store_path)
+    con = sqlite3.connect(store_path)
+    con.execute("CREATE TABLE IF NOT EXISTS doc_hashes (docid TEXT PRIMARY KEY, hash TEXT)")
+    if seed and _has_index(index_path):
+        reader = IndexReader(index_path)
+        try:
+            # Internal docids run up to maxDoc, which counts deleted documents too
+            live_docs = autoclass('org.apache.lucene.index.MultiBits').getLiveDocs(reader.reader)
+            con.executemany(
+                "INSERT OR IGNORE INTO doc_hashes VALUES (?, NULL)",
+                (
+                    (reader.convert_internal_docid_to_collection_docid(i),)
+                    for i in range(reader.reader.maxDoc())
+                    if live_docs is None or live_docs.get(i)
+                )
+            )
+        finally:
+            reader.reader.close()
+        con.commit()
+    return con
+
+
+def _iter_rows(ds, column_to_index: List[str], doc_id_column: str, batch_size: int) -> Iterator[Tuple[str, str]]:
+    for batch in ds.iter(batch_size=batch_size):
+        contents = [" ".join(values) for values in zip(*[batch[column] for column in column_to_index])]
+        yield from zip(map(str, batch[doc_id_column]), contents)
+
+
+def _delete_documents(index_path: str, docids: Iterator[str]) -> None:
+    JFile = autoclass('java.io.File')
+    JFSDirectory = autoclass('org.apache.lucene.store.FSDirectory')
+    JIndexWriter = autoclass('org.apache.lucene.index.IndexWriter')
+    JIndexWriterConfig = autoclass('org.apache.lucene.index.IndexWriterConfig')
+    JOpenMode = autoclass('org.apache.lucene.index.IndexWriterConfig$OpenMode')
+    JTerm = autoclass('org.apache.lucene.index.Term')
+
+    config = JIndexWriterConfig()
+    config.setOpenMode(JOpenMode.APPEND)
+    writer = JIndexWriter(JFSDirectory.open(JFile(index_path).toPath()), config)
+    try:
+        for docid in docids:
+            writer.deleteDocuments(JTerm("id", docid))
+        writer.commit()
+    finally:
+        writer.close()
+
+
+def update_index(
+    index_path: str,
+    dataset_name_or_path: str,
+    split: str,
+    column_to_index: List[str],
+    doc_id_column: str,
+    ds_config_name: str = None,
+    disable_tqdm: bool = False,
+    batch_size: int = 1000,
+    language: str = "en",
+    pretokenized: bool = False,
+    analyzeWithHuggingFaceTokenizer: str = None,
+    storePositions: bool = True,
+    storeDocvectors: bool = False,
+    storeContents: bool = False,
+    storeRaw: bool = False,
+    keepStopwords: bool = False,
+    stopwords: str = None,
+    stemmer:  Literal["porter", "krovetz"] = "porter",
+    optimize: bool = False,
+    verbose: bool = False,
+    quiet: bool = True,
+    memory_buffer: str = "4096",
+    n_threads: int = 5,
+) -> Dict[str, int]:
+    """Bring an existing index in line with a dataset without rebuilding it
+
+    New documents are added, documents whose contents changed are replaced and documents
+    whose ID no longer appears in the dataset are deleted. Unchanged documents are not re-analyzed.
+    Changes are detected with a hash of each document's contents, kept in a sidecar database
+    next to the index. The first update of an index built without this sidecar re-indexes every document.
+    The update can safely be re-run after a failure.
+
+    Parameters
+    ----------
+    index_path : str
+        Directory of the index to update. Created if it does not exist.
+    dataset_name_or_path : str
+        Name of HuggingFace dataset or path to local dataset
+    split : str
+        Split of dataset to index
+    column_to_index : List[str]
+        Columns of dataset to index
+    doc_id_column : str
+        Column of dataset to use as document ID. Positional IDs cannot be used to match documents between updates.
+    ds_config_name: str
+        Dataset configuration to stream
+    batch_size : int
+        Number of rows read from the dataset at a time
+
+    See [docs](../../docs/arguments.md) for remaining argument definitions
+
+    Returns
+    -------
+    Dictionary of update counts
+    Dictionary Keys ==> added, updated, deleted, unchanged
+    """
+    if not doc_id_column:
+        raise ValueError("Updating an index requires `doc_id_column`")
+
+    args = parse_args(**locals(), for_otf_indexing=True)
+    start_time = time.perf_counter()
+    os.makedirs(index_path, exist_ok=True)
+    con = _open_hash_store(index_path)
+    con.execute("CREATE TEMP TABLE seen (docid TEXT PRIMARY KEY, hash TEXT)")
+
+    # Pass 1: diff the dataset against the stored hashes, spooling documents to (re-)index
+    counts = {"added": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    spool_path = os.path.join(index_path, "update-spool.jsonl")
+    ds = _load_streaming_dataset(dataset_name_or_path, split, ds_config_name)
+    with open(spool_path, "w") as spool:
+        for docid, contents in tqdm(_iter_rows(ds, column_to_index, doc_id_column, batch_size), disable=disable_tqdm):
+            digest = content_hash(contents)
+            stored = con.execute("SELECT hash FROM doc_hashes WHERE docid = ?", (docid,)).fetchone()
+            con.execute("INSERT OR REPLACE INTO seen VALUES (?, ?)", (docid, digest))
+            if stored is not None and stored[0] == digest:
+                counts["unchanged"] += 1
+                continue
+            counts["added" if stored is None else "updated"] += 1
+            spool.write(json.dumps({"id": docid, "contents": contents}) + "\n")
+
+    # Pass 2: delete stale versions. New documents are deleted too, so that re-running
+    # an interrupted update never leaves duplicates behind.
+    removed = [r[0] for r in con.execute("SELECT docid FROM doc_hashes WHERE docid NOT IN (SELECT docid FROM seen)")]
+    counts["deleted"] = len(removed)
+    if _has_index(index_path):
+        changed = (r[0] for r in con.execute(
+            "SELECT s.docid FROM seen s LEFT JOIN doc_hashes d ON s.docid = d.docid "
+            "WHERE d.hash IS NULL OR d.hash != s.hash"
+        ))
+        _delete_documents(index_path, iter([*removed, *changed]))
+
+    # Pass 3: index new and changed documents
+    indexer = LuceneIndexer(args=args, append=True)
+    with open(spool_path) as spool:
+        docs = []
+        for line in spool:
+            docs.append(line.rstrip("\n"))
+            if len(docs) == batch_size:
+                indexer.add_batch_raw(docs)
+                docs = []
+        if docs:
+            indexer.add_batch_raw(docs)
+    indexer.close()
+    os.remove(spool_path)
+
+    # Only record the new hashes once the index has been committed
+    con.executemany("DELETE FROM doc_hashes WHERE docid = ?", ((docid,) for docid in removed))
+    con.execute("INSERT OR REPLACE INTO doc_hashes SELECT docid, hash FROM seen")
+    con.commit()
+    con.close()
+    write_index_manifest(index_path, build_config={
+        "dataset": dataset_name_or_path, "split": split, "column_to_index": column_to_index,
+        "doc_id_column": doc_id_column, "lucene_args": args
+    })
+
+    logger.info(f"Updated {index_path} in {time.perf_counter() - start_time:.1f}s: {counts}")
+    return counts
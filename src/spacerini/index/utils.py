@@ -1,3 +1,4 @@
+import os
 import shutil
 import logging
 from huggingface_hub import HfApi, create_repo, upload_folder, snapshot_download
@@ -5,6 +6,15 @@ from huggingface_hub import HfApi, create_repo, upload_folder, snapshot_download
 logger = logging.getLogger(__name__)
 
 
+def directory_size(path: str) -> int:
+    """
+    Total size in bytes of the files under a directory
+    """
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    )
+
+
 def push_index_to_hub(
     dataset_slug: str,
     index_path: str,
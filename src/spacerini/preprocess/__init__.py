@@ -1 +1,2 @@
-from . import tokenize, utils
\ No newline at end of file
+from . import dedup, tokenize, utils
+from .dedup import MinHashDeduplicator, deduplicate_dataset
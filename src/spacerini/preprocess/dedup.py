@@ -0,0 +1,204 @@
+import json
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Literal, Optional, Tuple, TypedDict, Union
+
+import numpy as np
+from datasets import Dataset, IterableDataset
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+class DedupStats(TypedDict):
+    documents: int
+    removed: int
+    bytes: int
+    removed_bytes: int
+
+
+class MinHashDeduplicator:
+    """
+    Streaming near-duplicate detector based on MinHash signatures and locality-sensitive hashing.
+
+    Documents are compared through `num_bands` bands of `num_perm // num_bands` MinHash values each.
+    A document is a near-duplicate if any of its bands matches a band of a document seen before.
+    Pairs with Jaccard similarity `s` over word n-grams collide with probability `1 - (1 - s^r)^b`,
+    so the similarity threshold is roughly `(1 / b) ^ (1 / r)`: about 0.88 with the defaults.
+
+    The band index keeps at most `max_entries` keys. Once full, the oldest keys are evicted, so
+    duplicates further apart in the stream than the index can remember are not detected.
+    """
+
+    def __init__(
+        self,
+        num_perm: int = 128,
+        num_bands: int = 8,
+        ngram_size: int = 5,
+        max_entries: int = 5_000_000,
+        max_shingles_per_chunk: int = 65536,
+        seed: int = 42,
+    ):
+        if num_perm % num_bands:
+            raise ValueError("`num_perm` must be a multiple of `num_bands`")
+        self.num_perm = num_perm
+        self.num_bands = num_bands
+        self.rows_per_band = num_perm // num_bands
+        self.ngram_size = ngram_size
+        self.max_entries_per_band = max(max_entries // num_bands, 1)
+        self.max_shingles_per_chunk = max_shingles_per_chunk
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 2**31 - 1, size=(num_perm, 1)).astype(np.uint64)
+        self._b = rng.randint(0, 2**31 - 1, size=(num_perm, 1)).astype(np.uint64)
+        self._bands = [OrderedDict() for _ in range(num_bands)]
+        self.stats = DedupStats(documents=0, removed=0, bytes=0, removed_bytes=0)
+        self.duplicates: List[Tuple[Any, Any]] = []
+
+    def _shingle_hashes(self, text: str) -> List[int]:
+        tokens = text.split()
+        if len(tokens) < self.ngram_size:
+            return [zlib.crc32(" ".join(tokens).encode("utf-8"))]
+        return [
+            zlib.crc32(" ".join(tokens[i:i + self.ngram_size]).encode("utf-8"))
+            for i in range(len(tokens) - self.ngram_size + 1)
+        ]
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """
+        Compute MinHash signatures for a batch of texts
+
+        Parameters
+        ----------
+        texts : List[str]
+            Texts to sign
+
+        Returns
+        -------
+        np.ndarray
+            A `(len(texts), num_perm)` array of MinHash values
+        """
+        signatures = np.empty((len(texts), self.num_perm), dtype=np.uint64)
+        start = 0
+        while start < len(texts):
+            # Permute the shingles of as many documents as fit in one chunk with a single matrix operation
+            hashes, lengths = [], []
+            end = start
+            while end < len(texts) and (not lengths or sum(lengths) < self.max_shingles_per_chunk):
+                shingles = self._shingle_hashes(texts[end])
+                hashes.extend(shingles)
+                lengths.append(len(shingles))
+                end += 1
+            shingles = np.asarray(hashes, dtype=np.uint64)[None, :]
+            permuted = (self._a * shingles + self._b) % _MERSENNE_PRIME & _MAX_HASH
+            offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            signatures[start:end] = np.minimum.reduceat(permuted, offsets, axis=1).T
+            start = end
+        return signatures
+
+    def filter_batch(self, texts: List[str], ids: List[Any] = None) -> List[bool]:
+        """
+        Register a batch of documents and flag the ones to keep
+
+        Parameters
+        ----------
+        texts : List[str]
+            Contents of the documents, in stream order
+        ids : List
+            IDs of the documents. Used to record which kept document each duplicate collapses into.
+
+        Returns
+        -------
+        List[bool]
+            True for documents that are not near-duplicates of an earlier document
+        """
+        collapse = ids is not None
+        ids = ids if collapse else [None] * len(texts)
+        signatures = self.signatures(texts)
+        keep = []
+        for text, docid, signature in zip(texts, ids, signatures):
+            keys = [
+                signature[i * self.rows_per_band:(i + 1) * self.rows_per_band].tobytes()
+                for i in range(self.num_bands)
+            ]
+            original = next((band[key] for band, key in zip(self._bands, keys) if key in band), None)
+            num_bytes = len(text.encode("utf-8"))
+            self.stats["documents"] += 1
+            self.stats["bytes"] += num_bytes
+
+            if original is not None:
+                self.stats["removed"] += 1
+                self.stats["removed_bytes"] += num_bytes
+                if collapse:
+                    self.duplicates.append((docid, original[0]))
+                keep.append(False)
+                continue
+
+            for band, key in zip(self._bands, keys):
+                # Wrap the ID so that a None ID still marks the key as present
+                band[key] = (docid,)
+                if len(band) > self.max_entries_per_band:
+                    band.popitem(last=False)
+            keep.append(True)
+        return keep
+
+    def report(self, index_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Summarize what was removed. If the size of the index built from the kept documents is given,
+        also estimate how much larger it would have been with the duplicates.
+        """
+        report = dict(self.stats)
+        kept_bytes = self.stats["bytes"] - self.stats["removed_bytes"]
+        if index_size is not None and kept_bytes:
+            report["estimated_index_bytes_saved"] = int(index_size * self.stats["removed_bytes"] / kept_bytes)
+        return report
+
+    def write_duplicates(self, path: str) -> None:
+        """
+        Write the ID of every removed document along with the ID of the kept document it collapses into
+        """
+        with open(path, "w") as f:
+            for docid, original in self.duplicates:
+                f.write(json.dumps({"id": docid, "duplicate_of": original}) + "\n")
+
+
+def deduplicate_dataset(
+    ds: Union[Dataset, IterableDataset],
+    column_to_index: List[str],
+    doc_id_column: str = None,
+    mode: Literal["drop", "collapse"] = "drop",
+    deduplicator: MinHashDeduplicator = None,
+    batch_size: int = 1000,
+) -> Tuple[Union[Dataset, IterableDataset], MinHashDeduplicator]:
+    """
+    Drop near-duplicate rows from a dataset, keeping the first occurrence.
+    On an `IterableDataset`, rows are checked lazily as the dataset is streamed.
+
+    Parameters
+    ----------
+    ds : datasets.Dataset or datasets.IterableDataset
+        Dataset to deduplicate
+    column_to_index : List[str]
+        Columns whose contents are compared
+    doc_id_column : str
+        Column to use as document ID
+    mode : str
+        `drop` only removes duplicates. `collapse` also records the ID of the kept document
+        each duplicate maps to, see `MinHashDeduplicator.write_duplicates`.
+    deduplicator : MinHashDeduplicator
+        Deduplicator to use. Defaults to one with default parameters.
+    batch_size : int
+        Number of rows signed at a time
+
+    Returns
+    -------
+    The filtered dataset, and the deduplicator holding the statistics once the dataset has been consumed
+    """
+    deduplicator = deduplicator or MinHashDeduplicator()
+
+    def _keep(batch: Dict[str, list]) -> List[bool]:
+        texts = [" ".join(values) for values in zip(*[batch[column] for column in column_to_index])]
+        ids = batch[doc_id_column] if mode == "collapse" and doc_id_column else None
+        return deduplicator.filter_batch(texts, ids)
+
+    return ds.filter(_keep, batched=True, batch_size=batch_size), deduplicator
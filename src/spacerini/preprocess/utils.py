@@ -1,10 +1,222 @@
-from typing import Union
-from datasets import Dataset
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import get_context
+from typing import Dict, Iterable, List, Literal, Union
+from datasets import Dataset, load_from_disk
 from datasets.utils.py_utils import convert_file_size_to_int
+import gzip
+import json
 import os
+import tempfile
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 
 
-def shard_dataset(hf_dataset: Dataset, shard_size: Union[int, str], shards_paths: str, column_to_index: str) -> None: # TODO break this up into smaller functions
+def build_documents(
+    batch: Union[pa.Table, pa.RecordBatch, Dict[str, list]],
+    column_to_index: Union[str, List[str]],
+    doc_id_column: str = None,
+    ids: Iterable = None,
+) -> pa.Table:
+    """
+    Assemble a batch of rows into Pyserini documents with Arrow compute kernels.
+    Parameters
+    ----------
+    batch : pyarrow.Table, pyarrow.RecordBatch or dict
+        A batch of dataset rows
+    column_to_index : str or List[str]
+        The column(s) joined with a space into the `contents` of each document.
+    doc_id_column : str
+        The column to use as document ID.
+    ids : Iterable
+        Document IDs to use if `doc_id_column` is not set. Defaults to the position of each row in the batch.
+    
+    Returns
+    -------
+    pyarrow.Table
+        A table with an `id` and a `contents` column
+    """
+    if not isinstance(batch, (pa.Table, pa.RecordBatch)):
+        batch = pa.Table.from_pydict(batch)
+    if isinstance(column_to_index, str):
+        column_to_index = [column_to_index]
+
+    columns = [batch.column(column) for column in column_to_index]
+    if len(columns) == 1:
+        contents = columns[0]
+    else:
+        contents = pc.binary_join_element_wise(*columns, " ", null_handling="skip")
+
+    if doc_id_column:
+        ids = batch.column(doc_id_column)
+    else:
+        ids = pa.array(range(batch.num_rows) if ids is None else ids, type=pa.int64())
+    return pa.table({"id": ids, "contents": contents})
+
+
+def documents_to_json(documents: pa.Table) -> List[str]:
+    """
+    Serialize a table of documents into one JSON string per document with Arrow compute kernels.
+    Python strings are only created for the final lines.
+    Parameters
+    ----------
+    documents : pyarrow.Table
+        A table of documents, as returned by `build_documents`
+    
+    Returns
+    -------
+    List[str]
+    """
+    if documents.num_rows == 0:
+        return []
+    fields = [
+        pc.binary_join_element_wise(f"{json.dumps(name)}:", _json_values(documents.column(name)), "")
+        for name in documents.column_names
+    ]
+    lines = pc.binary_join_element_wise("{", pc.binary_join_element_wise(*fields, ","), "}", "")
+    return lines.to_pylist()
+
+
+_JSON_ESCAPES = {"\\": "\\\\", '"': '\\"', "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+
+def _json_values(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Serialize each value of a column as JSON, nulls included
+    """
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        # Each escape is a pass over the column, so only run those whose character occurs.
+        # Bytes below 0x80 never occur within multi-byte UTF-8 sequences.
+        present = set()
+        for chunk in column.chunks:
+            data = chunk.buffers()[2]
+            if data is not None:
+                data = np.frombuffer(data, dtype=np.uint8)
+                present.update(np.unique(data[data < 0x20]).tolist())
+                present.update(code for code in [ord('"'), ord("\\")] if (data == code).any())
+        # Backslashes first, so that the escapes added next are not escaped again
+        for char in sorted(map(chr, present), key=lambda char: char != "\\"):
+            column = pc.replace_substring(column, char, _JSON_ESCAPES.get(char, f"\\u{ord(char):04x}"))
+        values = pc.binary_join_element_wise('"', column, '"', "")
+    elif pa.types.is_integer(column.type) or pa.types.is_boolean(column.type):
+        values = pc.cast(column, pa.string())
+    else:
+        values = pa.chunked_array([pa.array([json.dumps(value, default=str) for value in column.to_pylist()], pa.string())])
+    return pc.fill_null(values, "null")
+
+
+def prepare_documents(hf_dataset: Dataset, column_to_index: Union[str, List[str]], doc_id_column: str = None) -> Dataset:
+    """
+    Reduce a dataset to the `id` and `contents` columns Pyserini expects.
+    Parameters
+    ----------
+    hf_dataset : datasets.Dataset
+        a Hugging Face datasets object
+    column_to_index : str or List[str]
+        The column(s) to index.
+    doc_id_column : str
+        The column to use as document ID. If None, IDs are row positions.
+    
+    Returns
+    -------
+    datasets.Dataset
+    """
+    return hf_dataset.with_format("arrow").map(
+        lambda batch, indices: build_documents(batch, column_to_index, doc_id_column=doc_id_column, ids=indices),
+        batched=True,
+        with_indices=True,
+        remove_columns=hf_dataset.column_names,
+    ).with_format(None)
+
+
+def memory_map_dataset(hf_dataset: Dataset, path: str) -> Dataset:
+    """
+    Back a dataset with files on disk, so that it is sent to worker processes by path.
+    An in-memory dataset is pickled with all of its data for every task it is submitted to.
+    Parameters
+    ----------
+    hf_dataset : datasets.Dataset
+        a Hugging Face datasets object
+    path : str
+        The directory to save an in-memory dataset to. It must outlive the returned dataset.
+    
+    Returns
+    -------
+    datasets.Dataset
+        The dataset itself if it is already backed by cache files, else a memory-mapped copy
+    """
+    if hf_dataset.cache_files:
+        return hf_dataset
+    hf_dataset.save_to_disk(path)
+    return load_from_disk(path)
+
+
+SHARD_EXTENSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def open_shard(path: str, mode: str = "rt"):
+    """
+    Open a JSONL shard, decompressing it according to its extension.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    if path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd-compressed shards require the `zstandard` package: pip install spacerini[zstd]") from None
+        return zstandard.open(path, mode)
+    return open(path, mode)
+
+
+def write_shard(
+    hf_dataset: Dataset,
+    num_shards: int,
+    shard_index: int,
+    shards_paths: str,
+    compression: Literal["gzip", "zstd"] = None,
+) -> str:
+    """
+    Write one contiguous shard of a dataset of documents as a JSONL file.
+    Parameters
+    ----------
+    hf_dataset : datasets.Dataset
+        a dataset of documents, as returned by `prepare_documents`
+    num_shards : int
+        The number of shards the dataset is split into.
+    shard_index : int
+        The index of the shard to write.
+    shards_paths : str
+        The path to the directory where the shards are stored.
+    compression : str, optional
+        Compress the shard with `gzip` or `zstd`.
+    
+    Returns
+    -------
+    str
+        The path to the shard
+    """
+    path = f"{shards_paths}/docs-{shard_index:03d}.jsonl{SHARD_EXTENSIONS[compression]}"
+    shard = hf_dataset.shard(num_shards=num_shards, index=shard_index, contiguous=True)
+    if compression == "zstd":
+        # datasets only compresses with the codecs pandas supports natively
+        with open_shard(path, "wb") as f:
+            shard.to_json(f, orient="records", lines=True)
+    else:
+        shard.to_json(path, orient="records", lines=True, compression=compression)
+    return path
+
+
+def shard_dataset(
+    hf_dataset: Dataset,
+    shard_size: Union[int, str],
+    shards_paths: str,
+    column_to_index: Union[str, List[str]],
+    doc_id_column: str = None,
+    num_proc: int = 1,
+    compression: Literal["gzip", "zstd"] = None,
+) -> List[str]:
     """
     Shard a dataset into multiple files.
     Parameters
@@ -15,21 +227,35 @@ def shard_dataset(hf_dataset: Dataset, shard_size: Union[int, str], shards_paths
         The size of each arrow shard that gets written as a JSON file.
     shards_paths : str
         The path to the directory where the shards will be stored.
-    column_to_index : str
-        The column to index mapping.
+    column_to_index : str or List[str]
+        The column(s) to index.
+    doc_id_column : str, optional
+        The column to use as document ID. If None, IDs are row positions.
+    num_proc : int, optional
+        The number of processes writing shards concurrently.
+    compression : str, optional
+        Compress shards with `gzip` or `zstd`. Anserini's JsonCollection reads gzip shards directly.
+        zstd requires the `zstd` extra, and its shards can only be indexed by `index_dataset_pipelined`,
+        as Anserini does not read `.zst` files.
     
     Returns
     -------
-    None
+    List[str]
+        The paths to the shards
     """
-    hf_dataset = hf_dataset.remove_columns([c for c in hf_dataset.column_names if c!=column_to_index])
-    hf_dataset = hf_dataset.rename_column(column_to_index, "contents") # pyserini only wants a content column and an index column
-    hf_dataset = hf_dataset.add_column("id", range(len(hf_dataset)))
+    hf_dataset = prepare_documents(hf_dataset, column_to_index, doc_id_column=doc_id_column)
     num_shards = get_num_shards(hf_dataset.data.nbytes, shard_size)
     os.makedirs(shards_paths, exist_ok=True)
-    for shard_index in range(num_shards):
-        shard = hf_dataset.shard(num_shards=num_shards, index=shard_index, contiguous=True)
-        shard.to_json(f"{shards_paths}/docs-{shard_index:03d}.jsonl", orient="records", lines=True)
+    if num_proc <= 1:
+        return [write_shard(hf_dataset, num_shards, i, shards_paths, compression) for i in range(num_shards)]
+
+    with tempfile.TemporaryDirectory(dir=shards_paths) as dataset_path, \
+            ProcessPoolExecutor(max_workers=num_proc, mp_context=get_context("spawn")) as executor:
+        hf_dataset = memory_map_dataset(hf_dataset, dataset_path)
+        return list(executor.map(
+            write_shard,
+            repeat(hf_dataset), repeat(num_shards), range(num_shards), repeat(shards_paths), repeat(compression)
+        ))
 
 
 def get_num_shards(dataset_size: Union[int, str], max_shard_size: Union[int, str]) -> int:
@@ -1,2 +1,2 @@
 from . import utils
-from .utils import init_searcher, result_indices, result_page
\ No newline at end of file
+from .utils import batch_result_indices, build_query_cache, hydrated_result_page, init_searcher, query_encoder_class, result_indices, result_page
\ No newline at end of file
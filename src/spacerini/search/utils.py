@@ -1,3 +1,5 @@
+import json
+import os
 from enum import Enum
 from typing import Dict
 from typing import List
@@ -12,11 +14,21 @@ from pyserini.search import DenseSearchResult
 from pyserini.search import JLuceneSearcherResult
 from pyserini.search.faiss.__main__ import init_query_encoder
 from pyserini.search.faiss import FaissSearcher
-from pyserini.search.hybrid import HybridSearcher
 from pyserini.search.lucene import LuceneSearcher
 
+from spacerini.index.encode import default_device
+from spacerini.index.faiss_index import set_search_params
+from spacerini.spacerini_utils.cache import QUERY_WARM_FILENAME, CachedQueryEncoder, CachedSearcher, build_query_warm_file
+from spacerini.spacerini_utils.documents import DocumentHydrator
+from spacerini.spacerini_utils.hybrid import ConcurrentHybridSearcher, Fusion
+from spacerini.spacerini_utils.onnx_encoder import init_onnx_encoder
+from spacerini.spacerini_utils.search import batch_search
+
 Encoder = Literal["dkrr", "dpr", "tct_colbert", "ance", "sentence", "contriever", "auto"]
 
+# Document encoder classes of pyserini whose query encoder class is named differently
+QUERY_ENCODER_CLASSES = {"sentence-transformers": "sentence"}
+
 
 class AnalyzerArgs(TypedDict):
     language: str
@@ -41,8 +53,16 @@ def init_searcher(
     encoder_class: Encoder = None, 
     tokenizer_name: str = None,
     device: str = None,
-    prefix: str = None
-) -> Union[FaissSearcher, HybridSearcher, LuceneSearcher]:
+    prefix: str = None,
+    nprobe: int = None,
+    ef_search: int = None,
+    query_encoder_backend: Literal["torch", "onnx"] = "torch",
+    cache_size: int = 0,
+    cache_ttl: float = 3600,
+    query_cache_size: int = 0,
+    query_warm_file: str = None,
+    fusion: Fusion = "interpolation",
+) -> Union[FaissSearcher, ConcurrentHybridSearcher, LuceneSearcher, CachedSearcher]:
     """
     Initialize and return an approapriate searcher
     
@@ -59,15 +79,34 @@ def init_searcher(
     tokenizer_name: str
         Tokenizer name or path
     device: str
-        Device to load Query encoder on. 
+        Device to load Query encoder on. Defaults to the first GPU if there is one, else CPU.
     prefix: str
         Query prefix if exists
+    nprobe: int
+        Number of inverted lists visited per query by an IVF dense index. Higher is slower and more accurate.
+    ef_search: int
+        Size of the candidate list of an HNSW dense index. Higher is slower and more accurate.
+    query_encoder_backend: str
+        `torch` to run the query encoder with pyserini on `device`, or `onnx` to run an int8-quantized
+        ONNX export of it on CPU. The `onnx` backend supports the `auto`, `sentence` and `contriever` encoder classes.
+    cache_size: int
+        If positive, cache the results of this many queries, see `CachedSearcher`
+    cache_ttl: float
+        Seconds after which cached results expire
+    query_cache_size: int
+        If positive, cache the embeddings of this many queries, see `CachedQueryEncoder`
+    query_warm_file: str
+        Warm file of query embeddings loaded into the query embedding cache, see `build_query_warm_file`.
+        Defaults to `query_embeddings.npz` in `dense_index_path`, if it exists.
+    fusion: str
+        How a hybrid searcher fuses sparse and dense results, `interpolation` or `rrf`. See `ConcurrentHybridSearcher`.
 
     Returns
     -------
     Searcher: 
         A sparse, dense or hybrid searcher
     """
+    config = {k: v for k, v in locals().items() if k not in ["cache_size", "cache_ttl", "query_cache_size", "query_warm_file"]}
     if sparse_index_path:
         ssearcher = LuceneSearcher(sparse_index_path)
         if analyzer_args:
@@ -77,25 +116,115 @@ def init_searcher(
                 ssearcher.set_bm25(bm25_k1, bm25_b)
 
     if dense_index_path:
-        encoder = init_query_encoder(
-            encoder=encoder_name_or_path,
-            encoder_class=encoder_class,
-            tokenizer_name=tokenizer_name,
-            topics_name=None,
-            encoded_queries=None,
-            device=device,
-            prefix=prefix
+        encoder = _init_query_encoder(
+            encoder_name_or_path, encoder_class, tokenizer_name, device, prefix, query_encoder_backend
         )
+        if query_cache_size > 0:
+            encoder = CachedQueryEncoder(
+                encoder, _query_encoder_name(encoder_name_or_path, query_encoder_backend),
+                max_size=query_cache_size, encoder_class=encoder_class,
+                warm_file=query_warm_file or os.path.join(dense_index_path, QUERY_WARM_FILENAME),
+            )
 
         dsearcher = FaissSearcher(dense_index_path, encoder)
+        set_search_params(dsearcher.index, nprobe=nprobe, ef_search=ef_search)
 
         if sparse_index_path:
-            hsearcher = HybridSearcher(dense_searcher=dsearcher, sparse_searcher=ssearcher)
-            return hsearcher
+            searcher = ConcurrentHybridSearcher(dense_searcher=dsearcher, sparse_searcher=ssearcher, fusion=fusion)
         else:
-            return dsearcher
-    
-    return ssearcher
+            searcher = dsearcher
+    else:
+        searcher = ssearcher
+
+    if cache_size > 0:
+        searcher = CachedSearcher(searcher, max_size=cache_size, ttl=cache_ttl, config=config)
+    return searcher
+
+
+def query_encoder_class(encoder_class: str) -> Encoder:
+    """
+    Return the query encoder class matching a pyserini document encoder class, e.g. `sentence` for `sentence-transformers`
+
+    Parameters
+    ----------
+    encoder_class: str
+        Document encoder class, as passed to `encode_dataset`
+
+    Returns
+    -------
+    str
+        Query encoder class, as passed to `init_searcher` and `build_query_cache`
+    """
+    return QUERY_ENCODER_CLASSES.get(encoder_class, encoder_class)
+
+
+def _init_query_encoder(
+    encoder_name_or_path: str,
+    encoder_class: Encoder = None,
+    tokenizer_name: str = None,
+    device: str = None,
+    prefix: str = None,
+    query_encoder_backend: Literal["torch", "onnx"] = "torch",
+):
+    if query_encoder_backend == "onnx":
+        return init_onnx_encoder(encoder_name_or_path, encoder_class, prefix=prefix)
+    return init_query_encoder(
+        encoder=encoder_name_or_path,
+        encoder_class=encoder_class,
+        tokenizer_name=tokenizer_name,
+        topics_name=None,
+        encoded_queries=None,
+        device=device or default_device(),
+        prefix=prefix
+    )
+
+
+def _query_encoder_name(encoder_name_or_path: str, query_encoder_backend: str) -> str:
+    # Embeddings of the onnx backend differ slightly, so they are cached apart
+    return encoder_name_or_path if query_encoder_backend == "torch" else f"{encoder_name_or_path}:{query_encoder_backend}"
+
+
+def build_query_cache(
+    query_log_path: str,
+    output_path: str,
+    encoder_name_or_path: str,
+    encoder_class: Encoder = None,
+    tokenizer_name: str = None,
+    device: str = None,
+    prefix: str = None,
+    query_encoder_backend: Literal["torch", "onnx"] = "torch",
+    max_queries: int = 4096,
+) -> int:
+    """
+    Encode the most frequent queries of a query log into a warm file for the query embedding cache of `init_searcher`
+
+    Parameters
+    ----------
+    query_log_path: str
+        Text file with one query per line, or JSONL file with a `query` field
+    output_path: str
+        Path of the warm file, ending in `.npz`. Pass it to `init_searcher` as `query_warm_file`,
+        or save it as `query_embeddings.npz` in the dense index directory to have it loaded by default.
+    max_queries: int
+        Number of distinct queries to encode
+
+    See `init_searcher` for remaining argument definitions. They must match those of the searcher.
+
+    Returns
+    -------
+    int
+        Number of queries in the warm file
+    """
+    encoder = CachedQueryEncoder(
+        _init_query_encoder(encoder_name_or_path, encoder_class, tokenizer_name, device, prefix, query_encoder_backend),
+        _query_encoder_name(encoder_name_or_path, query_encoder_backend),
+        max_size=max_queries,
+        encoder_class=encoder_class,
+    )
+    with open(query_log_path) as f:
+        lines = (line.rstrip("\n") for line in f)
+        queries = [json.loads(line)["query"] if query_log_path.endswith(".jsonl") else line for line in lines if line]
+    return build_query_warm_file(encoder, queries, output_path, max_queries=max_queries)
 
 
 def result_indices(
@@ -132,11 +261,40 @@ def result_indices(
     return ix
 
 
+def batch_result_indices(
+        queries: List[str],
+        num_results: int,
+        searcher: Searcher,
+        threads: int = 1,
+        ) -> List[List[int]]:
+    """
+    Get the indices of the results of many queries, searched concurrently.
+    See `spacerini.spacerini_utils.search.batch_search` for how each type of searcher is parallelized.
+    Parameters
+    ----------
+    queries : List[str]
+        The queries.
+    num_results : int
+        The number of results to return per query.
+    searcher : Searcher
+        A sparse, dense or hybrid searcher.
+    threads : int (default=1)
+        The number of threads to search with.
+
+    Returns
+    -------
+    List[List[int]]
+        The indices of the returned documents of each query, in the order of `queries`.
+    """
+    return [[int(hit.docid) for hit in hits] for hits in batch_search(searcher, queries, k=num_results, threads=threads)]
+
+
 def result_page(
         hf_dataset: Dataset,
         result_indices: List[int],
         page: int = 0,
-        results_per_page: int=10
+        results_per_page: int=10,
+        fields: List[str] = None
         ) -> Dataset:
     """
     Returns a the ith results page as a datasets.Dataset object. Nothing is loaded into memory. Call `to_pandas()` on the returned Dataset to materialize the table.
@@ -149,12 +307,49 @@ def result_page(
         The result page to return. Returns the first page by default.
     results_per_page : int (default=10)
         The number of results per page.
+    fields : list of str (default=None)
+        If set, the only columns of the page.
     
     Returns
     -------
     datasets.Dataset
         A results page.
     """
-    results = hf_dataset.select(result_indices)
-    num_result_pages = int(len(results)/results_per_page) + 1
-    return results.shard(num_result_pages, page, contiguous=True)
+    if fields is not None:
+        hf_dataset = hf_dataset.select_columns(fields)
+    return hf_dataset.select(_page_indices(result_indices, page, results_per_page))
+
+
+def hydrated_result_page(
+        hydrator: DocumentHydrator,
+        result_indices: List[int],
+        page: int = 0,
+        results_per_page: int = 10
+        ) -> List[Dict]:
+    """
+    Returns the ith results page as a list of documents, fetched in one call and cached by `hydrator`.
+    ----------
+    hydrator : DocumentHydrator
+        Source of the documents, e.g. `DocumentHydrator(hf_dataset, text_field="text")`.
+    result_indices : list of int
+        The indices of the results.
+    page: int (default=0)
+        The result page to return. Returns the first page by default.
+    results_per_page : int (default=10)
+        The number of results per page.
+
+    Returns
+    -------
+    list of dict
+        The documents of the page, with the fields of `hydrator`.
+    """
+    return hydrator.hydrate(_page_indices(result_indices, page, results_per_page))
+
+
+def _page_indices(result_indices: List[int], page: int, results_per_page: int) -> List[int]:
+    # Same pages as `Dataset.shard(num_result_pages, page, contiguous=True)`, without selecting the other pages' rows
+    num_result_pages = int(len(result_indices)/results_per_page) + 1
+    div, mod = divmod(len(result_indices), num_result_pages)
+    start = div * page + min(page, mod)
+    end = start + div + (1 if page < mod else 0)
+    return list(result_indices[start:end])
@@ -0,0 +1,298 @@
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple, TypedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Warm file of a dense index, loaded by default into the query embedding cache of its searcher
+QUERY_WARM_FILENAME = "query_embeddings.npz"
+
+
+class CacheStats(TypedDict):
+    hits: int
+    misses: int
+    hit_rate: float
+    size: int
+    max_size: int
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded cache evicting the least recently used entries, with an optional time to live
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of entries
+    ttl : float
+        Seconds after which an entry expires. If None, entries only leave the cache when evicted.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[1] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Cached value of `key`, computed and stored if missing. Concurrent misses on a key may all compute it.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> CacheStats:
+        lookups = self.hits + self.misses
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+            size=len(self._entries),
+            max_size=self.max_size,
+        )
+
+
+def normalize_query(query: str, lowercase: bool = False) -> str:
+    """
+    Normalize a query for use as a cache key: Unicode NFC, collapsed whitespace and optionally lowercase
+    """
+    query = " ".join(unicodedata.normalize("NFC", query).split())
+    return query.lower() if lowercase else query
+
+
+class CachedSearcher:
+    """
+    Wraps a searcher with an `LRUCache` of its results.
+
+    Results are keyed by the normalized query, `k`, any other search argument (e.g. the weights of
+    a hybrid searcher) and `config`, which describes how the searcher was built. Other attributes
+    are those of the wrapped searcher. Calling one of its `set_*` methods, such as `set_bm25`,
+    clears the cache.
+
+    Parameters
+    ----------
+    searcher : Searcher
+        Sparse, dense or hybrid searcher
+    max_size : int
+        Maximum number of cached queries
+    ttl : float
+        Seconds after which cached results expire
+    config : Dict[str, Any]
+        Configuration of the searcher, such as analyzer arguments and BM25 parameters. Must serialize to JSON.
+    lowercase : bool
+        If True, queries differing only in case share cache entries. Only safe if every analyzer
+        and encoder of the searcher is case-insensitive.
+    """
+
+    def __init__(
+        self,
+        searcher,
+        max_size: int = 1024,
+        ttl: Optional[float] = 3600,
+        config: Dict[str, Any] = None,
+        lowercase: bool = False,
+    ):
+        self.searcher = searcher
+        self.cache = LRUCache(max_size=max_size, ttl=ttl)
+        self.config = json.dumps(config or {}, sort_keys=True, default=str)
+        self.lowercase = lowercase
+
+    def key(self, query: str, k: int = 10, **kwargs) -> Tuple[str, str, int, str]:
+        """
+        Cache key of a search
+        """
+        return self.config, normalize_query(query, self.lowercase), k, json.dumps(kwargs, sort_keys=True, default=str)
+
+    def search(self, query: str, k: int = 10, **kwargs) -> List[Any]:
+        key = self.key(query, k, **kwargs)
+        return list(self.cache.get_or_compute(key, lambda: self.searcher.search(query, k=k, **kwargs)))
+
+    def stats(self) -> CacheStats:
+        return self.cache.stats()
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "searcher":
+            raise AttributeError(name)
+        attribute = getattr(self.searcher, name)
+        if name.startswith("set_") and callable(attribute):
+            def setter(*args, **kwargs):
+                self.cache.clear()
+                return attribute(*args, **kwargs)
+            return setter
+        return attribute
+
+
+class CachedQueryEncoder:
+    """
+    Wraps a query encoder with an `LRUCache` of query embeddings, keyed by `encoder_name`, `encoder_class`,
+    the encoder's prefix and the normalized query. Pass it to `FaissSearcher` in place of the encoder.
+
+    The cache can be warmed with a file of precomputed embeddings, see `build_query_warm_file`.
+    Entries of a warm file built with another encoder, encoder class or prefix are ignored.
+
+    Parameters
+    ----------
+    encoder : QueryEncoder
+        Encoder with an `encode(query)` method returning a 1-D array
+    encoder_name : str
+        Name or path of the encoder
+    encoder_class : str
+        Class the encoder was loaded with. Classes loading the same checkpoint can pool differently.
+    max_size : int
+        Maximum number of cached embeddings
+    warm_file : str
+        Path of a warm file to load, if it exists
+    lowercase : bool
+        If True, queries differing only in case share embeddings. Only safe with uncased encoders.
+    """
+
+    def __init__(
+        self,
+        encoder,
+        encoder_name: str = "",
+        max_size: int = 4096,
+        warm_file: str = None,
+        lowercase: bool = False,
+        encoder_class: str = None,
+    ):
+        self.encoder = encoder
+        self.namespace = json.dumps([encoder_name, encoder_class, getattr(encoder, "prefix", None)])
+        self.cache = LRUCache(max_size=max_size)
+        self.lowercase = lowercase
+        if warm_file and os.path.exists(warm_file):
+            self.load(warm_file)
+
+    def _key(self, query: str) -> str:
+        return normalize_query(query, self.lowercase)
+
+    def encode(self, query: str, **kwargs) -> np.ndarray:
+        return self.cache.get_or_compute(self._key(query), lambda: self.encoder.encode(query, **kwargs))
+
+    def encode_batch(self, queries: List[str], encode_misses: Callable[[List[str]], np.ndarray] = None) -> np.ndarray:
+        """
+        Embed queries, encoding only those missing from the cache
+
+        Parameters
+        ----------
+        queries : List[str]
+            Queries to embed
+        encode_misses : Callable
+            Function encoding a list of queries into a 2-D array. Defaults to the encoder's
+            `encode_batch` if it has one, else to encoding queries one at a time.
+        """
+        keys = [self._key(query) for query in queries]
+        embeddings = [self.cache.get(key) for key in keys]
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if misses:
+            if encode_misses is None and hasattr(self.encoder, "encode_batch"):
+                encode_misses = self.encoder.encode_batch
+            missed = [queries[i] for i in misses]
+            encoded = encode_misses(missed) if encode_misses else [self.encoder.encode(query) for query in missed]
+            for i, embedding in zip(misses, encoded):
+                embedding = np.asarray(embedding).reshape(-1)
+                self.cache.put(keys[i], embedding)
+                embeddings[i] = embedding
+        return np.vstack(embeddings)
+
+    def load(self, path: str) -> int:
+        """
+        Add the embeddings of a warm file to the cache
+
+        Returns
+        -------
+        Number of embeddings loaded
+        """
+        with np.load(path, allow_pickle=False) as warm:
+            if str(warm["namespace"]) != self.namespace:
+                logger.warning(f"Ignoring {path}: it was built with another query encoder, encoder class or prefix")
+                return 0
+            # Most frequent queries come first and are put last, so that they are evicted last
+            queries, embeddings = warm["queries"][:self.cache.max_size], warm["embeddings"][:self.cache.max_size]
+        for query, embedding in zip(queries[::-1], embeddings[::-1]):
+            self.cache.put(self._key(str(query)), embedding)
+        return len(queries)
+
+    def stats(self) -> CacheStats:
+        return self.cache.stats()
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "encoder":
+            raise AttributeError(name)
+        return getattr(self.encoder, name)
+
+
+def build_query_warm_file(
+    encoder: CachedQueryEncoder,
+    queries: Iterable[str],
+    path: str,
+    max_queries: int = 4096,
+    batch_size: int = 64,
+) -> int:
+    """
+    Encode the most frequent queries of a query log and save their embeddings as a warm file for `CachedQueryEncoder`
+
+    Parameters
+    ----------
+    encoder : CachedQueryEncoder
+        Cached encoder to warm. Its namespace is saved in the file.
+    queries : Iterable[str]
+        Query log, with repetitions
+    path : str
+        Path of the warm file, a `.npz` archive
+    max_queries : int
+        Number of distinct queries to keep
+
+    Returns
+    -------
+    Number of queries in the warm file
+    """
+    counts = Counter(normalize_query(query, encoder.lowercase) for query in queries)
+    top = [query for query, _ in counts.most_common(max_queries) if query]
+    embeddings = [encoder.encode_batch(top[i:i + batch_size]) for i in range(0, len(top), batch_size)]
+    dimension = embeddings[0].shape[1] if embeddings else 0
+    np.savez(
+        path,
+        namespace=np.array(encoder.namespace),
+        queries=np.array(top, dtype=str),
+        embeddings=np.vstack(embeddings) if embeddings else np.zeros((0, dimension), dtype=np.float32),
+    )
+    return len(top)
@@ -0,0 +1,98 @@
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+from .cache import CacheStats, LRUCache
+
+Document = Dict[str, Any]
+
+
+class DocumentHydrator:
+    """
+    Fetches the stored documents of search hits, all the hits of a search at once, and keeps hot documents in an `LRUCache`.
+    Only `fields` are kept from each document.
+
+    The source of documents can be:
+
+    - a `LuceneSearcher`: documents missing from the cache are fetched with one `batch_doc` call
+      and their raw JSON is parsed.
+    - a Hugging Face `Dataset` whose row indices are the document IDs, as for a dataset indexed by spacerini.
+      Only `fields` columns are read, and missing rows are taken in one call. A dense searcher then
+      needs no sparse index to show its results. IDs that are not row indices have no document.
+    - any other object with a `doc(docid)` method, such as an `IndexReader`. Missing documents are
+      fetched one at a time.
+
+    Parameters
+    ----------
+    source : LuceneSearcher | Dataset | IndexReader
+        Where documents are stored
+    fields : Sequence[str]
+        Fields to keep. Defaults to `id_field` and `text_field`.
+    cache_size : int
+        Maximum number of cached documents. If 0, documents are not cached.
+    threads : int
+        Number of threads `batch_doc` fetches documents with
+    id_field : str
+        Field holding the document ID. With a dataset source, it is the row index if the dataset has no such column.
+    text_field : str
+        Field holding the text of the document
+    """
+
+    def __init__(
+        self,
+        source,
+        fields: Sequence[str] = None,
+        cache_size: int = 4096,
+        threads: int = 4,
+        id_field: str = "id",
+        text_field: str = "contents",
+    ):
+        self.fields = list(fields) if fields is not None else [id_field, text_field]
+        self.id_field = id_field
+        self.text_field = text_field
+        self.cache = LRUCache(max_size=cache_size) if cache_size > 0 else None
+        self.threads = threads
+        if hasattr(source, "column_names"):
+            missing = [field for field in self.fields if field != id_field and field not in source.column_names]
+            if missing:
+                raise ValueError(f"Dataset has no {missing} column, its columns are {source.column_names}")
+            source = source.select_columns([field for field in self.fields if field in source.column_names])
+        self.source = source
+
+    def hydrate(self, docids: List[str]) -> List[Optional[Document]]:
+        """
+        Documents of `docids`, in the same order. Documents that do not exist are None.
+        """
+        docids = [str(docid) for docid in docids]
+        documents = [self.cache.get(docid) for docid in docids] if self.cache is not None else [None] * len(docids)
+        misses = list(dict.fromkeys(docid for docid, document in zip(docids, documents) if document is None))
+        if misses:
+            fetched = self._fetch(misses)
+            if self.cache is not None:
+                for docid, document in fetched.items():
+                    self.cache.put(docid, document)
+            documents = [document if document is not None else fetched.get(docid) for docid, document in zip(docids, documents)]
+        return documents
+
+    def _fetch(self, docids: List[str]) -> Dict[str, Document]:
+        if hasattr(self.source, "column_names"):
+            docids = [docid for docid in docids if docid.isdecimal() and int(docid) < len(self.source)]
+            if not docids:
+                return {}
+            rows = self.source[[int(docid) for docid in docids]]
+            documents = {docid: {column: values[i] for column, values in rows.items()} for i, docid in enumerate(docids)}
+            if self.id_field in self.fields:
+                for docid, document in documents.items():
+                    document.setdefault(self.id_field, docid)
+            return documents
+
+        if hasattr(self.source, "batch_doc"):
+            fetched = self.source.batch_doc(docids, self.threads)
+        else:
+            fetched = {docid: self.source.doc(docid) for docid in docids}
+        return {docid: self._project(json.loads(document.raw())) for docid, document in fetched.items() if document is not None}
+
+    def _project(self, document: Document) -> Document:
+        return {field: document[field] for field in self.fields if field in document}
+
+    def stats(self) -> Optional[CacheStats]:
+        return self.cache.stats() if self.cache is not None else None
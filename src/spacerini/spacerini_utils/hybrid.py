@@ -0,0 +1,224 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Literal, Optional, Sequence, TypedDict
+
+import numpy as np
+from pyserini.search import DenseSearchResult
+
+Fusion = Literal["interpolation", "rrf"]
+
+
+class HybridTimings(TypedDict):
+    sparse_ms: float
+    dense_ms: float
+    fusion_ms: float
+    total_ms: float
+
+
+class ConcurrentHybridSearcher:
+    """
+    Hybrid searcher running its sparse and dense legs concurrently, so that a search takes about as long
+    as its slower leg rather than the sum of both. It can be used in place of pyserini's `HybridSearcher`.
+
+    Candidates of both legs are fused with numpy, by either:
+
+    - `interpolation`: `alpha * sparse + dense`, or `sparse + alpha * dense` if `weight_on_dense`, as pyserini does.
+      A document missing from a leg gets that leg's lowest score. With `normalization`, the scores of each leg
+      are first min-max scaled to [0, 1], which ranks documents as pyserini's normalization does.
+    - `rrf`: reciprocal rank fusion, `1 / (rrf_k + sparse rank) + 1 / (rrf_k + dense rank)`. A document missing
+      from a leg gets nothing from it. `alpha` and `weight_on_dense` are ignored.
+
+    The duration of each leg, of the fusion and of the whole search are kept for the last search in
+    `last_timings`, and averaged over all searches by `timings`. A batch search counts as one search.
+
+    Parameters
+    ----------
+    dense_searcher : FaissSearcher
+        Dense leg
+    sparse_searcher : LuceneSearcher
+        Sparse leg
+    fusion : str
+        Default fusion, `interpolation` or `rrf`
+    alpha : float
+        Default interpolation weight
+    normalization : bool
+        Default for min-max normalization of interpolated scores
+    weight_on_dense : bool
+        Default for whether `alpha` weighs the dense leg rather than the sparse one
+    rrf_k : int
+        Rank offset of reciprocal rank fusion
+    max_workers : int
+        Number of dense legs run at once. Sparse legs run in the calling thread.
+    """
+
+    def __init__(
+        self,
+        dense_searcher,
+        sparse_searcher,
+        fusion: Fusion = "interpolation",
+        alpha: float = 0.1,
+        normalization: bool = False,
+        weight_on_dense: bool = False,
+        rrf_k: int = 60,
+        max_workers: int = 4,
+    ):
+        if fusion not in ["interpolation", "rrf"]:
+            raise ValueError(f"Unknown fusion {fusion}, use interpolation or rrf")
+        self.dense_searcher = dense_searcher
+        self.sparse_searcher = sparse_searcher
+        self.fusion = fusion
+        self.alpha = alpha
+        self.normalization = normalization
+        self.weight_on_dense = weight_on_dense
+        self.rrf_k = rrf_k
+        self.last_timings: Optional[HybridTimings] = None
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="dense-leg")
+        self._num_searches = 0
+        self._total_timings = np.zeros(4)
+        self._lock = threading.Lock()
+
+    def search(
+        self,
+        query: str,
+        k0: int = None,
+        k: int = 10,
+        alpha: float = None,
+        normalization: bool = None,
+        weight_on_dense: bool = None,
+        fusion: Fusion = None,
+    ) -> List[DenseSearchResult]:
+        """
+        Search a query, retrieving `k0` candidates from each leg (`k` by default) and returning the `k` best fused ones.
+        Arguments left to None take the searcher's defaults.
+        """
+        k0 = k0 or k
+        (dense_hits, sparse_hits), leg_timings, start_time = self._run_legs(
+            lambda: self.dense_searcher.search(query, k=k0),
+            lambda: self.sparse_searcher.search(query, k=k0),
+        )
+        hits = self.fuse(dense_hits, sparse_hits, k, alpha, normalization, weight_on_dense, fusion)
+        self._record(leg_timings, start_time)
+        return hits
+
+    def batch_search(
+        self,
+        queries: List[str],
+        qids: List[str],
+        k0: int = None,
+        k: int = 10,
+        threads: int = 1,
+        alpha: float = None,
+        normalization: bool = None,
+        weight_on_dense: bool = None,
+        fusion: Fusion = None,
+    ) -> Dict[str, List[DenseSearchResult]]:
+        """
+        Search many queries, each leg as a batch with `batch_search`, and return the fused results keyed by `qids`
+        """
+        from .search import batch_search
+
+        k0 = k0 or k
+        (dense_results, sparse_results), leg_timings, start_time = self._run_legs(
+            lambda: batch_search(self.dense_searcher, queries, k=k0, threads=threads),
+            lambda: batch_search(self.sparse_searcher, queries, k=k0, threads=threads),
+        )
+        results = {
+            qid: self.fuse(dense_hits, sparse_hits, k, alpha, normalization, weight_on_dense, fusion)
+            for qid, dense_hits, sparse_hits in zip(qids, dense_results, sparse_results)
+        }
+        self._record(leg_timings, start_time)
+        return results
+
+    def _run_legs(self, dense_leg, sparse_leg):
+        def timed(leg):
+            leg_start = time.perf_counter()
+            return leg(), time.perf_counter() - leg_start
+
+        start_time = time.perf_counter()
+        dense = self._executor.submit(timed, dense_leg)
+        sparse_hits, sparse_time = timed(sparse_leg)
+        dense_hits, dense_time = dense.result()
+        return (dense_hits, sparse_hits), (sparse_time, dense_time), start_time
+
+    def _record(self, leg_timings: Sequence[float], start_time: float) -> None:
+        total_time = time.perf_counter() - start_time
+        sparse_time, dense_time = leg_timings
+        fusion_time = total_time - max(sparse_time, dense_time)
+        timings = np.array([sparse_time, dense_time, fusion_time, total_time]) * 1000
+        self.last_timings = _to_timings(timings)
+        with self._lock:
+            self._num_searches += 1
+            self._total_timings += timings
+
+    def timings(self) -> HybridTimings:
+        """
+        Mean timings over all searches, in milliseconds
+        """
+        with self._lock:
+            means = self._total_timings / max(self._num_searches, 1)
+        return _to_timings(means)
+
+    def fuse(
+        self,
+        dense_hits: List[DenseSearchResult],
+        sparse_hits: List[DenseSearchResult],
+        k: int = 10,
+        alpha: float = None,
+        normalization: bool = None,
+        weight_on_dense: bool = None,
+        fusion: Fusion = None,
+    ) -> List[DenseSearchResult]:
+        """
+        Fuse the hits of both legs of a query and return the `k` best
+        """
+        alpha = self.alpha if alpha is None else alpha
+        normalization = self.normalization if normalization is None else normalization
+        weight_on_dense = self.weight_on_dense if weight_on_dense is None else weight_on_dense
+        fusion = fusion or self.fusion
+
+        docids, inverse = np.unique(
+            np.array([hit.docid for hit in dense_hits] + [hit.docid for hit in sparse_hits], dtype=str),
+            return_inverse=True,
+        )
+        if not len(docids):
+            return []
+        dense_rows, sparse_rows = inverse[:len(dense_hits)], inverse[len(dense_hits):]
+
+        if fusion == "rrf":
+            scores = np.zeros(len(docids))
+            scores[dense_rows] += 1 / (self.rrf_k + np.arange(1, len(dense_rows) + 1))
+            scores[sparse_rows] += 1 / (self.rrf_k + np.arange(1, len(sparse_rows) + 1))
+        elif fusion == "interpolation":
+            dense_scores = _leg_scores(len(docids), dense_rows, [hit.score for hit in dense_hits], normalization)
+            sparse_scores = _leg_scores(len(docids), sparse_rows, [hit.score for hit in sparse_hits], normalization)
+            scores = sparse_scores + alpha * dense_scores if weight_on_dense else alpha * sparse_scores + dense_scores
+        else:
+            raise ValueError(f"Unknown fusion {fusion}, use interpolation or rrf")
+
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [DenseSearchResult(docid, score) for docid, score in zip(docids[top].tolist(), scores[top].tolist())]
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+
+def _to_timings(timings: np.ndarray) -> HybridTimings:
+    sparse_ms, dense_ms, fusion_ms, total_ms = timings.tolist()
+    return HybridTimings(sparse_ms=sparse_ms, dense_ms=dense_ms, fusion_ms=fusion_ms, total_ms=total_ms)
+
+
+def _leg_scores(num_docs: int, rows: np.ndarray, scores: List[float], normalization: bool) -> np.ndarray:
+    """
+    Scores of one leg for all fused documents, with the leg's lowest score for those it did not retrieve
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if not len(scores):
+        return np.zeros(num_docs)
+    low, high = scores.min(), scores.max()
+    if normalization:
+        scores = (scores - low) / (high - low) if high > low else np.ones_like(scores)
+        low = 0.0
+    leg_scores = np.full(num_docs, low)
+    leg_scores[rows] = scores
+    return leg_scores
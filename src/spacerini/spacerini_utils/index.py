@@ -1,13 +1,43 @@
+import hashlib
+import json
 import os
 from typing import Any
 from typing import Dict
+from typing import Optional
 
 from pyserini.index.lucene import IndexReader
 
+MANIFEST_FILENAME = "spacerini_manifest.json"
+
+
+def read_index_manifest(index_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Read the manifest written next to an index at build time
+    index_path : str
+        Path to index directory
+    Returns
+    -------
+    The manifest, or None if there is none or the index changed since it was written
+    """
+    path = os.path.join(index_path, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    commits = [f for f in os.listdir(index_path) if f.startswith("segments_")]
+    if not commits:
+        return None
+    commit = max(commits, key=lambda f: int(f[len("segments_"):], 36))
+    with open(os.path.join(index_path, commit), "rb") as f:
+        checksum = hashlib.sha256(f.read()).hexdigest()
+    if commit != manifest.get("commit") or checksum != manifest.get("checksum"):
+        return None
+    return manifest
+
 
 def fetch_index_stats(index_path: str) -> Dict[str, Any]:
     """
-    Fetch index statistics
+    Fetch index statistics, from the index manifest when it is up to date
     index_path : str
         Path to index directory
     Returns
@@ -16,5 +46,8 @@ def fetch_index_stats(index_path: str) -> Dict[str, Any]:
     Dictionary Keys ==> total_terms, documents, unique_terms
     """
     assert os.path.exists(index_path), f"Index path {index_path} does not exist"
+    manifest = read_index_manifest(index_path)
+    if manifest is not None:
+        return manifest["stats"]
     index_reader = IndexReader(index_path)
     return index_reader.stats()
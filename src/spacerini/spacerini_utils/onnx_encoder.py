@@ -0,0 +1,306 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Literal, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+Pooling = Literal["cls", "mean"]
+
+DEFAULT_ONNX_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "spacerini", "onnx")
+
+# Pooling and normalization of the pyserini encoder classes the ONNX backend can replace
+ONNX_ENCODER_CLASSES = {
+    "auto": ("cls", False),
+    "sentence": ("mean", True),
+    "contriever": ("mean", False),
+}
+
+# Document encoder classes of pyserini named differently on the query side
+ONNX_ENCODER_ALIASES = {"sentence-transformers": "sentence"}
+
+DRIFT_TEXTS = [
+    "What is the capital of France?",
+    "Paris is the capital and most populous city of France.",
+    "The mitochondria is the powerhouse of the cell.",
+    "how to install python packages offline",
+    "Lucene is a search library written in Java, used by Anserini and Pyserini.",
+    "A short one.",
+    "The quick brown fox jumps over the lazy dog while the cat watches from the windowsill.",
+    "Dense retrieval encodes queries and documents into the same vector space.",
+]
+
+
+class OnnxEncoder:
+    """
+    CPU encoder running a transformer exported to ONNX, optionally with dynamic int8 quantization,
+    on ONNX Runtime. Usable as a pyserini document encoder (`encode(texts, titles=...)`) and
+    as a query encoder (`encode(query)`).
+
+    The exported model is cached under `cache_dir`, keyed by model and export settings, together with
+    the tokenizer and a `drift.json` report of the cosine similarity between its embeddings and those
+    of the original fp32 PyTorch model. If `model_name_or_path` is a directory that already holds
+    `model.onnx` or `model.int8.onnx`, it is loaded as is, without PyTorch.
+
+    Parameters
+    ----------
+    model_name_or_path : str
+        HuggingFace model name or path, or directory of an exported model
+    pooling : str
+        `cls` to embed with the first token, `mean` to average over tokens
+    l2_norm : bool
+        If True, normalize embeddings to unit length
+    prefix : str
+        Text prepended to every input, as in pyserini's encoders
+    quantize : bool
+        If True, apply dynamic int8 quantization to the exported model
+    cache_dir : str
+        Directory of exported models
+    num_threads : int
+        Number of ONNX Runtime intra-op threads. Defaults to ONNX Runtime's choice.
+    """
+
+    def __init__(
+        self,
+        model_name_or_path: str,
+        pooling: Pooling = "cls",
+        l2_norm: bool = False,
+        prefix: Optional[str] = None,
+        quantize: bool = True,
+        cache_dir: str = DEFAULT_ONNX_CACHE,
+        num_threads: Optional[int] = None,
+    ):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.model_name_or_path = model_name_or_path
+        self.pooling = pooling
+        self.l2_norm = l2_norm
+        self.prefix = prefix
+        self.quantize = quantize
+
+        model_file = "model.int8.onnx" if quantize else "model.onnx"
+        if os.path.exists(os.path.join(model_name_or_path, model_file)):
+            self.model_dir = model_name_or_path
+        else:
+            key = json.dumps([model_name_or_path, pooling, l2_norm, quantize])
+            self.model_dir = os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+            if not os.path.exists(os.path.join(self.model_dir, model_file)):
+                # Export next to the cache entry and move it in place, so concurrent exports never see a partial model
+                os.makedirs(cache_dir, exist_ok=True)
+                export_dir = tempfile.mkdtemp(dir=cache_dir, prefix=".export-")
+                export_onnx_model(model_name_or_path, export_dir, quantize=quantize)
+                try:
+                    os.rename(export_dir, self.model_dir)
+                except OSError:
+                    # Another process exported the same model first
+                    shutil.rmtree(export_dir)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(self.model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+        drift_path = os.path.join(self.model_dir, "drift.json")
+        if self.model_dir != model_name_or_path and not os.path.exists(drift_path):
+            drift = self.check_drift()
+            with open(f"{drift_path}.{os.getpid()}.tmp", "w") as f:
+                json.dump(drift, f, indent=2)
+            os.replace(f"{drift_path}.{os.getpid()}.tmp", drift_path)
+
+    def _embed(self, text: List[str], text_pair: List[str] = None, max_length: int = 256) -> np.ndarray:
+        if self.prefix is not None:
+            text = [f"{self.prefix} {t}" for t in text]
+        inputs = self.tokenizer(
+            text, text_pair, max_length=max_length, truncation=True, padding="longest",
+            return_attention_mask=True, return_tensors="np"
+        )
+        feed = {name: inputs[name].astype(np.int64) for name in self.input_names}
+        last_hidden_state = self.session.run(None, feed)[0]
+        return _pool(last_hidden_state, inputs["attention_mask"], self.pooling, self.l2_norm)
+
+    def encode(
+        self,
+        texts: Union[str, List[str]],
+        titles: List[str] = None,
+        max_length: int = 256,
+        add_sep: bool = False,
+        **kwargs
+    ) -> np.ndarray:
+        """
+        Embed documents, or a single query if `texts` is a string
+
+        Returns
+        -------
+        np.ndarray
+            A `(len(texts), dimension)` array, or a `(dimension,)` array for a single query
+        """
+        if isinstance(texts, str):
+            return self._embed([texts], max_length=max_length)[0]
+        if titles is not None and add_sep:
+            return self._embed(titles, texts, max_length=max_length)
+        if titles is not None:
+            texts = [f"{title} {text}" for title, text in zip(titles, texts)]
+        return self._embed(texts, max_length=max_length)
+
+    def encode_batch(self, queries: List[str], max_length: int = 256) -> np.ndarray:
+        """
+        Embed queries in a single forward pass
+        """
+        return self._embed(queries, max_length=max_length)
+
+    def check_drift(self, texts: List[str] = None, max_length: int = 256) -> Dict[str, float]:
+        """
+        Compare embeddings with those of the original fp32 PyTorch model
+
+        Returns
+        -------
+        Dictionary with the mean and minimum cosine similarity over `texts`
+        """
+        import torch
+        from transformers import AutoModel
+
+        texts = texts or DRIFT_TEXTS
+        model = AutoModel.from_pretrained(self.model_name_or_path).eval()
+        prefixed = [f"{self.prefix} {t}" for t in texts] if self.prefix is not None else texts
+        inputs = self.tokenizer(prefixed, max_length=max_length, truncation=True, padding="longest", return_tensors="pt")
+        with torch.inference_mode():
+            last_hidden_state = model(**inputs)[0].numpy()
+        reference = _pool(last_hidden_state, inputs["attention_mask"].numpy(), self.pooling, l2_norm=True)
+        embeddings = self.encode(texts, max_length=max_length)
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        cosine = (reference * embeddings).sum(axis=1)
+        drift = {"mean_cosine": float(cosine.mean()), "min_cosine": float(cosine.min())}
+        logger.info(f"Cosine similarity of {self.model_dir} to the fp32 model: {drift}")
+        if drift["min_cosine"] < 0.98:
+            logger.warning(f"Embeddings of {self.model_dir} drift from the fp32 model: {drift}")
+        return drift
+
+
+def init_onnx_encoder(
+    encoder_name_or_path: str,
+    encoder_class: str = None,
+    prefix: str = None,
+    **kwargs
+) -> OnnxEncoder:
+    """
+    Initialize an `OnnxEncoder` with the pooling and normalization of a pyserini encoder class
+
+    Parameters
+    ----------
+    encoder_name_or_path : str
+        HuggingFace model name or path
+    encoder_class : str
+        One of `auto`, `sentence` (or `sentence-transformers`) or `contriever`.
+        If None or `auto`, infer from `encoder_name_or_path`, defaulting to `auto`.
+    prefix : str
+        Text prepended to every input
+    kwargs
+        Passed on to `OnnxEncoder`
+
+    Returns
+    -------
+    OnnxEncoder
+    """
+    encoder_class = ONNX_ENCODER_ALIASES.get(encoder_class, encoder_class)
+    if encoder_class in [None, "auto"]:
+        encoder_class = next((c for c in ["sentence", "contriever"] if c in encoder_name_or_path.lower()), "auto")
+    if encoder_class not in ONNX_ENCODER_CLASSES:
+        raise ValueError(
+            f"The onnx backend supports the encoder classes {list(ONNX_ENCODER_CLASSES)}, not {encoder_class}"
+        )
+    pooling, l2_norm = ONNX_ENCODER_CLASSES[encoder_class]
+    return OnnxEncoder(encoder_name_or_path, pooling=pooling, l2_norm=l2_norm, prefix=prefix, **kwargs)
+
+
+def _pool(last_hidden_state: np.ndarray, attention_mask: np.ndarray, pooling: Pooling, l2_norm: bool) -> np.ndarray:
+    if pooling == "mean":
+        mask = attention_mask[..., None].astype(last_hidden_state.dtype)
+        embeddings = (last_hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    else:
+        embeddings = last_hidden_state[:, 0, :]
+    if l2_norm:
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1, norms)
+    return embeddings.astype(np.float32)
+
+
+def export_onnx_model(model_name_or_path: str, output_dir: str, quantize: bool = True, opset: int = 17) -> str:
+    """
+    Export a HuggingFace transformer to ONNX, with dynamic batch and sequence axes, and optionally
+    quantize its weights to int8. The tokenizer is saved next to the model.
+
+    Parameters
+    ----------
+    model_name_or_path : str
+        HuggingFace model name or path
+    output_dir : str
+        Directory to write `model.onnx`, `model.int8.onnx` and the tokenizer to
+    quantize : bool
+        If True, also write the dynamically quantized `model.int8.onnx`
+    opset : int
+        ONNX opset version
+
+    Returns
+    -------
+    str
+        Path of the model to load
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+    model = AutoModel.from_pretrained(model_name_or_path).eval()
+    dummy = tokenizer(["spacerini exports this model"], return_tensors="pt")
+    input_names = [name for name in ["input_ids", "attention_mask", "token_type_ids"] if name in dummy]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in [*input_names, "last_hidden_state"]}
+
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    export_kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # The dynamo exporter does not take `dynamic_axes`
+        export_kwargs["dynamo"] = False
+    class _LastHiddenState(torch.nn.Module):
+        # Takes the tokenizer outputs positionally and returns a single tensor, as the tracer expects
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs)), return_dict=False)[0]
+
+    with torch.no_grad():
+        torch.onnx.export(
+            _LastHiddenState(),
+            tuple(dummy[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            **export_kwargs
+        )
+    tokenizer.save_pretrained(output_dir)
+
+    if not quantize:
+        return fp32_path
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    int8_path = os.path.join(output_dir, "model.int8.onnx")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    logger.info(
+        f"Exported {model_name_or_path} to {output_dir}: {os.path.getsize(fp32_path) / 2**20:.1f} MB fp32, "
+        f"{os.path.getsize(int8_path) / 2**20:.1f} MB int8"
+    )
+    return int8_path
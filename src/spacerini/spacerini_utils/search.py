@@ -1,6 +1,10 @@
 import json
-from typing import List, Literal, Protocol, Tuple, TypedDict, Union
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Literal, Optional, Protocol, Tuple, TypedDict, Union
 
+import faiss
+import numpy as np
 from pyserini.analysis import get_lucene_analyzer
 from pyserini.index import IndexReader
 from pyserini.search import DenseSearchResult, JLuceneSearcherResult
@@ -9,6 +13,11 @@ from pyserini.search.faiss import FaissSearcher
 from pyserini.search.hybrid import HybridSearcher
 from pyserini.search.lucene import LuceneSearcher
 
+from .cache import QUERY_WARM_FILENAME, CachedQueryEncoder, CachedSearcher
+from .documents import DocumentHydrator
+from .hybrid import ConcurrentHybridSearcher, Fusion
+from .onnx_encoder import init_onnx_encoder
+
 EncoderClass = Literal["dkrr", "dpr", "tct_colbert", "ance", "sentence", "contriever", "auto"]
 
 
@@ -42,8 +51,20 @@ def init_searcher_and_reader(
     encoder_class: EncoderClass = None, 
     tokenizer_name: str = None,
     device: str = None,
-    prefix: str = None
-) -> Tuple[Union[FaissSearcher, HybridSearcher, LuceneSearcher], IndexReader]:
+    prefix: str = None,
+    nprobe: int = None,
+    ef_search: int = None,
+    query_encoder_backend: Literal["torch", "onnx"] = "torch",
+    cache_size: int = 0,
+    cache_ttl: float = 3600,
+    query_cache_size: int = 0,
+    query_warm_file: str = None,
+    fusion: Fusion = "interpolation",
+    documents=None,
+    document_cache_size: int = 4096,
+    id_field: str = "id",
+    text_field: str = "contents",
+) -> Tuple[Union[FaissSearcher, ConcurrentHybridSearcher, LuceneSearcher, CachedSearcher], Optional[DocumentHydrator]]:
     """
     Initialize and return an approapriate searcher
     
@@ -60,15 +81,49 @@ def init_searcher_and_reader(
     tokenizer_name: str
         Tokenizer name or path
     device: str
-        Device to load Query encoder on. 
+        Device to load Query encoder on. Defaults to the first GPU if there is one, else CPU.
     prefix: str
         Query prefix if exists
+    nprobe: int
+        Number of inverted lists visited per query by an IVF dense index. Higher is slower and more accurate.
+    ef_search: int
+        Size of the candidate list of an HNSW dense index. Higher is slower and more accurate.
+    query_encoder_backend: str
+        `torch` to run the query encoder with pyserini on `device`, or `onnx` to run an int8-quantized
+        ONNX export of it on CPU. The `onnx` backend supports the `auto`, `sentence` and `contriever` encoder classes.
+    cache_size: int
+        If positive, cache the results of this many queries, see `CachedSearcher`
+    cache_ttl: float
+        Seconds after which cached results expire
+    query_cache_size: int
+        If positive, cache the embeddings of this many queries, see `CachedQueryEncoder`
+    query_warm_file: str
+        Warm file of query embeddings loaded into the query embedding cache, see `build_query_warm_file`.
+        Defaults to `query_embeddings.npz` in `dense_index_path`, if it exists.
+    fusion: str
+        How a hybrid searcher fuses sparse and dense results, `interpolation` or `rrf`. See `ConcurrentHybridSearcher`.
+    documents: datasets.Dataset
+        Dataset whose row indices are the document IDs of the dense index. If set, dense results are
+        hydrated from it rather than from the sparse index, which is then not needed.
+    document_cache_size: int
+        Number of hydrated documents cached, see `DocumentHydrator`
+    id_field: str
+        Column of `documents` holding document IDs. Row indices are used if it has no such column.
+    text_field: str
+        Column of `documents` holding the text shown in results
     
     Returns
     -------
-    Searcher: FaissSearcher | HybridSearcher | LuceneSearcher
+    Searcher: FaissSearcher | ConcurrentHybridSearcher | LuceneSearcher
         A sparse, dense or hybrid searcher
+    DocumentHydrator:
+        Fetches the documents of dense results, None for a sparse searcher
     """
+    excluded = [
+        "cache_size", "cache_ttl", "query_cache_size", "query_warm_file", "documents", "document_cache_size",
+        "id_field", "text_field"
+    ]
+    config = {k: v for k, v in locals().items() if k not in excluded}
     reader = None
     if sparse_index_path:
         ssearcher = LuceneSearcher(sparse_index_path)
@@ -79,34 +134,68 @@ def init_searcher_and_reader(
                 ssearcher.set_bm25(bm25_k1, bm25_b)
 
     if dense_index_path:
-        encoder = init_query_encoder(
-            encoder=encoder_name_or_path,
-            encoder_class=encoder_class,
-            tokenizer_name=tokenizer_name,
-            topics_name=None,
-            encoded_queries=None,
-            device=device,
-            prefix=prefix
-        )
+        if query_encoder_backend == "onnx":
+            encoder = init_onnx_encoder(encoder_name_or_path, encoder_class, prefix=prefix)
+        else:
+            encoder = init_query_encoder(
+                encoder=encoder_name_or_path,
+                encoder_class=encoder_class,
+                tokenizer_name=tokenizer_name,
+                topics_name=None,
+                encoded_queries=None,
+                device=device or _default_device(),
+                prefix=prefix
+            )
+        if query_cache_size > 0:
+            encoder_name = encoder_name_or_path if query_encoder_backend == "torch" else f"{encoder_name_or_path}:{query_encoder_backend}"
+            encoder = CachedQueryEncoder(
+                encoder, encoder_name, max_size=query_cache_size, encoder_class=encoder_class,
+                warm_file=query_warm_file or os.path.join(dense_index_path, QUERY_WARM_FILENAME),
+            )
 
-        reader = IndexReader(sparse_index_path)
+        if documents is not None:
+            reader = DocumentHydrator(documents, cache_size=document_cache_size, id_field=id_field, text_field=text_field)
+        elif sparse_index_path:
+            reader = DocumentHydrator(ssearcher, cache_size=document_cache_size)
         dsearcher = FaissSearcher(dense_index_path, encoder)
+        _set_faiss_search_params(dsearcher.index, nprobe=nprobe, ef_search=ef_search)
 
         if sparse_index_path:
-            hsearcher = HybridSearcher(dense_searcher=dsearcher, sparse_searcher=ssearcher)
-            return hsearcher, reader
+            searcher = ConcurrentHybridSearcher(dense_searcher=dsearcher, sparse_searcher=ssearcher, fusion=fusion)
         else:
-            return dsearcher, reader
-    
-    return ssearcher, reader
+            searcher = dsearcher
+    else:
+        searcher = ssearcher
+
+    if cache_size > 0:
+        searcher = CachedSearcher(searcher, max_size=cache_size, ttl=cache_ttl, config=config)
+    return searcher, reader
+
 
+def _set_faiss_search_params(index: faiss.Index, nprobe: int = None, ef_search: int = None) -> None:
+    """
+    Set `nprobe` on IVF indexes and `ef_search` on HNSW indexes. Parameters that do not apply are ignored.
+    """
+    index = faiss.downcast_index(index)
+    if nprobe and hasattr(index, "nprobe"):
+        faiss.ParameterSpace().set_index_parameter(index, "nprobe", nprobe)
+    if ef_search and hasattr(index, "hnsw"):
+        faiss.ParameterSpace().set_index_parameter(index, "efSearch", ef_search)
+
+
+def _default_device() -> str:
+    import torch
+    return "cuda:0" if torch.cuda.is_available() else "cpu"
 
-def _search(searcher: Searcher, reader: IndexReader, query: str, num_results: int = 10) -> List[SearchResult]:
+
+def _search(searcher: Searcher, reader: Union[DocumentHydrator, IndexReader], query: str, num_results: int = 10) -> List[SearchResult]:
     """
     Parameters:
     -----------
-    searcher: FaissSearcher | HybridSearcher | LuceneSearcher
+    searcher: FaissSearcher | ConcurrentHybridSearcher | LuceneSearcher
         A sparse, dense or hybrid searcher
+    reader: DocumentHydrator | IndexReader
+        Source of the documents of dense results. All of them are fetched in one call.
     query: str
         Query for which to retrieve results
     num_results: int
@@ -116,20 +205,185 @@ def _search(searcher: Searcher, reader: IndexReader, query: str, num_results: in
     --------
     Dict:
     """
+    search_results = searcher.search(query, k=num_results)
+    return _to_search_results(reader, search_results)
+
+
+def _batch_search(
+    searcher: Searcher,
+    reader: Union[DocumentHydrator, IndexReader],
+    queries: List[str],
+    num_results: int = 10,
+    threads: int = 1,
+) -> List[List[SearchResult]]:
+    """
+    Search many queries at once, see `batch_search`
+
+    Parameters:
+    -----------
+    searcher: FaissSearcher | ConcurrentHybridSearcher | LuceneSearcher | CachedSearcher
+        A sparse, dense or hybrid searcher
+    queries: List[str]
+        Queries for which to retrieve results
+    num_results: int
+        Maximum number of results to retrieve per query
+    threads: int
+        Number of threads to search with
+
+    Returns:
+    --------
+    The results of each query, in the order of `queries`
+    """
+    return [_to_search_results(reader, hits) for hits in batch_search(searcher, queries, k=num_results, threads=threads)]
+
+
+def _to_search_results(
+    reader: Union[DocumentHydrator, IndexReader],
+    search_results: List[Union[DenseSearchResult, JLuceneSearcherResult]],
+) -> List[SearchResult]:
+    # Lucene hits carry their raw document, dense hits are hydrated together in one call
+    hydrator = reader if isinstance(reader, DocumentHydrator) else DocumentHydrator(reader, cache_size=0)
+    dense_docids = [r.docid for r in search_results if not isinstance(r, JLuceneSearcherResult)]
+    if dense_docids:
+        documents = dict(zip(dense_docids, hydrator.hydrate(dense_docids)))
+
     def _get_dict(r: Union[DenseSearchResult, JLuceneSearcherResult]):
         if isinstance(r, JLuceneSearcherResult):
-            return json.loads(r.raw)
-        elif isinstance(r, DenseSearchResult):
-            # Get document from sparse_index using index reader
-            return json.loads(reader.doc(r.docid).raw())
-    
-    search_results = searcher.search(query, k=num_results)
+            result = json.loads(r.raw)
+            return {"docid": result["id"], "text": result["contents"]}
+        result = documents[r.docid]
+        return {"docid": result.get(hydrator.id_field, r.docid), "text": result[hydrator.text_field]} if result is not None else None
+
     all_results = [
         SearchResult(
-            docid=result["id"],
-            text=result["contents"],
-            score=search_results[idx].score   
-        ) for idx, result in enumerate(map(lambda r: _get_dict(r), search_results))
+            docid=result["docid"],
+            text=result["text"],
+            score=r.score
+        ) for r, result in zip(search_results, map(_get_dict, search_results)) if result is not None
     ]
 
     return all_results
+
+
+def batch_search(
+    searcher: Searcher,
+    queries: List[str],
+    k: int = 10,
+    threads: int = 1,
+    **kwargs
+) -> List[List[Union[DenseSearchResult, JLuceneSearcherResult]]]:
+    """
+    Search many queries at once, using `threads` threads
+
+    Lucene queries are run concurrently by `LuceneSearcher.batch_search`. Dense queries are encoded
+    as a batch, or concurrently if the encoder only encodes one query at a time, and searched with
+    a single FAISS matrix search. Hybrid searches run their sparse and dense legs concurrently
+    before fusing each query's results. Queries already in the cache of a `CachedSearcher` are not searched.
+
+    Parameters:
+    -----------
+    searcher: FaissSearcher | ConcurrentHybridSearcher | LuceneSearcher | CachedSearcher
+        A sparse, dense or hybrid searcher. Other searchers are called one query per thread.
+    queries: List[str]
+        Queries for which to retrieve results
+    k: int
+        Maximum number of results to retrieve per query
+    threads: int
+        Number of threads to search with
+    kwargs
+        Passed on to the searcher, e.g. `alpha` for a hybrid searcher
+
+    Returns:
+    --------
+    The results of each query, in the order of `queries`
+    """
+    if not queries:
+        return []
+    if isinstance(searcher, CachedSearcher):
+        keys = [searcher.key(query, k, **kwargs) for query in queries]
+        results = [searcher.cache.get(key) for key in keys]
+        misses = [i for i, hits in enumerate(results) if hits is None]
+        missed_results = batch_search(searcher.searcher, [queries[i] for i in misses], k=k, threads=threads, **kwargs)
+        for i, hits in zip(misses, missed_results):
+            searcher.cache.put(keys[i], hits)
+            results[i] = hits
+        return [list(hits) for hits in results]
+
+    qids = [str(i) for i in range(len(queries))]
+    if isinstance(searcher, ConcurrentHybridSearcher):
+        results = searcher.batch_search(queries, qids, k=k, threads=threads, **kwargs)
+    elif isinstance(searcher, HybridSearcher):
+        results = _hybrid_batch_search(searcher, queries, qids, k=k, threads=threads, **kwargs)
+    elif isinstance(searcher, FaissSearcher):
+        embeddings = _encode_queries(searcher.query_encoder, queries, threads)
+        results = searcher.batch_search(embeddings, qids, k=k, threads=threads, **kwargs)
+    elif isinstance(searcher, LuceneSearcher):
+        results = searcher.batch_search(queries, qids, k=k, threads=threads, **kwargs)
+    else:
+        with ThreadPoolExecutor(threads) as executor:
+            return list(executor.map(lambda query: searcher.search(query, k=k, **kwargs), queries))
+    return [results[qid] for qid in qids]
+
+
+def _encode_queries(encoder, queries: List[str], threads: int) -> np.ndarray:
+    if isinstance(encoder, CachedQueryEncoder):
+        embeddings = encoder.encode_batch(queries, encode_misses=lambda misses: _encode_queries(encoder.encoder, misses, threads))
+        return embeddings.astype(np.float32)
+    if hasattr(encoder, "encode_batch"):
+        return np.asarray(encoder.encode_batch(queries), dtype=np.float32)
+    if getattr(encoder, "has_model", False) and all(hasattr(encoder, a) for a in ["model", "tokenizer", "device", "pooling", "l2_norm"]):
+        return _forward_queries(encoder, queries)
+    with ThreadPoolExecutor(threads) as executor:
+        return np.vstack([np.reshape(e, (1, -1)) for e in executor.map(encoder.encode, queries)]).astype(np.float32)
+
+
+def _forward_queries(encoder, queries: List[str]) -> np.ndarray:
+    """
+    Encode queries in one forward pass of a pyserini `AutoQueryEncoder`, with the same pooling as its `encode`
+    """
+    import torch
+
+    prefix = getattr(encoder, "prefix", None)
+    if prefix:
+        queries = [f"{prefix} {query}" for query in queries]
+    inputs = encoder.tokenizer(
+        queries, add_special_tokens=True, return_tensors="pt", padding="longest",
+        return_token_type_ids=False, truncation=True
+    ).to(encoder.device)
+    with torch.inference_mode():
+        outputs = encoder.model(**inputs)[0]
+    if encoder.pooling == "mean":
+        # Padding is masked out, as a query encoded on its own has none
+        mask = inputs["attention_mask"].unsqueeze(-1).to(outputs.dtype)
+        embeddings = (outputs * mask).sum(dim=1) / mask.sum(dim=1)
+    else:
+        embeddings = outputs[:, 0, :]
+    embeddings = embeddings.float().cpu().numpy()
+    if encoder.l2_norm:
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+
+def _hybrid_batch_search(
+    searcher: HybridSearcher,
+    queries: List[str],
+    qids: List[str],
+    k0: int = 10,
+    k: int = 10,
+    threads: int = 1,
+    alpha: float = 0.1,
+    normalization: bool = False,
+    weight_on_dense: bool = False,
+) -> Dict[str, List[DenseSearchResult]]:
+    with ThreadPoolExecutor(2) as executor:
+        dense = executor.submit(
+            lambda: searcher.dense_searcher.batch_search(
+                _encode_queries(searcher.dense_searcher.query_encoder, queries, threads), qids, k=k0, threads=threads
+            )
+        )
+        sparse = executor.submit(searcher.sparse_searcher.batch_search, queries, qids, k=k0, threads=threads)
+        dense_results, sparse_results = dense.result(), sparse.result()
+    return {
+        qid: searcher._hybrid_results(dense_results[qid], sparse_results[qid], alpha, k, normalization, weight_on_dense)
+        for qid in qids
+    }
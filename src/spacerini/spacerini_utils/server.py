@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, TypedDict
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import urlopen
+
+from .search import Searcher, batch_search, init_searcher_and_reader
+
+
+class BatchingStats(TypedDict):
+    queries: int
+    batches: int
+    mean_batch_size: float
+    p50_ms: float
+    p99_ms: float
+
+
+class MicroBatchSearcher:
+    """
+    Searcher that collects concurrent queries and searches them together with `batch_search`,
+    so that a dense or hybrid searcher encodes them in one forward pass and one FAISS matrix search.
+
+    A batch is searched once it holds `max_batch_size` queries or `max_wait_ms` after its first query arrived.
+    Batching runs on an asyncio event loop in a background thread: coroutines can await `search_async`
+    on that loop, and any other thread can call `search`, which blocks until its results are ready.
+    Queries asking for fewer results than others in their batch get the top of the batch's results.
+
+    Parameters
+    ----------
+    searcher : Searcher
+        Sparse, dense, hybrid or cached searcher
+    max_batch_size : int
+        Maximum number of queries searched together
+    max_wait_ms : float
+        Maximum time a query waits for others to join its batch
+    threads : int
+        Number of threads each batch is searched with
+    """
+
+    def __init__(self, searcher: Searcher, max_batch_size: int = 32, max_wait_ms: float = 5.0, threads: int = 1):
+        self.searcher = searcher
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.threads = threads
+        self.loop = asyncio.new_event_loop()
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor = ThreadPoolExecutor(1)
+        self._num_queries = 0
+        self._num_batches = 0
+        self._latencies = deque(maxlen=10_000)
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self._queue = asyncio.Queue()
+        self._batcher = self.loop.create_task(self._batch_queries())
+        self.loop.call_soon(self._started.set)
+        self.loop.run_forever()
+
+    async def search_async(self, query: str, k: int = 10) -> List[Any]:
+        """
+        Search a query as part of the next batch. Must be awaited on `self.loop`.
+        """
+        future = self.loop.create_future()
+        await self._queue.put((query, k, future, time.perf_counter()))
+        return await future
+
+    def search(self, query: str, k: int = 10) -> List[Any]:
+        return asyncio.run_coroutine_threadsafe(self.search_async(query, k), self.loop).result()
+
+    async def _batch_queries(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self.loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            queries = [query for query, _, _, _ in batch]
+            k = max(k for _, k, _, _ in batch)
+            try:
+                results = await self.loop.run_in_executor(
+                    self._executor, lambda: batch_search(self.searcher, queries, k=k, threads=self.threads)
+                )
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            self._num_queries += len(batch)
+            self._num_batches += 1
+            for (_, query_k, future, start_time), hits in zip(batch, results):
+                self._latencies.append(now - start_time)
+                if not future.done():
+                    future.set_result(hits[:query_k])
+
+    def stats(self) -> BatchingStats:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            return 1000 * latencies[min(int(p * len(latencies)), len(latencies) - 1)] if latencies else 0.0
+
+        return BatchingStats(
+            queries=self._num_queries,
+            batches=self._num_batches,
+            mean_batch_size=self._num_queries / self._num_batches if self._num_batches else 0.0,
+            p50_ms=percentile(0.5),
+            p99_ms=percentile(0.99),
+        )
+
+    def close(self) -> None:
+        async def cancel_batcher():
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+
+        asyncio.run_coroutine_threadsafe(cancel_batcher(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self._executor.shutdown()
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "searcher":
+            raise AttributeError(name)
+        return getattr(self.searcher, name)
+
+
+class SearchServer:
+    """
+    Local HTTP endpoint in front of a `MicroBatchSearcher`. Each connection is handled in its own thread,
+    so concurrent requests are batched together.
+
+    `GET /search?q=<query>&k=<k>` returns `{"query": ..., "results": [{"docid": ..., "score": ...}, ...]}`
+    and `GET /stats` returns the batching statistics. Errors are returned as `{"error": ...}`, with status 400
+    if `k` is not a positive integer and 500 if the search fails. From an app's directory,
+    `python -m spacerini_utils.server --sparse-index sparse_index` serves its index.
+
+    Parameters
+    ----------
+    searcher : MicroBatchSearcher
+        Batching searcher to serve
+    host : str
+        Address to listen on
+    port : int
+        Port to listen on. If 0, pick a free port.
+    """
+
+    def __init__(self, searcher: MicroBatchSearcher, host: str = "127.0.0.1", port: int = 8765):
+        self.searcher = searcher
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        searcher = self.searcher
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                if url.path == "/search" and params.get("q"):
+                    query, raw_k = params["q"][0], params.get("k", ["10"])[0]
+                    try:
+                        k = int(raw_k)
+                    except ValueError:
+                        k = 0
+                    if k < 1:
+                        self._send(400, {"error": f"k must be a positive integer, got {raw_k!r}"})
+                        return
+                    try:
+                        hits = searcher.search(query, k=k)
+                    except Exception as e:
+                        self._send(500, {"error": f"Search failed: {e}"})
+                        return
+                    self._send(200, {"query": query, "results": [{"docid": hit.docid, "score": float(hit.score)} for hit in hits]})
+                elif url.path == "/stats":
+                    self._send(200, searcher.stats())
+                else:
+                    self._send(404, {"error": "Use /search?q=<query>&k=<k> or /stats"})
+
+            def _send(self, status: int, body: Dict[str, Any]):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "SearchServer":
+        """
+        Serve in a background thread
+        """
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self.httpd.serve_forever()
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.searcher.close()
+
+
+def search_http(url: str, query: str, k: int = 10, timeout: float = 30) -> List[Dict[str, Any]]:
+    """
+    Query a `SearchServer`
+
+    Returns
+    -------
+    The hits, as dictionaries with the keys `docid` and `score`
+    """
+    with urlopen(f"{url}/search?{urlencode({'q': query, 'k': k})}", timeout=timeout) as response:
+        return json.loads(response.read())["results"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a searcher over HTTP, batching concurrent queries")
+    parser.add_argument("--sparse-index", type=str, help="Path to sparse index")
+    parser.add_argument("--dense-index", type=str, help="Path to dense index")
+    parser.add_argument("--encoder", type=str, help="Query encoder name or path")
+    parser.add_argument("--encoder-class", type=str, help="Query encoder class")
+    parser.add_argument("--query-encoder-backend", type=str, default="torch", choices=["torch", "onnx"])
+    parser.add_argument("--cache-size", type=int, default=1024, help="Number of queries whose results are cached")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="Maximum number of queries searched together")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Maximum time a query waits for a batch")
+    parser.add_argument("--threads", type=int, default=1, help="Number of threads each batch is searched with")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    searcher, _ = init_searcher_and_reader(
+        sparse_index_path=args.sparse_index,
+        dense_index_path=args.dense_index,
+        encoder_name_or_path=args.encoder,
+        encoder_class=args.encoder_class,
+        query_encoder_backend=args.query_encoder_backend,
+        cache_size=args.cache_size,
+    )
+    batcher = MicroBatchSearcher(searcher, args.max_batch_size, args.max_wait_ms, args.threads)
+    server = SearchServer(batcher, args.host, args.port)
+    print(f"Serving on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,17 @@ import gradio as gr
 from datasets import load_from_disk
 from pyserini.search.lucene import LuceneSearcher
 
-searcher = LuceneSearcher("index")
+from spacerini_utils.cache import CachedSearcher
+from spacerini_utils.documents import DocumentHydrator
+
+searcher = CachedSearcher(LuceneSearcher("index"), max_size=1024)
 ds = load_from_disk("data")
 NUM_PAGES = 10 # STATIC. THIS CAN'T CHANGE BECAUSE GRADIO CAN'T DYNAMICALLY CREATE COMPONENTS. 
 RESULTS_PER_PAGE = 5 
 
 TEXT_FIELD = "{{ cookiecutter.dset_text_field }}"
 METADATA_FIELD = "{{ cookiecutter.metadata_field }}"
+documents = DocumentHydrator(ds, fields=[TEXT_FIELD, METADATA_FIELD], cache_size=4096)
 
 
 def result_html(result, meta):
@@ -19,20 +23,24 @@ def result_html(result, meta):
 
 
 def format_results(results):
-    return "\n".join([result_html(result, meta) for result,meta in zip(results[TEXT_FIELD], results[METADATA_FIELD])])
+    return "\n".join([result_html(result[TEXT_FIELD], result[METADATA_FIELD]) for result in results])
+
+
+def fetch_page(ix, i):
+    return documents.hydrate([int(docid) for docid in ix[i*RESULTS_PER_PAGE:(i+1)*RESULTS_PER_PAGE]])
 
 
 def page_0(query):
     hits = searcher.search(query, k=NUM_PAGES*RESULTS_PER_PAGE)
     ix = [int(hit.docid) for hit in hits]
-    results = ds.select(ix).shard(num_shards=NUM_PAGES, index=0, contiguous=True) # no need to shard. split ix in batches instead. (would make sense if results was cacheable)
+    results = fetch_page(ix, 0)
     results = format_results(results)
     return results, [ix], gr.update(visible=True)
 
 
 def page_i(i, ix):
     ix = ix[0]
-    results = ds.select(ix).shard(num_shards=NUM_PAGES, index=i, contiguous=True)
+    results = fetch_page(ix, i)
     results = format_results(results)
     return results, [ix]
 
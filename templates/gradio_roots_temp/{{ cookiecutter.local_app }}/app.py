@@ -3,11 +3,24 @@ from typing import List, NewType, Optional, Union
 import gradio as gr
 
 from spacerini_utils.index import fetch_index_stats
-from spacerini_utils.search import _search, init_searcher, SearchResult
+from spacerini_utils.search import _search, init_searcher_and_reader, SearchResult
 
 HTML = NewType('HTML', str)
 
-searcher = init_searcher(sparse_index_path="sparse_index")
+{% if cookiecutter.encoder_name_or_path -%}
+# Hybrid search. Query embeddings pre-encoded into dense_index/query_embeddings.npz are loaded into the query cache.
+searcher, reader = init_searcher_and_reader(
+    sparse_index_path="sparse_index",
+    dense_index_path="dense_index",
+    encoder_name_or_path="{{ cookiecutter.encoder_name_or_path }}",
+    encoder_class="{{ cookiecutter.encoder_class }}",
+    query_encoder_backend="{{ cookiecutter.query_encoder_backend }}",
+    cache_size=1024,
+    query_cache_size=4096,
+)
+{%- else -%}
+searcher, reader = init_searcher_and_reader(sparse_index_path="sparse_index", cache_size=1024)
+{%- endif %}
 
 def get_docid_html(docid: Union[int, str]) -> HTML:
     {% if cookiecutter.private -%}
@@ -69,7 +82,7 @@ def process_results(results: List[SearchResult], language: str, highlight_terms:
 
 
 def search(query: str, language: str, num_results: int = 10) -> HTML:
-    results_dict = _search(searcher, query, num_results=num_results)
+    results_dict = _search(searcher, reader, query, num_results=num_results)
     return process_results(results_dict, language)
 
 
@@ -4,8 +4,18 @@ from pyserini.search.lucene import LuceneSearcher
 import json
 import time
 
+from spacerini_utils.cache import CachedSearcher
+
 st.set_page_config(page_title="{{title}}", page_icon='', layout="centered")
-searcher = LuceneSearcher('{{index_path}}')
+
+
+@st.cache_resource
+def load_searcher():
+    # Streamlit reruns this script on every interaction: keep one searcher, and its result cache, per process
+    return CachedSearcher(LuceneSearcher('{{index_path}}'), max_size=1024)
+
+
+searcher = load_searcher()
 
 
 col1, col2 = st.columns([9, 1])
@@ -0,0 +1,67 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from spacerini.bench import compare_reports, load_report
+from spacerini.bench.index import write_report
+
+
+def make_result(config, docs_per_sec, peak_rss_mb=100.0, index_size_mb=10.0):
+    return {
+        "method": "streaming",
+        "config": config,
+        "num_docs": 1000,
+        "wall_time": 1000 / docs_per_sec,
+        "docs_per_sec": docs_per_sec,
+        "peak_rss_mb": peak_rss_mb,
+        "index_size_mb": index_size_mb,
+    }
+
+
+class TestBench(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.baseline = [make_result({"n_threads": 1}, 100.0), make_result({"n_threads": 4}, 300.0)]
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_write_report(self):
+        """
+        Test that reports are written as JSON or as CSV with one column per configuration key
+        """
+        json_path = os.path.join(self.work_dir, "report.json")
+        write_report(self.baseline, json_path)
+        self.assertEqual(load_report(json_path), self.baseline)
+
+        csv_path = os.path.join(self.work_dir, "report.csv")
+        write_report(self.baseline, csv_path)
+        with open(csv_path) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([row["n_threads"] for row in rows], ["1", "4"])
+        self.assertEqual(float(rows[1]["docs_per_sec"]), 300.0)
+        with self.assertRaises(ValueError):
+            load_report(csv_path)
+
+    def test_compare_reports(self):
+        """
+        Test that slower or larger configurations are flagged as regressions
+        """
+        baseline_path = os.path.join(self.work_dir, "baseline.json")
+        with open(baseline_path, "w") as f:
+            json.dump(self.baseline, f)
+        candidate = [
+            make_result({"n_threads": 1}, 95.0),
+            make_result({"n_threads": 4}, 200.0),
+            make_result({"n_threads": 8}, 50.0),
+        ]
+        comparisons = compare_reports(baseline_path, candidate, tolerance=0.1)
+        self.assertEqual([c["config"] for c in comparisons], [{"n_threads": 1}, {"n_threads": 4}])
+        self.assertEqual([c["regression"] for c in comparisons], [False, True])
+        self.assertAlmostEqual(comparisons[1]["docs_per_sec"], 2 / 3)
+
+        larger = [make_result({"n_threads": 1}, 100.0, index_size_mb=12.0)]
+        self.assertTrue(compare_reports(self.baseline, larger)[0]["regression"])
@@ -2,11 +2,27 @@ import os
 import shutil
 from os import path
 import unittest
-from spacerini.index import fetch_index_stats, index_streaming_dataset
+import json
+import numpy as np
+from datasets import Dataset, IterableDataset
+from spacerini.index import fetch_index_stats, index_dataset_pipelined, index_json_shards, index_streaming_dataset, read_index_manifest, update_index
+from spacerini.index.embedding_cache import EmbeddingCache, cache_namespace
+from spacerini.index.embedding_store import EmbeddingStore, EmbeddingStoreWriter
+from spacerini.index.encode import padded_tokens, plan_token_batches
+from spacerini.index.index import POSITION_COLUMN, _with_positions
+from spacerini.index.resources import plan_index_resources
+from spacerini.preprocess.utils import shard_dataset
+from pyserini.index.lucene import IndexReader
 from pyserini.search.lucene import LuceneSearcher
 from typing import List
 
 
+def generate_rows(shards: List[List[str]]):
+    for shard in shards:
+        for text in shard:
+            yield {"contents": text}
+
+
 class TestIndex(unittest.TestCase):
     def setUp(self):
         self.index_path = path.join(path.dirname(__file__), "indexes")
@@ -44,6 +60,279 @@ class TestIndex(unittest.TestCase):
         self.assertEqual(index_stats["documents"], 3)
         self.assertEqual(index_stats["unique_terms"], 9)
 
+        manifest = read_index_manifest(local_index_path)
+        self.assertEqual(manifest["stats"], index_stats)
+        self.assertEqual(manifest["length_histograms"]["contents"], {"4-7": 3})
+
+    def test_index_streaming_hf_dataset_batched(self):
+        """
+        Test indexing a local dataset in batches
+        """
+        batched_index_path = path.join(self.index_path, "batched")
+        index_streaming_dataset(
+            index_path=batched_index_path,
+            dataset_name_or_path=self.dataset_name_or_path,
+            split="train",
+            column_to_index=["contents"],
+            doc_id_column="id",
+            language="en",
+            storeContents = True,
+            storeRaw = True,
+            num_rows=3,
+            batch_size=2
+        )
+
+        searcher = LuceneSearcher(batched_index_path)
+        hits = searcher.search('contents')
+        self.assertEqual(hits[0].docid, 'doc1')
+
+        index_stats = fetch_index_stats(batched_index_path)
+        self.assertEqual(index_stats["total_terms"], 11)
+        self.assertEqual(index_stats["documents"], 3)
+
+    def test_index_streaming_hf_dataset_parallel(self):
+        """
+        Test indexing a local dataset across worker processes
+        """
+        parallel_index_path = path.join(self.index_path, "parallel")
+        index_streaming_dataset(
+            index_path=parallel_index_path,
+            dataset_name_or_path=self.dataset_name_or_path,
+            split="train",
+            column_to_index=["contents"],
+            language="en",
+            storeContents = True,
+            storeRaw = True,
+            num_rows=3,
+            num_proc=2
+        )
+
+        self.assertFalse(os.path.exists(f"{parallel_index_path}.parts"))
+        searcher = LuceneSearcher(parallel_index_path)
+        self.assertEqual(sorted(searcher.doc(str(i)).contents() for i in range(3)), [
+            "contents of doc one.", "contents of document two.", "here's some text in document three."
+        ])
+
+        index_stats = fetch_index_stats(parallel_index_path)
+        self.assertEqual(index_stats["total_terms"], 11)
+        self.assertEqual(index_stats["documents"], 3)
+
+    def test_index_streaming_hf_dataset_parallel_auto_resources(self):
+        """
+        Test indexing across worker processes with planned threads and buffer
+        """
+        auto_index_path = path.join(self.index_path, "parallel_auto")
+        index_streaming_dataset(
+            index_path=auto_index_path,
+            dataset_name_or_path=self.dataset_name_or_path,
+            split="train",
+            column_to_index=["contents"],
+            doc_id_column="id",
+            storeRaw=True,
+            num_proc=2,
+            auto_resources=True
+        )
+
+        self.assertFalse(os.path.exists(f"{auto_index_path}.parts"))
+        self.assertEqual(fetch_index_stats(auto_index_path)["documents"], 3)
+
+    def test_index_streaming_hf_dataset_parallel_deduplicated(self):
+        """
+        Test that deduplicating workers give the documents of a dataset without IDs distinct positional IDs
+        """
+        dedup_index_path = path.join(self.index_path, "parallel_dedup")
+        index_streaming_dataset(
+            index_path=dedup_index_path,
+            dataset_name_or_path=self.dataset_name_or_path,
+            split="train",
+            column_to_index=["contents"],
+            storeRaw=True,
+            num_proc=2,
+            deduplicate=True
+        )
+
+        searcher = LuceneSearcher(dedup_index_path)
+        self.assertEqual(searcher.num_docs, 3)
+        self.assertEqual(sorted(searcher.doc(str(i)).contents() for i in range(3)), [
+            "contents of doc one.", "contents of document two.", "here's some text in document three."
+        ])
+
+    def test_with_positions(self):
+        """
+        Test that positions of a sharded stream are counted over the whole stream in every slice
+        """
+        ds = IterableDataset.from_generator(
+            generate_rows, gen_kwargs={"shards": [["a", "b"], ["c", "d"], ["e", "f"], ["g", "h"]]}
+        )
+        slices = [
+            [(row["contents"], row[POSITION_COLUMN]) for row in _with_positions(ds, shard_id=rank, num_shards=2)]
+            for rank in range(2)
+        ]
+        self.assertEqual(slices, [[("a", 0), ("c", 2), ("e", 4), ("g", 6)], [("b", 1), ("d", 3), ("f", 5), ("h", 7)]])
+
+    def test_index_streaming_hf_dataset_resume(self):
+        """
+        Test that resuming a checkpointed build does not duplicate documents
+        """
+        resume_index_path = path.join(self.index_path, "resume")
+        kwargs = dict(
+            index_path=resume_index_path,
+            dataset_name_or_path=self.dataset_name_or_path,
+            split="train",
+            column_to_index=["contents"],
+            doc_id_column="id",
+            storeRaw=True,
+            checkpoint_every=1
+        )
+        index_streaming_dataset(**kwargs)
+        with open(path.join(resume_index_path, "checkpoint.json")) as f:
+            checkpoint = json.load(f)
+        self.assertEqual((checkpoint["rows"], checkpoint["documents"], checkpoint["complete"]), (3, 3, True))
+
+        index_streaming_dataset(**kwargs, resume=True)
+        self.assertEqual(fetch_index_stats(resume_index_path)["documents"], 3)
+
+        # Checkpoints written before length histograms were recorded have none
+        with open(path.join(resume_index_path, "checkpoint.json"), "w") as f:
+            json.dump({"rows": 3, "documents": 3}, f)
+        index_streaming_dataset(**kwargs, resume=True)
+        self.assertEqual(fetch_index_stats(resume_index_path)["documents"], 3)
+
+    def test_index_dataset_pipelined(self):
+        """
+        Test that indexing shards as they are written matches indexing them once they are all written
+        """
+        with open(self.dataset_name_or_path) as f:
+            hf_dataset = Dataset.from_list([json.loads(line) for line in f])
+        pipelined_index_path = path.join(self.index_path, "pipelined")
+        index_dataset_pipelined(
+            hf_dataset,
+            shards_path=path.join(self.index_path, "pipelined_shards"),
+            index_path=pipelined_index_path,
+            column_to_index="contents",
+            doc_id_column="id",
+            shard_size=100,
+            num_proc=2,
+            keep_shards=False,
+            storeRaw=True
+        )
+
+        shards_path = path.join(self.index_path, "json_shards")
+        shard_dataset(hf_dataset, 100, shards_path, "contents", doc_id_column="id")
+        json_index_path = path.join(self.index_path, "json")
+        index_json_shards(shards_path, json_index_path, storeRaw=True)
+
+        def docids(index_path: str) -> List[str]:
+            reader = IndexReader(index_path)
+            return sorted(reader.convert_internal_docid_to_collection_docid(i) for i in range(reader.stats()["documents"]))
+
+        self.assertEqual(fetch_index_stats(pipelined_index_path)["documents"], fetch_index_stats(json_index_path)["documents"])
+        self.assertEqual(docids(pipelined_index_path), docids(json_index_path))
+        self.assertEqual(docids(pipelined_index_path), ["doc1", "doc2", "doc3"])
+        self.assertFalse(os.path.exists(path.join(self.index_path, "pipelined_shards")))
+
+    def test_plan_index_resources(self):
+        """
+        Test that the indexing plan fits the host and the dataset
+        """
+        plan = plan_index_resources(2**30, num_rows=10**6, memory_bytes=16 * 2**30, cpu_count=9)
+        self.assertEqual(plan["n_threads"], 8)
+        self.assertEqual(plan["memory_buffer"], "2048")
+        self.assertEqual(plan["num_shards"], 8)
+
+        small_plan = plan_index_resources("10MB", num_rows=1000, memory_bytes=2 * 2**30, cpu_count=64)
+        self.assertEqual(small_plan["n_threads"], 1)
+        self.assertEqual(small_plan["memory_buffer"], "256")
+
+    def test_plan_token_batches(self):
+        """
+        Test that documents are batched by length within the token budget
+        """
+        lengths = [10, 2, 3, 9, 2]
+        batches = plan_token_batches(lengths, max_tokens=20, max_batch_size=4)
+        self.assertEqual(batches, [[1, 4, 2], [3, 0]])
+        self.assertEqual(padded_tokens(lengths, batches), 29)
+        self.assertEqual(padded_tokens(lengths, [[0, 1], [2, 3], [4]]), 40)
+
+    def test_embedding_cache(self):
+        """
+        Test that cached embeddings are found again and the least recently used are evicted
+        """
+        cache = EmbeddingCache(path.join(self.index_path, "cache"), cache_namespace("encoder"), max_size=3 * 4 * 4)
+        cache.put(["a", "b"], np.arange(8, dtype=np.float32).reshape(2, 4))
+        vectors, found = cache.get(["b", "c"])
+        self.assertEqual(found, [True, False])
+        self.assertEqual(vectors[0].tolist(), [4, 5, 6, 7])
+
+        cache.get(["a"])
+        cache.put(["c", "d"], np.ones((2, 4), dtype=np.float32))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get(["a", "b", "c", "d"])[1], [True, False, True, True])
+        cache.close()
+
+    def test_embedding_cache_namespaces(self):
+        """
+        Test that embeddings of one checkpoint loaded by different encoder classes are kept apart
+        """
+        cache_path = path.join(self.index_path, "cache_namespaces")
+        dpr_cache = EmbeddingCache(cache_path, cache_namespace("encoder", encoder_class="dpr", pooling="cls"))
+        contriever_cache = EmbeddingCache(cache_path, cache_namespace("encoder", encoder_class="contriever", pooling="mean"))
+        dpr_cache.put(["a"], np.ones((1, 4), dtype=np.float32))
+        self.assertEqual(contriever_cache.get(["a"])[1], [False])
+        self.assertEqual(dpr_cache.get(["a"])[1], [True])
+        self.assertNotEqual(
+            cache_namespace("encoder", encoder_class="dpr", fp16=True), cache_namespace("encoder", encoder_class="dpr")
+        )
+        dpr_cache.close()
+        contriever_cache.close()
+
+    def test_embedding_store(self):
+        """
+        Test that embeddings appended in chunks are memory-mapped back with their document IDs
+        """
+        store_path = path.join(self.index_path, "store")
+        vectors = np.arange(20, dtype=np.float32).reshape(5, 4)
+        with EmbeddingStoreWriter(store_path, dimension=4, dtype="float16") as writer:
+            writer.write({"id": ["a", "b", "c"], "vector": vectors[:3]})
+            writer.write({"id": ["d", "e"], "vector": vectors[3:]})
+
+        store = EmbeddingStore(store_path)
+        self.assertEqual(len(store), 5)
+        self.assertEqual(store.vectors.dtype, np.float16)
+        self.assertEqual(store.vectors.tolist(), vectors.tolist())
+        self.assertEqual(store.docid(3), "d")
+        self.assertEqual(store.docids(1, 4), ["b", "c", "d"])
+        store.close()
+
+    def test_update_index(self):
+        """
+        Test adding, replacing and deleting documents in an existing index
+        """
+        update_index_path = path.join(self.index_path, "update")
+        kwargs = dict(
+            index_path=update_index_path,
+            split="train",
+            column_to_index=["contents"],
+            doc_id_column="id",
+            storeContents=True,
+            storeRaw=True
+        )
+        counts = update_index(dataset_name_or_path=self.dataset_name_or_path, **kwargs)
+        self.assertEqual(counts, {"added": 3, "updated": 0, "deleted": 0, "unchanged": 0})
+
+        updated_dataset_path = path.join(self.index_path, "updated_documents.jsonl")
+        with open(updated_dataset_path, "w") as f:
+            f.write(json.dumps({"id": "doc1", "contents": "contents of doc one."}) + "\n")
+            f.write(json.dumps({"id": "doc2", "contents": "new contents of document two."}) + "\n")
+            f.write(json.dumps({"id": "doc4", "contents": "a fourth document."}) + "\n")
+        counts = update_index(dataset_name_or_path=updated_dataset_path, **kwargs)
+        self.assertEqual(counts, {"added": 1, "updated": 1, "deleted": 1, "unchanged": 1})
+
+        searcher = LuceneSearcher(update_index_path)
+        self.assertEqual(searcher.num_docs, 3)
+        self.assertEqual(searcher.doc("doc2").contents(), "new contents of document two.")
+        self.assertIsNone(searcher.doc("doc3"))
+
     
     def test_index_streaming_hf_dataset_huggingface(self):
         """
@@ -0,0 +1,86 @@
+import json
+import os
+import shutil
+import unittest
+from os import path
+
+import pyarrow as pa
+from datasets import Dataset
+
+from spacerini.preprocess import MinHashDeduplicator
+from spacerini.preprocess.utils import documents_to_json, open_shard, shard_dataset
+
+
+class TestDedup(unittest.TestCase):
+    def test_near_duplicates_are_removed(self):
+        """
+        Test that near-duplicates are dropped and collapsed into the first occurrence
+        """
+        text = " ".join(f"word{i}" for i in range(200))
+        near_duplicate = text.replace("word100", "other100")
+        unrelated = " ".join(f"token{i}" for i in range(200))
+
+        deduplicator = MinHashDeduplicator()
+        keep = deduplicator.filter_batch([text, near_duplicate, unrelated], ids=["a", "b", "c"])
+
+        self.assertEqual(keep, [True, False, True])
+        self.assertEqual(deduplicator.stats["removed"], 1)
+        self.assertEqual(deduplicator.duplicates, [("b", "a")])
+
+
+class TestDocuments(unittest.TestCase):
+    def test_documents_to_json(self):
+        """
+        Test that documents are serialized as valid JSON, keeping integer IDs when some are null
+        """
+        contents = ['a "quoted"\\ word', "line\nbreak\tand \x01 control", "héllo €", None]
+        documents = pa.table({"id": pa.array([1, None, 3, 4], type=pa.int64()), "contents": contents})
+        lines = documents_to_json(documents)
+        self.assertEqual([json.loads(line) for line in lines], [
+            {"id": 1, "contents": contents[0]},
+            {"id": None, "contents": contents[1]},
+            {"id": 3, "contents": contents[2]},
+            {"id": 4, "contents": None},
+        ])
+        self.assertEqual(lines[2], '{"id":3,"contents":"héllo €"}')
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.shards_path = path.join(path.dirname(__file__), "shards")
+        self.hf_dataset = Dataset.from_dict({
+            "doc": [f"doc{i}" for i in range(20)], "text": [f"text of document {i}" for i in range(20)]
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.shards_path, ignore_errors=True)
+
+    def read_shards(self, shard_paths):
+        documents = []
+        for shard_path in shard_paths:
+            with open_shard(shard_path) as f:
+                documents.extend(json.loads(line) for line in f)
+        return documents
+
+    def test_shards_round_trip(self):
+        """
+        Test that plain and gzip shards are read back through `open_shard`
+        """
+        expected = [{"id": f"doc{i}", "contents": f"text of document {i}"} for i in range(20)]
+        for compression, extension in [(None, ".jsonl"), ("gzip", ".jsonl.gz")]:
+            shards_path = path.join(self.shards_path, str(compression))
+            shard_paths = shard_dataset(self.hf_dataset, 200, shards_path, "text", doc_id_column="doc", compression=compression)
+            self.assertGreater(len(shard_paths), 1)
+            self.assertTrue(all(shard_path.endswith(extension) for shard_path in shard_paths))
+            self.assertEqual(self.read_shards(shard_paths), expected)
+
+    def test_parallel_shards(self):
+        """
+        Test that shards written by worker processes match those written by a single process
+        """
+        serial_paths = shard_dataset(self.hf_dataset, 200, path.join(self.shards_path, "serial"), "text")
+        parallel_paths = shard_dataset(self.hf_dataset, 200, path.join(self.shards_path, "parallel"), "text", num_proc=2)
+        self.assertEqual([path.basename(p) for p in parallel_paths], [path.basename(p) for p in serial_paths])
+        for serial_path, parallel_path in zip(serial_paths, parallel_paths):
+            self.assertEqual(self.read_shards([parallel_path]), self.read_shards([serial_path]))
+        self.assertEqual(sorted(os.listdir(path.join(self.shards_path, "parallel"))), [path.basename(p) for p in serial_paths])
@@ -0,0 +1,204 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import urlopen
+
+import numpy as np
+from datasets import Dataset
+
+from spacerini.spacerini_utils.cache import QUERY_WARM_FILENAME, CachedQueryEncoder, CachedSearcher, build_query_warm_file
+from spacerini.spacerini_utils.documents import DocumentHydrator
+from spacerini.spacerini_utils.hybrid import ConcurrentHybridSearcher
+from spacerini.spacerini_utils.search import _to_search_results, batch_search
+from spacerini.spacerini_utils.server import MicroBatchSearcher, SearchServer, search_http
+
+
+class CountingSearcher:
+    def __init__(self):
+        self.calls = 0
+
+    def search(self, query, k=10, **kwargs):
+        self.calls += 1
+        return [query] * k
+
+
+class CountingEncoder:
+    prefix = None
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, query):
+        self.calls += 1
+        return np.full(4, len(query), dtype=np.float32)
+
+
+Hit = namedtuple("Hit", ["docid", "score"])
+
+
+class SlowSearcher:
+    def __init__(self, hits, delay):
+        self.hits = hits
+        self.delay = delay
+
+    def search(self, query, k=10):
+        time.sleep(self.delay)
+        return self.hits[:k]
+
+
+class HitSearcher:
+    def search(self, query, k=10, **kwargs):
+        if query == "fail":
+            raise RuntimeError("index unavailable")
+        return [Hit(f"{query} {i}", float(k - i)) for i in range(k)]
+
+
+class StoredDocument:
+    def __init__(self, docid):
+        self.docid = docid
+
+    def raw(self):
+        return json.dumps({"id": self.docid, "contents": f"document {self.docid}", "vector": [0.0] * 8})
+
+
+class DocumentSource:
+    def __init__(self):
+        self.calls = []
+
+    def batch_doc(self, docids, threads):
+        self.calls.append(docids)
+        return {docid: StoredDocument(docid) for docid in docids if docid != "missing"}
+
+
+class TestSearch(unittest.TestCase):
+    def test_cached_searcher(self):
+        """
+        Test that repeated queries are served from the cache until they are evicted or expire
+        """
+        searcher = CountingSearcher()
+        cached = CachedSearcher(searcher, max_size=2, ttl=0.5)
+        cached.search("sea  turtles", k=2)
+        self.assertEqual(cached.search(" sea turtles ", k=2), ["sea  turtles"] * 2)
+        self.assertEqual(searcher.calls, 1)
+
+        cached.search("sea turtles", k=3)
+        cached.search("whales", k=2)
+        cached.search("sea turtles", k=2)
+        self.assertEqual(searcher.calls, 4)
+        self.assertEqual(cached.stats()["hits"], 1)
+
+        time.sleep(0.6)
+        cached.search("whales", k=2)
+        self.assertEqual(searcher.calls, 5)
+
+    def test_cached_query_encoder(self):
+        """
+        Test that only queries missing from the cache are encoded
+        """
+        encoder = CountingEncoder()
+        cached = CachedQueryEncoder(encoder, "counting", max_size=8)
+        cached.encode("whales")
+        embeddings = cached.encode_batch(["whales ", "sea turtles", "whales"])
+        self.assertEqual(embeddings.shape, (3, 4))
+        self.assertEqual(embeddings[:, 0].tolist(), [6, 11, 6])
+        self.assertEqual(encoder.calls, 2)
+
+        with tempfile.TemporaryDirectory() as warm_dir:
+            warm_file = os.path.join(warm_dir, QUERY_WARM_FILENAME)
+            build_query_warm_file(CachedQueryEncoder(CountingEncoder(), "counting", encoder_class="dpr"), ["whales"], warm_file)
+            self.assertEqual(CachedQueryEncoder(encoder, "counting", encoder_class="dpr").load(warm_file), 1)
+            self.assertEqual(CachedQueryEncoder(encoder, "counting", encoder_class="contriever").load(warm_file), 0)
+
+    def test_batch_search(self):
+        """
+        Test that batch search returns results in query order and skips cached queries
+        """
+        searcher = CountingSearcher()
+        cached = CachedSearcher(searcher)
+        cached.search("whales", k=1)
+        results = batch_search(cached, ["sea turtles", "whales", "corals"], k=1, threads=2)
+        self.assertEqual(results, [["sea turtles"], ["whales"], ["corals"]])
+        self.assertEqual(searcher.calls, 3)
+
+    def test_concurrent_hybrid_searcher(self):
+        """
+        Test that both legs run concurrently and their results are fused by interpolation or reciprocal rank
+        """
+        dense = SlowSearcher([Hit("a", 0.9), Hit("b", 0.8), Hit("c", 0.1)], delay=0.2)
+        sparse = SlowSearcher([Hit("c", 12.0), Hit("d", 10.0), Hit("a", 2.0)], delay=0.2)
+        searcher = ConcurrentHybridSearcher(dense, sparse, alpha=0.5, normalization=True)
+        hits = searcher.search("sea turtles", k=4)
+        self.assertEqual([hit.docid for hit in hits], ["a", "b", "c", "d"])
+        timings = searcher.last_timings
+        self.assertGreaterEqual(timings["dense_ms"], 200)
+        # The legs overlapped if the search took less than running them one after the other
+        self.assertLess(timings["total_ms"], timings["dense_ms"] + timings["sparse_ms"])
+
+        hits = searcher.search("sea turtles", k0=3, k=2, fusion="rrf")
+        self.assertEqual([hit.docid for hit in hits], ["a", "c"])
+        self.assertAlmostEqual(hits[0].score, 1 / 61 + 1 / 63)
+        searcher.close()
+
+    def test_document_hydrator(self):
+        """
+        Test that documents missing from the cache are fetched in one call and only requested fields are kept
+        """
+        source = DocumentSource()
+        hydrator = DocumentHydrator(source, fields=["id", "contents"])
+        hydrator.hydrate(["1"])
+        documents = hydrator.hydrate(["2", "1", "missing", "3"])
+        self.assertEqual(source.calls, [["1"], ["2", "missing", "3"]])
+        self.assertEqual(documents[0], {"id": "2", "contents": "document 2"})
+        self.assertIsNone(documents[2])
+        self.assertEqual(hydrator.stats()["hits"], 1)
+
+    def test_dataset_document_hydrator(self):
+        """
+        Test that a dataset source maps row indices to documents, other IDs to None, and checks its columns up front
+        """
+        hf_dataset = Dataset.from_dict({"text": ["first", "second", "third"], "url": ["a", "b", "c"]})
+        hydrator = DocumentHydrator(hf_dataset, text_field="text")
+        documents = hydrator.hydrate(["1", "doc1", "3", "-1", "0"])
+        self.assertEqual(documents, [{"text": "second", "id": "1"}, None, None, None, {"text": "first", "id": "0"}])
+        self.assertEqual(hydrator.hydrate(["doc1"]), [None])
+
+        results = _to_search_results(hydrator, [Hit("2", 0.5), Hit("7", 0.4)])
+        self.assertEqual(results, [{"docid": "2", "text": "third", "score": 0.5}])
+        with self.assertRaises(ValueError):
+            DocumentHydrator(hf_dataset)
+
+    def test_micro_batch_searcher(self):
+        """
+        Test that concurrent queries are searched in batches and each caller gets its own results
+        """
+        searcher = MicroBatchSearcher(CountingSearcher(), max_batch_size=8, max_wait_ms=50)
+        queries = [f"query {i}" for i in range(16)]
+        with ThreadPoolExecutor(16) as executor:
+            results = list(executor.map(lambda query: searcher.search(query, k=1), queries))
+        self.assertEqual(results, [[query] for query in queries])
+        self.assertLess(searcher.stats()["batches"], len(queries))
+        searcher.close()
+
+    def test_search_server(self):
+        """
+        Test that the server answers searches over HTTP and reports bad requests and failed searches
+        """
+        server = SearchServer(MicroBatchSearcher(HitSearcher(), max_wait_ms=1), port=0).start()
+        self.assertEqual(search_http(server.url, "whales", k=2), [
+            {"docid": "whales 0", "score": 2.0}, {"docid": "whales 1", "score": 1.0}
+        ])
+        for k, status in [("ten", 400), ("-1", 400), ("0", 400), (quote("²"), 400)]:
+            with self.assertRaises(HTTPError) as error:
+                urlopen(f"{server.url}/search?q=whales&k={k}")
+            self.assertEqual(error.exception.code, status)
+        with self.assertRaises(HTTPError) as error:
+            search_http(server.url, "fail")
+        self.assertEqual(error.exception.code, 500)
+        self.assertIn("index unavailable", json.loads(error.exception.read())["error"])
+        server.close()